@@ -5,45 +5,79 @@ import signal
 import sys
 
 import src.handlers as hd
+from src.launcher import Launcher
 from src.matchbox import extinguish_tracing, ignite_tracing
+from src.options import TraceOptions, add_trace_arguments
+from src.targets import split_targets
 from src.utils import must_support_bpftrace
 
 
-def process(args: argparse.Namespace):
+def process(args: argparse.Namespace, options: TraceOptions):
     # list of tracers (type: src/tracer/Tracer)
     tracers = []
 
+    # targets of a multi-target session (more than one pid or cgroup)
+    targets = None
+
+    # runs the command of the execute mode once the tracers are attached
+    launcher = None
+
     # call handler based on user input to get the tracers
     if args.execute:
-        tracers = hd.handle_execute(
-            args.out, args.execute, args.rotate, args.rotate_size
-        )
+        launcher = Launcher(args.execute)
+        tracers = hd.handle_execute(args.out, launcher, options)
     elif args.pid:
-        tracers = hd.handle_pid(args.out, args.pid, args.rotate, args.rotate_size)
+        tracers = hd.handle_pid(args.out, args.pid, options)
+        pids = split_targets(args.pid)
+        if len(pids) > 1:
+            targets = [{"name": pid, "id": pid} for pid in pids]
     elif args.command:
-        tracers = hd.handle_command(
-            args.out, args.command, args.rotate, args.rotate_size
-        )
+        tracers = hd.handle_command(args.out, args.command, options)
     elif args.cgroup and args.filter_command:
         tracers = hd.handle_cgroup_and_command(
-            args.out, args.cgroup, args.filter_command, args.rotate, args.rotate_size
+            args.out, args.cgroup, args.filter_command, options
         )
     elif args.cgroup:
-        tracers = hd.handle_cgroup(args.out, args.cgroup, args.rotate, args.rotate_size)
+        tracers = hd.handle_cgroup(args.out, args.cgroup, options)
+        cgids = split_targets(args.cgroup)
+        if len(cgids) > 1:
+            targets = [{"name": cgid, "id": cgid} for cgid in cgids]
     else:
         logging.error("no input provided!")
         sys.exit(1)
 
-    # set the termination handlers
-    signal.signal(signal.SIGINT, extinguish_tracing(tracers=tracers))
-    signal.signal(signal.SIGTERM, extinguish_tracing(tracers=tracers))
+    # a forked command must not outlive a session that fails before releasing it
+    try:
+        # set the termination handlers
+        signal.signal(signal.SIGINT, extinguish_tracing(tracers=tracers))
+        signal.signal(signal.SIGTERM, extinguish_tracing(tracers=tracers))
+
+        # consume the tracer output for live metrics
+        live = hd.handle_live_metrics(
+            tracers, args.metrics_address, args.metrics_textfile, args.metrics_top_k
+        )
+
+        # release the command when every tracer printed its BEGIN output
+        if launcher:
+            launcher.start()
+
+        # start tracers
+        ignite_tracing(output_dir=args.out, tracers=tracers, targets=targets)
+    finally:
+        if launcher:
+            launcher.stop()
 
-    # start tracers
-    ignite_tracing(output_dir=args.out, tracers=tracers)
+    if live:
+        live.stop()
 
 
 def init_vars(args: argparse.Namespace):
     os.environ["BPFTRACE_MAX_STRLEN"] = args.max_str_len
+    # named BPFTRACE_MAX_MAP_KEYS since bpftrace 0.20
+    os.environ["BPFTRACE_MAP_KEYS_MAX"] = args.max_map_keys
+    os.environ["BPFTRACE_MAX_MAP_KEYS"] = args.max_map_keys
+    if args.perf_rb_pages:
+        os.environ["BPFTRACE_PERF_RB_PAGES"] = args.perf_rb_pages
     logging.basicConfig(
         level=logging.DEBUG if args.debug else logging.INFO,
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -64,7 +98,7 @@ def main():
     group.add_argument(
         "-p",
         "--pid",
-        help="trace an existing process using its PID (must be in running state)",
+        help="trace existing processes using their PIDs, comma separated for one session over many (must be in running state)",
     )
     group.add_argument(
         "-c", "--command", help="trace all processes by their command name"
@@ -72,7 +106,7 @@ def main():
     group.add_argument(
         "-cg",
         "--cgroup",
-        help="trace processes by their Cgroup ID (must be a valid cgroup)",
+        help="trace processes by their Cgroup IDs, comma separated for one session over many (must be valid cgroups)",
     )
 
     # optional arguments
@@ -81,37 +115,9 @@ def main():
         "--filter_command",
         help="Filter based on a command in cgroup tracing (only works with -cg|--cgroup)",
     )
-    parser.add_argument(
-        "-o",
-        "--out",
-        default="logs",
-        help="Folder path to export the tracing logs (default: logs)",
-    )
-    parser.add_argument(
-        "-mxsl",
-        "--max_str_len",
-        default="150",
-        help="bpf MAX_STRLEN in bytes (default: 150)",
-    )
-    parser.add_argument(
-        "-d",
-        "--debug",
-        action="store_true",
-        help="Enable debug mode (print debug messages)",
-    )
-    parser.add_argument(
-        "-r",
-        "--rotate",
-        action="store_true",
-        help="Enable log rotation (useful to break large tracing log output)",
-    )
-    parser.add_argument(
-        "-rs",
-        "--rotate_size",
-        type=int,
-        default=100 * 1024 * 1024,
-        help="Setting the rotate size (default is 100MB)",
-    )
+
+    # output, bpftrace and tracing options
+    add_trace_arguments(parser)
 
     # parse the arguments
     args = parser.parse_args()
@@ -122,7 +128,7 @@ def main():
     logging.info(f"configs:\n\t{vars(args)}")
 
     # start processing the input
-    process(args=args)
+    process(args=args, options=TraceOptions.from_args(args))
 
 
 if __name__ == "__main__":
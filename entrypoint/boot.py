@@ -6,24 +6,50 @@ import sys
 
 import src.handlers as hd
 from src.containers import find_pod_cgroup
+from src.daemon import PodDaemon
+from src.files import create_dir
 from src.matchbox import extinguish_tracing, ignite_tracing
+from src.options import TraceOptions, add_trace_arguments
+from src.targets import split_targets
 from src.utils import must_support_bpftrace
 
 
-def process(args: argparse.Namespace):
+def process(args: argparse.Namespace, options: TraceOptions):
     """Process user inputs."""
+    if args.daemon:
+        process_daemon(args, options)
+        return
+
+    if not (args.namespace and args.pod and args.container):
+        logging.error("-ns, -p and -c are required (or use -dm|--daemon)")
+        sys.exit(1)
 
     # extract Kubernetes data
     ns = args.namespace
-    pod = args.pod
+    pods = split_targets(args.pod)
     container = args.container
 
-    # find the cgroup
-    cgroup = find_pod_cgroup(namespace=ns, pod=pod, container=container)
-    if len(cgroup) == 0:
-        logging.error("empty cgroup returned!")
+    if len(pods) > 1 and args.filter_command:
+        logging.error("a command filter only supports a single pod")
         sys.exit(1)
 
+    # find the cgroups, more than one pod is traced in a single session
+    cgroups = []
+    for pod in pods:
+        cgroup = find_pod_cgroup(namespace=ns, pod=pod, container=container)
+        if len(cgroup) == 0:
+            logging.error("empty cgroup returned!")
+            sys.exit(1)
+        cgroups.append(cgroup)
+    cgroup = ",".join(cgroups)
+
+    targets = None
+    if len(pods) > 1:
+        targets = [
+            {"name": f"{ns}/{pod}/{container}", "id": cgid}
+            for pod, cgid in zip(pods, cgroups)
+        ]
+
     # get tracers based on input
     tracers = []
     if args.filter_command:
@@ -31,22 +57,71 @@ def process(args: argparse.Namespace):
             f"tracing {args.container}/{args.filter_command} in {args.namespace}/{args.pod}"
         )
         tracers = hd.handle_cgroup_and_command(
-            args.out, cgroup, args.filter_command, args.rotate, args.rotate_size
+            args.out, cgroup, args.filter_command, options
         )
     else:
-        logging.info(f"tracing {args.container} in {args.namespace}/{args.pod}")
-        tracers = hd.handle_cgroup(args.out, cgroup, args.rotate, args.rotate_size)
+        logging.info(f"tracing {args.container} in {args.namespace}/{','.join(pods)}")
+        tracers = hd.handle_cgroup(args.out, cgroup, options)
+
+    # set the termination handlers
+    signal.signal(signal.SIGINT, extinguish_tracing(tracers=tracers))
+    signal.signal(signal.SIGTERM, extinguish_tracing(tracers=tracers))
+
+    # consume the tracer output for live metrics
+    live = hd.handle_live_metrics(
+        tracers, args.metrics_address, args.metrics_textfile, args.metrics_top_k
+    )
+
+    # start tracers
+    ignite_tracing(output_dir=args.out, tracers=tracers, targets=targets)
+
+    if live:
+        live.stop()
+
+
+def process_daemon(args: argparse.Namespace, options: TraceOptions):
+    """Trace the pods that match the selector while they come and go."""
+    if args.filter_command or args.pod:
+        logging.error("the daemon selects pods by -ns and -l, not -p or -fc")
+        sys.exit(1)
+
+    logging.info(
+        f"tracing the pods of {args.namespace or 'every namespace'} "
+        f"with labels {args.selector or 'any'}"
+    )
+    tracers = hd.handle_pods(args.out, os.getpid(), options)
 
     # set the termination handlers
     signal.signal(signal.SIGINT, extinguish_tracing(tracers=tracers))
     signal.signal(signal.SIGTERM, extinguish_tracing(tracers=tracers))
 
+    # consume the tracer output for live metrics
+    live = hd.handle_live_metrics(
+        tracers, args.metrics_address, args.metrics_textfile, args.metrics_top_k
+    )
+
+    # the daemon writes targets.json from its start, the directory must be ready
+    create_dir(args.out)
+
+    # attach the pods to the tracers while they run
+    daemon = PodDaemon(args.out, args.namespace, args.selector, args.container)
+    daemon.start()
+
     # start tracers
-    ignite_tracing(output_dir=args.out, tracers=tracers)
+    ignite_tracing(output_dir=args.out, tracers=tracers, fresh=False)
+
+    daemon.stop()
+    if live:
+        live.stop()
 
 
 def init_vars(args: argparse.Namespace):
     os.environ["BPFTRACE_MAX_STRLEN"] = args.max_str_len
+    # named BPFTRACE_MAX_MAP_KEYS since bpftrace 0.20
+    os.environ["BPFTRACE_MAP_KEYS_MAX"] = args.max_map_keys
+    os.environ["BPFTRACE_MAX_MAP_KEYS"] = args.max_map_keys
+    if args.perf_rb_pages:
+        os.environ["BPFTRACE_PERF_RB_PAGES"] = args.perf_rb_pages
     logging.basicConfig(
         level=logging.DEBUG if args.debug else logging.INFO,
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -60,49 +135,43 @@ def main():
     )
 
     parser.add_argument(
-        "-c", "--container", required=True, help="Container name inside the pod"
+        "-c",
+        "--container",
+        help="Container name inside the pod (with --daemon: default every container)",
     )
-    parser.add_argument("-p", "--pod", required=True, help="Pod name")
     parser.add_argument(
-        "-ns", "--namespace", required=True, help="Kubernetes namespace of the Pod"
+        "-p",
+        "--pod",
+        help="Pod name, comma separated to trace many pods in one session",
     )
     parser.add_argument(
-        "-fc",
-        "--filter_command",
-        help="Specific command to trace inside the container (lower overhead)",
+        "-ns",
+        "--namespace",
+        help="Kubernetes namespace of the Pod (with --daemon: default every namespace)",
     )
     parser.add_argument(
-        "-o",
-        "--out",
-        default="logs",
-        help="Folder path to export the tracing logs (default: logs)",
-    )
-    parser.add_argument(
-        "-mxsl",
-        "--max_str_len",
-        default="150",
-        help="bpf MAX_STRLEN in bytes (default: 150)",
-    )
-    parser.add_argument(
-        "-d",
-        "--debug",
+        "-dm",
+        "--daemon",
         action="store_true",
-        help="Enable debug mode (print debug messages)",
+        help="Run as a node daemon: attach the pods that match -ns and -l when they start, detach them when they stop",
     )
     parser.add_argument(
-        "-r",
-        "--rotate",
-        action="store_true",
-        help="Enable log rotation (useful to break large tracing log output)",
+        "-l",
+        "--selector",
+        type=lambda value: [
+            label.strip() for label in value.split(",") if label.strip()
+        ],
+        help="Pod labels of the daemon, comma separated key=value pairs (e.g. app=web,tier=db)",
     )
     parser.add_argument(
-        "-rs",
-        "--rotate_size",
-        type=int,
-        default=100 * 1024 * 1024,
-        help="Setting the rotate size (default is 100MB)",
+        "-fc",
+        "--filter_command",
+        help="Specific command to trace inside the container (lower overhead)",
     )
 
+    # output, bpftrace and tracing options
+    add_trace_arguments(parser)
+
     # parse the arguments
     args = parser.parse_args()
 
@@ -112,7 +181,7 @@ def main():
     logging.info(f"configs:\n\t{vars(args)}")
 
     # start processing the input
-    process(args=args)
+    process(args=args, options=TraceOptions.from_args(args))
 
 
 if __name__ == "__main__":
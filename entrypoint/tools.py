@@ -0,0 +1,519 @@
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import sys
+from datetime import datetime, time
+from itertools import accumulate
+from typing import Optional
+
+from src.columnar import export_segments, load_columns
+from src.faults import iter_faults, summarize_faults
+from src.index import query as query_segments
+from src.parser import write_timeline
+from src.patterns import analyze, fault_accesses, io_accesses
+from src.report import build_report, follow_report
+from src.targets import pid_targets, split_by_target
+from src.timestamp import load_reference_timestamps, wall_to_nsecs
+
+
+def export(args: argparse.Namespace):
+    """Convert tracing logs into columnar files."""
+    try:
+        files = export_segments(args.input, args.out, args.format, args.tracer)
+    except (ValueError, RuntimeError) as e:
+        logging.error(f"export failed: {e}")
+        sys.exit(1)
+
+    logging.info(f"{len(files)} files exported to {args.out}")
+
+
+def faults(args: argparse.Namespace):
+    """Attribute page faults to mapped files and print the hottest files and regions."""
+    stream = iter_faults(args.input, args.tracer, args.page_size)
+    if args.csv:
+        stream = _write_faults(stream, args.csv)
+
+    summary = summarize_faults(stream, args.region_pages, args.top)
+
+    print(f"faults: {summary['total']} (anonymous or unknown: {summary['unresolved']})")
+    print("top files:")
+    for path, count in summary["files"]:
+        print(f"{count:>12} {path}")
+    print(f"top regions ({args.region_pages} pages):")
+    for (path, page), count in summary["regions"]:
+        print(f"{count:>12} {path} [{page}, {page + args.region_pages})")
+
+
+def _write_faults(stream, path: str):
+    """Write each resolved fault to a csv file while passing it through."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ts", "pid", "tid", "comm", "addr", "path", "page", "latency"])
+        for fault in stream:
+            writer.writerow(fault)
+            yield fault
+
+
+def patterns(args: argparse.Namespace):
+    """Classify the access patterns of each file or pid (sequentiality, sizes, reuse, working set)."""
+    if args.faults:
+        acc = fault_accesses(iter_faults(args.input, args.tracer, args.page_size))
+    else:
+        pattern = f"trace_{args.tracer or '*'}_*.npz"
+        paths = (
+            [args.input]
+            if os.path.isfile(args.input)
+            else sorted(glob.glob(os.path.join(args.input, pattern)))
+        )
+        if not paths:
+            logging.error(f"no exported npz files in {args.input} (run export first)")
+            sys.exit(1)
+        acc = io_accesses(load_columns(paths))
+
+    try:
+        report = analyze(acc, args.by, args.block_size, args.window, args.top)
+    except ValueError as e:
+        logging.error(f"analysis failed: {e}")
+        sys.exit(1)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"report saved to {args.out}")
+
+    total = report["total"]
+    print(
+        f"accesses: {total['accesses']}, bytes: {total['bytes']}, blocks: {total['blocks']}"
+    )
+    print(f"{'accesses':>10} {'seq':>6} {'median size':>12} {'max wss':>12}  {args.by}")
+    for group in report["groups"]:
+        # the size bucket of the median access
+        running = accumulate(group["sizes"].values())
+        median = next(
+            size
+            for size, count in zip(group["sizes"], running)
+            if count * 2 >= group["accesses"]
+        )
+        seq = "-" if group["sequential"] is None else f"{group['sequential']:.0%}"
+        print(
+            f"{group['accesses']:>10} {seq:>6} {median:>12} "
+            f"{group['working_set']['max']:>12}  {group['name']}"
+        )
+
+
+def merge(args: argparse.Namespace):
+    """Merge the logs of every tracer into one timeline in timestamp order."""
+    count = write_timeline(
+        args.input,
+        args.out,
+        args.tracers,
+        int(args.slack_ms * 1_000_000),
+        not args.keep_duplicates,
+    )
+    logging.info(f"{count} events merged into {args.out}")
+
+
+def query(args: argparse.Namespace):
+    """Print the events of a time window, pids and commands through the segment indexes."""
+    try:
+        start = _nsecs(args.start, args.input)
+        end = _nsecs(args.end, args.input)
+    except (OSError, ValueError) as e:
+        logging.error(f"invalid time window: {e}")
+        sys.exit(1)
+
+    pids = args.pids
+    if args.target:
+        tagged = pid_targets(args.input, args.tracer)
+        found = {pid for pid, name in tagged.items() if name == args.target}
+        if not found:
+            logging.error(f"no process of target {args.target} in {args.input}")
+            sys.exit(1)
+        pids = found if pids is None else found & set(pids)
+
+    out = open(args.out, "wb") if args.out else sys.stdout.buffer
+    count = 0
+    for line in query_segments(args.input, start, end, pids, args.comms, args.tracer):
+        out.write(line)
+        count += 1
+    if args.out:
+        out.close()
+
+    logging.info(f"{count} events matched")
+
+
+def report(args: argparse.Namespace):
+    """Count the calls, bytes, latency and files of every tracer over a process pool."""
+    cache_dir = None
+    if not args.no_cache and os.path.isdir(args.input):
+        cache_dir = args.cache or os.path.join(args.input, ".report_cache")
+
+    if args.follow:
+        stream = follow_report(
+            args.input, args.tracer, args.jobs, args.top, cache_dir, args.interval
+        )
+        try:
+            for result in stream:
+                print(f"--- {datetime.now().isoformat(timespec='seconds')}")
+                _print_report(result, args.out)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stream.close()
+        return
+
+    try:
+        result = build_report(args.input, args.tracer, args.jobs, args.top, cache_dir)
+    except (OSError, RuntimeError) as e:
+        logging.error(f"report failed: {e}")
+        sys.exit(1)
+    _print_report(result, args.out)
+
+
+def _print_report(result: dict, out: Optional[str]):
+    """Print the ops and files of each tracer, and write the json report."""
+    if out:
+        with open(out, "w") as f:
+            json.dump(result, f, indent=2)
+        logging.info(f"report saved to {out}")
+
+    for name, summary in result.items():
+        print(f"[{name}] {summary['segments']} segments, {summary['events']} events")
+        print(
+            f"{'calls':>12} {'errors':>8} {'unpaired':>8} {'bytes':>14} "
+            f"{'mean (us)':>10}  op"
+        )
+        for op, counts in summary["ops"].items():
+            mean = counts["latency"]["mean"]
+            mean = "-" if mean is None else f"{mean / 1000:.1f}"
+            print(
+                f"{counts['calls']:>12} {counts['errors']:>8} {counts['unpaired']:>8} "
+                f"{counts['bytes']:>14} {mean:>10}  {op}"
+            )
+        print(f"{'read bytes':>14} {'written bytes':>14} {'faults':>8}  file")
+        for file in summary["files"]:
+            print(
+                f"{file['read_bytes']:>14} {file['written_bytes']:>14} "
+                f"{file['faults']:>8}  {file['path']}"
+            )
+
+
+def split(args: argparse.Namespace):
+    """Split the logs of a multi-target session into one directory per target."""
+    try:
+        counts = split_by_target(args.input, args.out, args.tracer)
+    except (OSError, RuntimeError) as e:
+        logging.error(f"split failed: {e}")
+        sys.exit(1)
+
+    for name, count in sorted(counts.items()):
+        print(f"{count:>12} {name}")
+
+
+def _nsecs(value: Optional[str], output_dir: str) -> Optional[int]:
+    """Convert nsecs, a datetime or a time of the session day into bpftrace nsecs."""
+    if value is None or value.isdigit():
+        return None if value is None else int(value)
+
+    ref = load_reference_timestamps(
+        output_dir if os.path.isdir(output_dir) else os.path.dirname(output_dir)
+    )
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        day = datetime.fromtimestamp(ref["ref_wall"]).date()
+        moment = datetime.combine(day, time.fromisoformat(value))
+    return wall_to_nsecs(ref, moment.timestamp())
+
+
+def init_vars(args: argparse.Namespace):
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+
+def main():
+    # create an argument parser
+    parser = argparse.ArgumentParser(
+        description="Post-processing tools for FLAK tracing logs."
+    )
+    parser.add_argument(
+        "-d",
+        "--debug",
+        action="store_true",
+        help="Enable debug mode (print debug messages)",
+    )
+    commands = parser.add_subparsers(dest="tool", required=True)
+
+    # export command
+    cmd = commands.add_parser(
+        "export", help="convert tracing logs into dictionary-encoded columnar files"
+    )
+    cmd.add_argument(
+        "-i",
+        "--input",
+        default="logs",
+        help="Tracing output directory or a single log file (default: logs)",
+    )
+    cmd.add_argument(
+        "-o",
+        "--out",
+        default="columnar",
+        help="Folder path to export the columnar files (default: columnar)",
+    )
+    cmd.add_argument(
+        "-f",
+        "--format",
+        choices=["npz", "parquet", "arrow"],
+        default="npz",
+        help="Output format, parquet and arrow require pyarrow (default: npz)",
+    )
+    cmd.add_argument(
+        "-t", "--tracer", help="Only export one tracer (e.g. io or memory)"
+    )
+    cmd.set_defaults(func=export)
+
+    # faults command
+    cmd = commands.add_parser(
+        "faults", help="attribute page faults to mapped files and page offsets"
+    )
+    cmd.add_argument(
+        "-i",
+        "--input",
+        default="logs",
+        help="Tracing output directory or a single log file (default: logs)",
+    )
+    cmd.add_argument(
+        "-t",
+        "--tracer",
+        help="Only read one tracer (memory, or all in unified mode)",
+    )
+    cmd.add_argument(
+        "-ps",
+        "--page_size",
+        type=int,
+        default=4096,
+        help="Page size of the traced machine (default: 4096)",
+    )
+    cmd.add_argument(
+        "-rp",
+        "--region_pages",
+        type=int,
+        default=256,
+        help="Number of pages per reported region (default: 256)",
+    )
+    cmd.add_argument(
+        "-n", "--top", type=int, default=20, help="Number of files and regions to print"
+    )
+    cmd.add_argument("--csv", help="Also write every resolved fault into this csv file")
+    cmd.set_defaults(func=faults)
+
+    # patterns command
+    cmd = commands.add_parser(
+        "patterns",
+        help="classify access patterns (sequentiality, I/O sizes, miss ratio curves, working set)",
+    )
+    cmd.add_argument(
+        "-i",
+        "--input",
+        default="columnar",
+        help="Exported columnar directory or npz file, or the tracing output directory with --faults (default: columnar)",
+    )
+    cmd.add_argument(
+        "-t", "--tracer", help="Only read one tracer (e.g. io, or all in unified mode)"
+    )
+    cmd.add_argument(
+        "--faults",
+        action="store_true",
+        help="Analyze the page faults of the tracing logs instead of the io calls",
+    )
+    cmd.add_argument(
+        "--by",
+        choices=["file", "pid"],
+        default="file",
+        help="Group the accesses by file or pid (default: file)",
+    )
+    cmd.add_argument(
+        "-b",
+        "--block_size",
+        type=int,
+        default=4096,
+        help="Block size of the reuse and working set analysis (default: 4096)",
+    )
+    cmd.add_argument(
+        "-w",
+        "--window",
+        type=float,
+        default=60.0,
+        help="Working set window in seconds (default: 60)",
+    )
+    cmd.add_argument(
+        "-ps",
+        "--page_size",
+        type=int,
+        default=4096,
+        help="Page size of the traced machine, with --faults (default: 4096)",
+    )
+    cmd.add_argument(
+        "-n", "--top", type=int, default=20, help="Number of files or pids to report"
+    )
+    cmd.add_argument("-o", "--out", help="Write the full json report into this file")
+    cmd.set_defaults(func=patterns)
+
+    # merge command
+    cmd = commands.add_parser(
+        "merge", help="merge the logs of every tracer into one ordered timeline"
+    )
+    cmd.add_argument(
+        "-i",
+        "--input",
+        default="logs",
+        help="Tracing output directory (default: logs)",
+    )
+    cmd.add_argument(
+        "-o",
+        "--out",
+        default="timeline.log",
+        help="Timeline file path (default: timeline.log)",
+    )
+    cmd.add_argument(
+        "-t",
+        "--tracers",
+        type=lambda s: [t.strip() for t in s.split(",") if t.strip()],
+        help="Comma separated tracers to merge (default: all)",
+    )
+    cmd.add_argument(
+        "-s",
+        "--slack_ms",
+        type=float,
+        default=10.0,
+        help="Maximum disorder of a log, and distance of duplicate events in ms (default: 10)",
+    )
+    cmd.add_argument(
+        "--keep_duplicates",
+        action="store_true",
+        help="Keep the metadata events that more than one tracer logged",
+    )
+    cmd.set_defaults(func=merge)
+
+    # query command
+    cmd = commands.add_parser(
+        "query", help="print the events of a time window, pids or commands"
+    )
+    cmd.add_argument(
+        "-i",
+        "--input",
+        default="logs",
+        help="Tracing output directory or a single log file (default: logs)",
+    )
+    cmd.add_argument("-t", "--tracer", help="Only read one tracer (e.g. io or memory)")
+    cmd.add_argument(
+        "-s",
+        "--start",
+        help="Window start: nsecs, a datetime (2024-05-01 14:02) or a time of the session day (14:02)",
+    )
+    cmd.add_argument("-e", "--end", help="Window end, in the formats of --start")
+    cmd.add_argument(
+        "-p",
+        "--pids",
+        type=lambda s: [int(p) for p in s.split(",") if p.strip()],
+        help="Comma separated pids",
+    )
+    cmd.add_argument(
+        "-c",
+        "--comms",
+        type=lambda s: [c.strip() for c in s.split(",") if c.strip()],
+        help="Comma separated process commands",
+    )
+    cmd.add_argument(
+        "-tg",
+        "--target",
+        help="Only the processes of this target of a multi-target session (a name in targets.json)",
+    )
+    cmd.add_argument(
+        "-o", "--out", help="Write the events into this file (default: stdout)"
+    )
+    cmd.set_defaults(func=query)
+
+    # report command
+    cmd = commands.add_parser(
+        "report", help="count calls, bytes, latency and files in parallel over segments"
+    )
+    cmd.add_argument(
+        "-i",
+        "--input",
+        default="logs",
+        help="Tracing output directory or a single log file (default: logs)",
+    )
+    cmd.add_argument("-t", "--tracer", help="Only read one tracer (e.g. io or memory)")
+    cmd.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes (default: one per cpu)",
+    )
+    cmd.add_argument(
+        "-n", "--top", type=int, default=20, help="Number of commands and files to keep"
+    )
+    cmd.add_argument(
+        "-c",
+        "--cache",
+        help="Folder of the cached partial reports (default: <input>/.report_cache)",
+    )
+    cmd.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Read every segment again, and do not write the cache",
+    )
+    cmd.add_argument(
+        "-f",
+        "--follow",
+        action="store_true",
+        help="Keep reading the new data of a running session (like tail -F)",
+    )
+    cmd.add_argument(
+        "-iv",
+        "--interval",
+        type=float,
+        default=2.0,
+        help="Seconds between two refreshes with --follow (default: 2)",
+    )
+    cmd.add_argument("-o", "--out", help="Write the full json report into this file")
+    cmd.set_defaults(func=report)
+
+    # split command
+    cmd = commands.add_parser(
+        "split", help="split the logs of a multi-target session per target (pod)"
+    )
+    cmd.add_argument(
+        "-i",
+        "--input",
+        default="logs",
+        help="Tracing output directory or a single log file (default: logs)",
+    )
+    cmd.add_argument(
+        "-o",
+        "--out",
+        default="targets",
+        help="Folder path of the target directories (default: targets)",
+    )
+    cmd.add_argument("-t", "--tracer", help="Only read one tracer (e.g. io or memory)")
+    cmd.set_defaults(func=split)
+
+    # parse the arguments
+    args = parser.parse_args()
+
+    # init variables
+    init_vars(args=args)
+
+    # run the selected tool
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
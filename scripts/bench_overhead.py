@@ -0,0 +1,513 @@
+# file: scripts/bench_overhead.py
+# measuring what tracing costs, in two tiers:
+#   kernel: runs the tests/toys workloads untraced and under each mode, output style
+#           and rotation setting (root and bpftrace required)
+#   userspace: drives rotation, parsing and analysis with synthetic logs in the
+#              format of the templates (no root, for CI)
+# run: sudo PYTHONPATH=. python3 scripts/bench_overhead.py kernel [-s 16M,256M] [-o results.json]
+#      PYTHONPATH=. python3 scripts/bench_overhead.py userspace [-n lines] [-o results.json]
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from src.parser import iter_calls, list_segments, open_segment
+from src.render import CONFIG_PATH, import_json, load_probes
+
+TOYS_DIR = os.path.join("tests", "toys")
+
+# app.py options of each output style and rotation setting
+STYLES = {
+    "default": [],
+    "paired": ["-pa"],
+    "unified": ["-u"],
+    "aggregate": ["-ag"],
+}
+ROTATIONS = {
+    "off": [],
+    "rotate": ["-r", "-rs", str(64 * 1024 * 1024)],
+    "compress": ["-r", "-rs", str(64 * 1024 * 1024), "-cz"],
+}
+
+# the launcher logs the runtime of the command it released
+_EXITED = re.compile(r"command exited: (-?\d+) \((\d+\.\d+)s\)")
+_LOST = re.compile(rb"Lost (\d+) events")
+_ATTACHED = re.compile(r"\[(\w+)\] probes attached in")
+
+
+def parse_size(value: str) -> int:
+    """Parse a size with an optional K, M or G suffix (e.g. 64M)."""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    value = value.strip().upper()
+    if value[-1:] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def split_list(value: str) -> list[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def run_waited(cmd: list[str], **kwargs) -> tuple[int, float, object, str]:
+    """Run a command and collect the resources of its whole process tree.
+
+    :return: exit code, wall seconds, rusage, stderr text
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, **kwargs
+    )
+    stderr = proc.stderr.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, time.perf_counter() - start, usage, stderr
+
+
+def cpu_seconds(usage) -> float:
+    return usage.ru_utime + usage.ru_stime
+
+
+def output_stats(out_dir: str) -> dict:
+    """Count the lines, bytes and lost events of a tracing output directory."""
+    lines, size, lost = 0, 0, 0
+    for segment in list_segments(out_dir):
+        size += os.path.getsize(segment)
+        with open_segment(segment) as f:
+            while chunk := f.read(1024 * 1024):
+                lines += chunk.count(b"\n")
+                lost += sum(int(n) for n in _LOST.findall(chunk))
+
+    stats = {}
+    try:
+        with open(os.path.join(out_dir, "stats.json")) as f:
+            stats = json.load(f)["tracers"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    return {
+        "events": lines,
+        "bytes_written": size,
+        # rotate mode counts the reports of stderr too
+        "lost_events": max(lost, sum(t.get("lost_events", 0) for t in stats.values())),
+        "peak_rss_bytes": max(
+            [t.get("peak_rss_bytes", 0) for t in stats.values()], default=0
+        ),
+        "attach_seconds": max(
+            [t.get("attach_seconds", 0) for t in stats.values()], default=0
+        ),
+    }
+
+
+def wait_attached(
+    out_dir: str, count: int, logs: list[str], timeout: float = 60.0
+) -> bool:
+    """Wait for the BEGIN line of every tracer.
+
+    Rotate tracers log it, the BEGIN line of the others is in their first log.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        ready = {m.group(1) for line in logs if (m := _ATTACHED.search(line))}
+        for name in os.listdir(out_dir) if os.path.isdir(out_dir) else []:
+            if name.startswith("trace_") and name.endswith("_0.log"):
+                with open(os.path.join(out_dir, name), "rb") as f:
+                    if b" START tracing events " in f.read(4096):
+                        ready.add(name)
+        if len(ready) >= count:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def traced_run(
+    workload: list[str], mode: str, style: str, rotation: str, out_dir: str
+) -> dict:
+    """Run a workload once under FLAK.
+
+    execute: app.py -ex launches the workload once every tracer is attached.
+    command: app.py -c traces the workload by name, it starts once attached.
+    """
+    app = [sys.executable, os.path.join("entrypoint", "app.py"), "-o", out_dir]
+    app += STYLES[style] + ROTATIONS[rotation]
+    env = dict(os.environ, PYTHONPATH=".")
+    tracers = 1 if style in ("unified", "aggregate") else 2
+
+    if mode == "execute":
+        code, _, usage, stderr = run_waited(app + ["-ex", " ".join(workload)], env=env)
+        match = _EXITED.search(stderr)
+        if code != 0 or match is None:
+            raise RuntimeError(f"traced run failed ({code}): {stderr[-2000:]}")
+        seconds = float(match.group(2))
+        workload_cpu = None  # the workload is in the tree of app.py
+    else:
+        proc = subprocess.Popen(
+            app + ["-c", os.path.basename(workload[0])],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        logs = []
+        threading.Thread(target=lambda: logs.extend(proc.stderr), daemon=True).start()
+        if not wait_attached(out_dir, tracers, logs):
+            proc.kill()
+            proc.wait()
+            raise RuntimeError("tracers did not attach")
+        code, seconds, wusage, _ = run_waited(workload)
+        workload_cpu = cpu_seconds(wusage)
+        proc.send_signal(signal.SIGINT)
+        _, _, usage = os.wait4(proc.pid, 0)
+
+    return {
+        "seconds": seconds,
+        "cpu_seconds": cpu_seconds(usage),
+        "workload_cpu_seconds": workload_cpu,
+        "max_rss_bytes": usage.ru_maxrss * 1024,
+        **output_stats(out_dir),
+    }
+
+
+def bench_kernel(args: argparse.Namespace):
+    """Run the toys untraced and traced, and report the overhead of each setting."""
+    if os.geteuid() != 0 or shutil.which("bpftrace") is None:
+        print("the kernel tier requires root and bpftrace", file=sys.stderr)
+        sys.exit(3)
+
+    subprocess.run(["make", "-s", "-C", TOYS_DIR, "all"], check=True)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            source = os.path.join(tmp, f"source-{size}")
+            with open(source, "wb") as f:
+                for _ in range(0, size, 1 << 20):
+                    f.write(os.urandom(min(1 << 20, size)))
+
+            for toy in args.workloads:
+                binary = os.path.abspath(os.path.join(TOYS_DIR, "bin", toy))
+                workload = [binary, source, os.path.join(tmp, "dest")]
+
+                base = [run_waited(workload) for _ in range(args.repeat)]
+                base_seconds = statistics.median(b[1] for b in base)
+                base_cpu = statistics.median(cpu_seconds(b[2]) for b in base)
+                print(f"\n{toy} {size} bytes: untraced {base_seconds:.3f}s")
+                print(
+                    f"{'mode':>8} {'style':>9} {'rotation':>8} {'slowdown':>8} "
+                    f"{'events/s':>10} {'lost':>8} {'cpu s':>7} {'rss MB':>7} "
+                    f"{'written MB':>10}"
+                )
+
+                for mode in args.modes:
+                    for style in args.styles:
+                        for rotation in args.rotations:
+                            runs = []
+                            for i in range(args.repeat):
+                                out_dir = os.path.join(tmp, f"out-{i}")
+                                runs.append(
+                                    traced_run(workload, mode, style, rotation, out_dir)
+                                )
+                                shutil.rmtree(out_dir, ignore_errors=True)
+
+                            run = min(runs, key=lambda r: r["seconds"])
+                            seconds = statistics.median(r["seconds"] for r in runs)
+                            # tracer cpu: the tree of app.py without the workload
+                            workload_cpu = run["workload_cpu_seconds"]
+                            tracer_cpu = run["cpu_seconds"] - (
+                                base_cpu if workload_cpu is None else 0
+                            )
+                            rss = max(run["peak_rss_bytes"], run["max_rss_bytes"])
+                            result = {
+                                "workload": toy,
+                                "size": size,
+                                "mode": mode,
+                                "style": style,
+                                "rotation": rotation,
+                                "untraced_seconds": base_seconds,
+                                "seconds": seconds,
+                                "slowdown": seconds / base_seconds,
+                                "events": run["events"],
+                                "events_per_second": run["events"] / seconds,
+                                "lost_events": run["lost_events"],
+                                "tracer_cpu_seconds": tracer_cpu,
+                                "peak_rss_bytes": rss,
+                                "bytes_written": run["bytes_written"],
+                                "attach_seconds": run["attach_seconds"],
+                            }
+                            results.append(result)
+                            print(
+                                f"{mode:>8} {style:>9} {rotation:>8} "
+                                f"{result['slowdown']:>7.2f}x "
+                                f"{result['events_per_second']:>10,.0f} "
+                                f"{result['lost_events']:>8} {tracer_cpu:>7.2f} "
+                                f"{rss / 2**20:>7.1f} "
+                                f"{result['bytes_written'] / 2**20:>10.1f}"
+                            )
+
+    save(args.out, results)
+
+
+class SyntheticLog:
+    """SyntheticLog writes trace logs in the format of the bpftrace templates.
+
+    The probe lines are built from probes.json, so the generator follows the
+    templates. A few processes open files, read and write them (sequential
+    and random offsets), map them and fault on their pages, and close them.
+    """
+
+    def __init__(self, paired: bool = False, processes: int = 4, seed: int = 1):
+        """SyntheticLog constructor.
+
+        :param paired: write {PA op} lines instead of {EN op} and {EX op} pairs
+        :param processes: number of traced processes
+        :param seed: seed of the random choices
+        """
+        cfg = import_json(CONFIG_PATH)
+        table = load_probes(
+            os.path.join(cfg["templates_dir"], cfg["sources_dir"], cfg["probes"])
+        )
+        self._probes = {probe["name"]: probe for probe in table}
+        self._paired = paired
+        self._rand = random.Random(seed)
+        self._pids = [4312 + i * 17 for i in range(processes)]
+        self._ts = 1_000_000_000
+
+    def __call(self, pid: int, op: str, values: dict, ret: int, latency: int) -> str:
+        """Format one call in the EN/EX or the PA format of the templates."""
+        probe = self._probes.get(op)
+        head = f"{{pid={pid} tid={pid} proc=bench{pid % 10}}}"
+        if probe is None:  # page_fault_user is not a syscall probe
+            fields = " ".join(f"{key}={value}" for key, value in values.items())
+        else:
+            fields = " ".join(f"{key}={values[key]}" for key, _, _ in probe["args"])
+
+        self._ts += self._rand.randint(200, 2000)
+        if self._paired:
+            done = f"ret={ret} latency={latency}" if probe else f"latency={latency}"
+            return f"{self._ts} {head}{{PA {op}}}{{{fields} {done}}}\n"
+
+        enter = f"{self._ts} {head}{{EN {op}}}{{{fields}}}\n"
+        self._ts += latency
+        done = f"ret={ret}" if probe else f"latency={latency}"
+        return enter + f"{self._ts} {head}{{EX {op}}}{{{done}}}\n"
+
+    def __session(self, pid: int) -> list[str]:
+        """One file session of a process: open, io or mmap with faults, close."""
+        rand = self._rand
+        fd = rand.randint(3, 64)
+        path = f"/data/db/{pid}/{rand.randint(0, 255):04d}.dat"
+        lines = [self.__call(pid, "openat", {"fname": path}, fd, 3000)]
+
+        if rand.random() < 0.2:
+            length, addr = 1 << 20, 0x7F0000000000 + rand.randint(0, 1 << 20) * 4096
+            mapping = {"fd": fd, "addr": 0, "len": length, "off": 0}
+            lines.append(self.__call(pid, "mmap", mapping, addr, 4000))
+            for _ in range(rand.randint(4, 64)):
+                page = addr + rand.randrange(0, length, 4096)
+                lines.append(
+                    self.__call(pid, "page_fault_user", {"addr": page}, 0, 900)
+                )
+            lines.append(
+                self.__call(pid, "munmap", {"addr": addr, "len": length}, 0, 2000)
+            )
+        else:
+            sequential = rand.random() < 0.7
+            off = 0
+            for _ in range(rand.randint(8, 256)):
+                op = rand.choice(("read", "pread64", "write", "pwrite64"))
+                count = rand.choice((4096, 8192, 16384, 131072))
+                if not sequential:
+                    off = rand.randrange(0, 1 << 30, 4096)
+                values = {"fd": fd, "count": count, "off": off}
+                lines.append(self.__call(pid, op, values, count, count // 4 + 500))
+                off += count
+
+        lines.append(self.__call(pid, "close", {"fd": fd}, 0, 800))
+        return lines
+
+    def write(self, path: str, lines: int) -> int:
+        """Write at least `lines` lines (whole file sessions).
+
+        :return: the number of lines written
+        """
+        written = 0
+        with open(path, "w") as f:
+            f.write("1970-01-01 00:00:00 START tracing events for 4 PIDs\n")
+            while written < lines:
+                chunk = self.__session(self._rand.choice(self._pids))
+                written += sum(part.count("\n") for part in chunk)
+                f.writelines(chunk)
+        return written
+
+
+def stage(results: list, name: str, lines: int, size: int, func):
+    """Time one userspace stage and print its throughput."""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    results.append(
+        {
+            "stage": name,
+            "seconds": elapsed,
+            "lines_per_second": lines / elapsed,
+            "bytes_per_second": size / elapsed,
+        }
+    )
+    print(
+        f"{name:>12}: {lines / elapsed:>12,.0f} lines/s "
+        f"{size / elapsed / 2**20:>8.1f} MB/s ({elapsed:.2f}s)"
+    )
+
+
+def bench_userspace(args: argparse.Namespace):
+    """Drive rotation, parsing and analysis with synthetic logs.
+
+    rotate is the pipe drain into segments, finish the background indexing
+    (and compression) of the closed segments, and report the map-reduce
+    summary over --jobs workers.
+    """
+    from src.columnar import export_segments, load_columns
+    from src.index import query
+    from src.matchbox import Supervisor
+    from src.patterns import analyze, io_accesses
+    from src.report import build_report
+    from src.segments import wait_background
+    from src.tracer import RotateTracer
+
+    class CatTracer(RotateTracer):
+        """RotateTracer that reads a file through cat instead of running bpftrace."""
+
+        def __init__(self, source: str, output_dir: str):
+            super().__init__("io", source, output_dir)
+
+        def command(self) -> list[str]:
+            return ["cat", self._script]
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.log")
+        lines = SyntheticLog(paired=args.paired).write(source, args.lines)
+        size = os.path.getsize(source)
+        print(f"input: {lines} lines, {size} bytes (paired: {args.paired})")
+
+        out_dir = os.path.join(tmp, "logs")
+        os.makedirs(out_dir)
+
+        def rotate():
+            tracer = CatTracer(source, out_dir)
+            tracer.with_rotate_size(args.rotate_size)
+            tracer.with_retention(args.compress)
+            Supervisor([tracer]).run()
+
+        def parse():
+            for _ in iter_calls(out_dir):
+                pass
+
+        def report():
+            build_report(out_dir, jobs=args.jobs)
+
+        def export():
+            export_segments(out_dir, os.path.join(tmp, "columns"))
+
+        def patterns():
+            columns = os.path.join(tmp, "columns")
+            paths = sorted(os.path.join(columns, n) for n in os.listdir(columns))
+            analyze(io_accesses(load_columns(paths)))
+
+        def window():
+            start = 1_000_000_000 + (lines // 4) * 1000
+            for _ in query(out_dir, start, start + lines * 100):
+                pass
+
+        stage(results, "rotate", lines, size, rotate)
+        stage(results, "finish", lines, size, wait_background)
+        stage(results, "parse", lines, size, parse)
+        stage(results, "report", lines, size, report)
+        stage(results, "export", lines, size, export)
+        stage(results, "patterns", lines, size, patterns)
+        stage(results, "query", lines, size, window)
+
+    save(args.out, results)
+
+
+def save(path: str, results: list):
+    if path:
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results saved to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="tracing overhead benchmark")
+    tiers = parser.add_subparsers(dest="tier", required=True)
+
+    cmd = tiers.add_parser("kernel", help="trace the toys (root and bpftrace)")
+    cmd.add_argument(
+        "-s",
+        "--sizes",
+        type=lambda s: [parse_size(v) for v in split_list(s)],
+        default=[16 << 20, 256 << 20],
+        help="Comma separated input sizes (default: 16M,256M)",
+    )
+    cmd.add_argument(
+        "-w",
+        "--workloads",
+        type=split_list,
+        default=["copy", "mmap"],
+        help="Comma separated toys (default: copy,mmap)",
+    )
+    cmd.add_argument(
+        "-m",
+        "--modes",
+        type=split_list,
+        default=["execute", "command"],
+        help="Comma separated modes, execute and/or command (default: both)",
+    )
+    cmd.add_argument(
+        "-st",
+        "--styles",
+        type=split_list,
+        default=list(STYLES),
+        help=f"Comma separated output styles (default: {','.join(STYLES)})",
+    )
+    cmd.add_argument(
+        "-r",
+        "--rotations",
+        type=split_list,
+        default=list(ROTATIONS),
+        help=f"Comma separated rotation settings (default: {','.join(ROTATIONS)})",
+    )
+    cmd.add_argument("-n", "--repeat", type=int, default=3)
+    cmd.add_argument("-o", "--out", help="Write the results as json")
+    cmd.set_defaults(func=bench_kernel)
+
+    cmd = tiers.add_parser("userspace", help="rotate, parse and analyze synthetic logs")
+    cmd.add_argument("-n", "--lines", type=int, default=1_000_000)
+    cmd.add_argument("-rs", "--rotate_size", type=int, default=32 * 1024 * 1024)
+    cmd.add_argument("-pa", "--paired", action="store_true")
+    cmd.add_argument("-cz", "--compress", choices=["gzip", "zstd"])
+    cmd.add_argument("-j", "--jobs", type=int, help="Workers of the report stage")
+    cmd.add_argument("-o", "--out", help="Write the results as json")
+    cmd.set_defaults(func=bench_userspace)
+
+    args = parser.parse_args()
+    for name in ("modes", "styles", "rotations"):
+        known = {
+            "modes": ("execute", "command"),
+            "styles": STYLES,
+            "rotations": ROTATIONS,
+        }
+        unknown = set(getattr(args, name, ())) - set(known[name])
+        if unknown:
+            parser.error(f"unknown {name} {sorted(unknown)}")
+
+    args.func(args)
@@ -0,0 +1,109 @@
+# file: scripts/bench_rotate.py
+# measuring the throughput of the rotate tracer pipe reader (lines per second).
+# run: PYTHONPATH=. python3 scripts/bench_rotate.py [-n lines] [-rs rotate_size]
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+from src.matchbox import Supervisor
+from src.tracer import RotateTracer
+
+# a read/write mix in the format of templates/bpftrace/io_trace.bt.j2
+SAMPLE = [
+    "{ts} {{pid=4312 tid=4312 proc=postgres}}{{EN read}}{{fd=7 count=8192}}\n",
+    "{ts} {{pid=4312 tid=4312 proc=postgres}}{{EX read}}{{ret=8192}}\n",
+    "{ts} {{pid=4312 tid=4313 proc=postgres}}{{EN pwrite64}}{{fd=9 count=16384}}\n",
+    "{ts} {{pid=4312 tid=4313 proc=postgres}}{{EX pwrite64}}{{ret=16384}}\n",
+    "{ts} {{pid=4312 tid=4312 proc=postgres}}{{EN openat}}{{fname=/var/lib/postgresql/data/base/16384/2619}}\n",
+    "{ts} {{pid=4312 tid=4312 proc=postgres}}{{EX openat}}{{ret=10}}\n",
+]
+
+
+def generate(path: str, lines: int):
+    """Write a synthetic trace log.
+
+    :param path: output file
+    :param lines: number of lines to write
+    """
+    ts = 1_000_000_000
+    with open(path, "w") as f:
+        for i in range(lines):
+            ts += 1500
+            f.write(SAMPLE[i % len(SAMPLE)].format(ts=ts))
+
+
+def legacy_drain(source: str, output_dir: str, rotate_size: int):
+    """The previous rotate loop: text readline, encode per line, line-buffered writes."""
+    index, size, f = 0, 0, None
+
+    def rotate():
+        nonlocal index, size, f
+        if f:
+            f.close()
+        f = open(
+            os.path.join(output_dir, f"trace_legacy_{index}.log"), "w", buffering=1
+        )
+        size = 0
+        index += 1
+
+    rotate()
+    proc = subprocess.Popen(
+        ["cat", source], stdout=subprocess.PIPE, text=True, bufsize=1
+    )
+    while True:
+        line = proc.stdout.readline()
+        if not line:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.05)
+            continue
+        data = line.encode()
+        if size + len(data) > rotate_size:
+            rotate()
+        f.write(line)
+        size += len(data)
+    f.close()
+
+
+class CatTracer(RotateTracer):
+    """RotateTracer that reads a file through cat instead of running bpftrace."""
+
+    def __init__(self, source: str, output_dir: str):
+        super().__init__("chunked", source, output_dir)
+
+    def command(self) -> list[str]:
+        return ["cat", self._script]
+
+
+def measure(name: str, lines: int, func) -> float:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>8}: {lines / elapsed:>12,.0f} lines/s ({elapsed:.2f}s)")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="rotate tracer throughput benchmark")
+    parser.add_argument("-n", "--lines", type=int, default=2_000_000)
+    parser.add_argument("-rs", "--rotate_size", type=int, default=100 * 1024 * 1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.log")
+        generate(source, args.lines)
+        print(f"input: {args.lines} lines, {os.path.getsize(source)} bytes")
+
+        def chunked():
+            tracer = CatTracer(source, tmp)
+            tracer.with_rotate_size(args.rotate_size)
+            Supervisor([tracer]).run()
+
+        before = measure(
+            "legacy", args.lines, lambda: legacy_drain(source, tmp, args.rotate_size)
+        )
+        after = measure("chunked", args.lines, chunked)
+        print(f" speedup: {before / after:.1f}x")
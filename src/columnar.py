@@ -0,0 +1,221 @@
+import logging
+import os
+from array import array
+from typing import Iterable, Optional
+
+import numpy as np
+
+from src.parser import (
+    Call,
+    group_segments,
+    iter_segment_events,
+    list_segments,
+    pair_events,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, npz is always available
+    pa = None
+
+# value of the integer columns when the record has no such field
+MISSING = np.iinfo(np.int64).min
+
+# integer columns and their dtypes
+INT_COLUMNS = {
+    "ts": np.int64,
+    "latency": np.int64,
+    "pid": np.int32,
+    "tid": np.int32,
+    "fd": np.int32,
+    "newfd": np.int32,
+    "count": np.int64,
+    "ret": np.int64,
+    "addr": np.int64,
+    "len": np.int64,
+    "off": np.int64,
+}
+
+# dictionary-encoded string columns (stored as int32 codes + a `<name>_dict` array)
+DICT_COLUMNS = ("comm", "op", "path")
+
+FORMATS = ("npz", "parquet", "arrow")
+
+_U64 = 1 << 64
+_I64_MAX = (1 << 63) - 1
+
+
+def _signed(value: int) -> int:
+    """Fold unsigned 64-bit values (addresses, mmap ret) into int64."""
+    return value - _U64 if value > _I64_MAX else value
+
+
+class ColumnBuilder:
+    """ColumnBuilder accumulates calls into typed columns."""
+
+    def __init__(self):
+        self._ints = {name: array("q") for name in INT_COLUMNS}
+        self._codes = {name: array("i") for name in DICT_COLUMNS}
+        self._dicts = {name: {} for name in DICT_COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self._ints["ts"])
+
+    def _code(self, column: str, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        table = self._dicts[column]
+        code = table.get(value)
+        if code is None:
+            code = table[value] = len(table)
+        return code
+
+    def append(self, call: Call):
+        """Append a single call as a new row.
+
+        :param call: a paired call from the parser
+        """
+        args = call.args
+        ints = self._ints
+
+        fd = args.get("fd", args.get("oldfd", -1))
+        ints["ts"].append(call.ts)
+        ints["latency"].append(MISSING if call.latency is None else call.latency)
+        ints["pid"].append(call.pid)
+        ints["tid"].append(call.tid)
+        ints["fd"].append(fd if isinstance(fd, int) else -1)
+        ints["newfd"].append(args.get("newfd", -1))
+        ints["count"].append(args.get("count", MISSING))
+        ints["ret"].append(MISSING if call.ret is None else _signed(call.ret))
+        ints["addr"].append(_signed(args.get("addr", MISSING)))
+        ints["len"].append(_signed(args.get("len", MISSING)))
+        ints["off"].append(_signed(args.get("off", MISSING)))
+
+        self._codes["comm"].append(self._code("comm", call.comm))
+        self._codes["op"].append(self._code("op", call.op))
+        self._codes["path"].append(self._code("path", args.get("fname")))
+
+    def columns(self) -> dict[str, np.ndarray]:
+        """Get the columns as numpy arrays.
+
+        :return: integer columns, `<name>` code columns and `<name>_dict` string arrays
+        """
+        cols = {}
+        for name, dtype in INT_COLUMNS.items():
+            cols[name] = np.frombuffer(self._ints[name], dtype=np.int64).astype(dtype)
+        for name in DICT_COLUMNS:
+            cols[name] = np.frombuffer(self._codes[name], dtype=np.int32).copy()
+            cols[f"{name}_dict"] = np.array(list(self._dicts[name]), dtype=str)
+        return cols
+
+
+def save_columns(path: str, cols: dict[str, np.ndarray], fmt: str = "npz"):
+    """Write columns into a file.
+
+    :param path: output file path (without extension)
+    :param cols: columns created by ColumnBuilder
+    :param fmt: one of npz, parquet, arrow
+    :return: the written file path
+    """
+    if fmt == "npz":
+        np.savez_compressed(path, **cols)
+        return path + ".npz"
+
+    if pa is None:
+        raise RuntimeError(f"pyarrow is required for the {fmt} format")
+
+    fields = {name: pa.array(cols[name]) for name in INT_COLUMNS}
+    for name in DICT_COLUMNS:
+        fields[name] = pa.DictionaryArray.from_arrays(
+            pa.array(cols[name], mask=cols[name] < 0),
+            pa.array(cols[f"{name}_dict"].tolist(), type=pa.string()),
+        )
+    table = pa.table(fields)
+
+    if fmt == "parquet":
+        pq.write_table(table, path + ".parquet", compression="zstd")
+        return path + ".parquet"
+
+    feather.write_feather(table, path + ".arrow", compression="zstd")
+    return path + ".arrow"
+
+
+def export_segments(
+    input_path: str,
+    output_dir: str,
+    fmt: str = "npz",
+    tracer: Optional[str] = None,
+) -> list[str]:
+    """Convert trace segments into columnar files (one per segment).
+
+    Calls are paired across the segments of a tracer. A call belongs to
+    the segment where it exits, so memory stays bounded by the segment size.
+
+    :param input_path: tracing output directory (or a single segment)
+    :param output_dir: directory to store the columnar files
+    :param fmt: one of npz, parquet, arrow
+    :param tracer: only export the segments of this tracer
+    :return: a list of written files
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt}, use one of {FORMATS}")
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    written = []
+    for chain in group_segments(list_segments(input_path, tracer)).values():
+        pending = {}
+        for index, segment in enumerate(chain):
+            builder = ColumnBuilder()
+            last = index == len(chain) - 1
+            for call in pair_events(iter_segment_events([segment]), last, pending):
+                builder.append(call)
+
+            name = os.path.splitext(os.path.basename(segment))[0]
+            out = save_columns(os.path.join(output_dir, name), builder.columns(), fmt)
+            logging.info(f"exported {len(builder)} calls: {segment} => {out}")
+            written.append(out)
+
+    return written
+
+
+def load_columns(paths: Iterable[str]) -> dict[str, np.ndarray]:
+    """Load and concatenate exported npz files.
+
+    The dictionary columns are re-encoded against one merged dictionary,
+    so codes are comparable across all loaded files.
+
+    :param paths: npz files created by export_segments
+    :return: integer columns, code columns and `<name>_dict` arrays
+    """
+    parts = {name: [] for name in list(INT_COLUMNS) + list(DICT_COLUMNS)}
+    merged = {name: {} for name in DICT_COLUMNS}
+
+    for path in paths:
+        with np.load(path) as data:
+            for name, dtype in INT_COLUMNS.items():
+                if name in data.files:
+                    parts[name].append(data[name])
+                else:  # exported before the column existed
+                    parts[name].append(np.full(len(data["ts"]), MISSING, dtype))
+            for name in DICT_COLUMNS:
+                table = merged[name]
+                remap = np.array(
+                    [table.setdefault(v, len(table)) for v in data[f"{name}_dict"]]
+                    + [-1],
+                    dtype=np.int32,
+                )
+                # code -1 (missing) indexes the trailing -1 of the remap table
+                parts[name].append(remap[data[name]])
+
+    cols = {}
+    for name, dtype in INT_COLUMNS.items():
+        cols[name] = np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype)
+    for name in DICT_COLUMNS:
+        cols[name] = (
+            np.concatenate(parts[name]) if parts[name] else np.empty(0, np.int32)
+        )
+        cols[f"{name}_dict"] = np.array(list(merged[name]), dtype=str)
+    return cols
@@ -1,68 +1,218 @@
+import json
 import logging
+import os
+import select
 import subprocess
 import sys
 import time
+from typing import Optional
 
+# cgroup v2 mount point when /proc/self/mounts has none
+DEFAULT_CGROUP_ROOT = "/sys/fs/cgroup"
 
-def find_pod_cgroup(namespace: str, pod: str, container: str) -> str:
-    """Find pod's cgroup based on its namespace, name, and container using crictl.
+# seconds between two checks when crictl cannot stream events (and as a safety net)
+WATCH_INTERVAL = 2.0
+
+# container id => cgroup id, container ids are never reused
+_cgroup_ids: dict[str, str] = {}
+
+
+def crictl(*args: str) -> str:
+    """Run crictl and get its output.
+
+    :raises RuntimeError: when crictl cannot run or fails
+    """
+    try:
+        result = subprocess.run(
+            ["crictl", *args], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError) as exc:
+        raise RuntimeError(f"error running crictl {args[0]}: {exc}") from exc
+    return result.stdout
+
+
+def _cgroup_root() -> str:
+    """Get the mount point of the cgroup v2 hierarchy (read by bpftrace `cgroup`)."""
+    try:
+        with open("/proc/self/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] == "cgroup2":
+                    return fields[1]
+    except OSError:
+        pass
+    return DEFAULT_CGROUP_ROOT
+
+
+def find_container_id(namespace: str, pod: str, container: str) -> Optional[str]:
+    """Find the id of a running container by its kubernetes labels.
 
     :param namespace: kubernetes namespace
     :param pod: kubernetes pod name
     :param container: kubernetes pod's container name
-    :return: container cgroup
+    :raises RuntimeError: when crictl fails
+    :return: the id of the newest running container (None if not running)
     """
+    output = crictl(
+        "ps",
+        "-o",
+        "json",
+        "--label",
+        f"io.kubernetes.pod.namespace={namespace}",
+        "--label",
+        f"io.kubernetes.pod.name={pod}",
+        "--label",
+        f"io.kubernetes.container.name={container}",
+    )
+    running = [
+        item
+        for item in json.loads(output or "{}").get("containers") or []
+        if item.get("state") == "CONTAINER_RUNNING"
+    ]
+    if not running:
+        return None
+    return max(running, key=lambda item: int(item.get("createdAt", 0)))["id"]
+
 
-    # poll for the container ID
-    while True:
-        logging.info("waiting ...")
-        try:
-            result = subprocess.run(
-                ["crictl", "ps", "--namespace", namespace],
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-        except subprocess.CalledProcessError as exc:
-            logging.error(f"error running crictl ps: {exc}")
-            sys.exit(1)
-
-        containerid = None
-        for line in result.stdout.splitlines()[1:]:
-            parts = line.split()
-
-            if len(parts) >= 11 and parts[9] == pod and parts[6] == container:
-                containerid = parts[0]
-                break
-
-        if containerid:
-            logging.info(f"target container found: {container} => {containerid}")
-            break
-
-        time.sleep(0.5)
-
-    # find cgroup path
+def _proc_cgroup(pid: int, root: str) -> Optional[str]:
+    """Get the cgroup v2 directory of a process from /proc/<pid>/cgroup."""
     try:
-        find_proc = subprocess.run(
-            ["find", "/sys/fs/cgroup/", "-type", "d", "-name", f"*{containerid}*"],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        path = find_proc.stdout.strip().splitlines()[0]
-    except Exception as e:
-        logging.error(f"could not find cgroup path: {e}")
-        sys.exit(1)
+        with open(f"/proc/{pid}/cgroup") as f:
+            for line in f:
+                hierarchy, _, path = line.rstrip("\n").split(":", 2)
+                if hierarchy == "0" and ".." not in path:
+                    # the path is relative to the root of our cgroup namespace
+                    path = os.path.join(root, path.lstrip("/"))
+                    return path if os.path.isdir(path) else None
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _spec_cgroup(cgroups_path: str, root: str) -> Optional[str]:
+    """Get the cgroup directory of the cgroupsPath of an OCI runtime spec.
+
+    The systemd driver writes `<slice>:<prefix>:<name>`, which is the scope
+    `<prefix>-<name>.scope` under the nested slices (a-b.slice is in a.slice).
+    The cgroupfs driver writes the path itself.
+    """
+    if ":" in cgroups_path:
+        parent, prefix, name = cgroups_path.split(":", 2)
+        parts = parent.removesuffix(".slice").split("-") if parent else []
+        slices = ["-".join(parts[: i + 1]) + ".slice" for i in range(len(parts))]
+        path = os.path.join(root, *slices, f"{prefix}-{name}.scope")
+    else:
+        path = os.path.join(root, cgroups_path.lstrip("/"))
+    return path if os.path.isdir(path) else None
+
+
+def _walk_cgroup(container_id: str, root: str) -> Optional[str]:
+    """Search the cgroup tree for the container id (slow, last resort)."""
+    logging.warning(f"searching {root} for container {container_id}, this may be slow")
+    for path, dirs, _ in os.walk(root):
+        for name in dirs:
+            if container_id in name:
+                return os.path.join(path, name)
+    return None
+
+
+def container_cgroup(container_id: str) -> str:
+    """Resolve the cgroup id of a container (cached).
+
+    The cgroup directory comes from the container's init process, or from the
+    cgroupsPath of its runtime spec (`crictl inspect`), and the id is its inode.
+
+    :param container_id: the container id (from crictl)
+    :raises RuntimeError: when crictl fails (e.g. the container is gone)
+    :return: the cgroup id, empty if it is not found
+    """
+    if container_id in _cgroup_ids:
+        return _cgroup_ids[container_id]
+
+    info = json.loads(crictl("inspect", "-o", "json", container_id)).get("info", {})
+    root = _cgroup_root()
+
+    path = None
+    if info.get("pid"):
+        path = _proc_cgroup(info["pid"], root)
+    cgroups_path = ((info.get("runtimeSpec") or {}).get("linux") or {}).get(
+        "cgroupsPath"
+    )
+    if path is None and cgroups_path:
+        path = _spec_cgroup(cgroups_path, root)
+    if path is None:
+        path = _walk_cgroup(container_id, root)
+    if path is None:
+        logging.error(f"could not find the cgroup of container {container_id}")
+        return ""
 
-    # find numeric cgroupid
     try:
-        stat_proc = subprocess.run(
-            ["stat", "-c", "%i", path], capture_output=True, text=True, check=True
-        )
-        cgroupid = stat_proc.stdout.strip()
-        return cgroupid
-    except Exception as e:
+        cgroupid = str(os.stat(path).st_ino)
+    except OSError as e:
         logging.error(f"could not determine cgroupid for {path}: {e}")
-        sys.exit(1)
+        return ""
+
+    logging.info(f"container {container_id} cgroup: {path} => {cgroupid}")
+    _cgroup_ids[container_id] = cgroupid
+    return cgroupid
+
+
+def watch_events() -> Optional[subprocess.Popen]:
+    """Stream the container events of the runtime (None if crictl cannot)."""
+    try:
+        return subprocess.Popen(
+            ["crictl", "events", "-o", "json"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        return None
+
+
+def close_events(events: subprocess.Popen):
+    """Stop a stream of container events.
+
+    :param events: the process returned by watch_events
+    """
+    events.kill()
+    events.wait()
 
-    return ""
+
+def find_pod_cgroup(namespace: str, pod: str, container: str) -> str:
+    """Find pod's cgroup based on its namespace, name, and container using crictl.
+
+    Waits for the container to run: every container event of the runtime
+    (`crictl events`) triggers a check, with a slow poll when events are
+    not supported.
+
+    :param namespace: kubernetes namespace
+    :param pod: kubernetes pod name
+    :param container: kubernetes pod's container name
+    :return: container cgroup
+    """
+    # watch before the first check, so a container started in between is seen
+    events = watch_events()
+    interval = 0.1
+    try:
+        while True:
+            containerid = find_container_id(namespace, pod, container)
+            if containerid:
+                logging.info(f"target container found: {container} => {containerid}")
+                return container_cgroup(containerid)
+
+            logging.info("waiting ...")
+            if events is not None and events.poll() is None:
+                ready, _, _ = select.select([events.stdout], [], [], WATCH_INTERVAL)
+                if ready and not os.read(events.stdout.fileno(), 64 * 1024):
+                    # the event stream ended, poll from now on
+                    close_events(events)
+                    events = None
+            else:
+                time.sleep(interval)
+                interval = min(interval * 2, WATCH_INTERVAL)
+    except RuntimeError as e:
+        logging.error(str(e))
+        sys.exit(1)
+    finally:
+        if events is not None:
+            close_events(events)
@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+from typing import Optional
+
+from src.containers import (
+    WATCH_INTERVAL,
+    close_events,
+    container_cgroup,
+    crictl,
+    watch_events,
+)
+from src.targets import export_targets
+
+# the descriptor the pods scripts watch in lseek, no process has it open
+_CONTROL_FD = -1
+
+
+class PodDaemon:
+    """PodDaemon attaches the containers of the selected pods to running tracers.
+
+    A thread watches the container runtime (`crictl events`, with a slow poll
+    as a safety net) and keeps the @tracked_cgid map of the pods scripts in
+    sync with the running containers of the pods that match the selector.
+    Each container gets the next target index, and targets.json grows with
+    them, so the output is split per pod by the target tags.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        namespace: Optional[str] = None,
+        selector: Optional[list[str]] = None,
+        container: Optional[str] = None,
+        interval: float = WATCH_INTERVAL,
+    ):
+        """PodDaemon constructor.
+
+        :param output_dir: the output directory (targets.json is written there)
+        :param namespace: only the pods of this namespace (None for every namespace)
+        :param selector: only the pods with these labels (e.g. ["app=web"])
+        :param container: only the containers with this name (None for every one)
+        :param interval: seconds between two checks without runtime events
+        """
+        self._output_dir = output_dir
+        self._namespace = namespace
+        self._selector = selector or []
+        self._container = container
+        self._interval = interval
+
+        self._targets = []  # every target of the session, in the order of their tags
+        self._attached = {}  # container id => (cgroup id, target index)
+        self._unsaved = False  # targets.json lags behind the targets
+
+        self._stopping = threading.Event()
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = threading.Thread(
+            target=self.__run, name="pod-daemon", daemon=True
+        )
+
+    def start(self):
+        """Start watching the runtime."""
+        os.makedirs(self._output_dir, exist_ok=True)
+        self._thread.start()
+
+    def stop(self):
+        """Detach every container and stop watching the runtime."""
+        self._stopping.set()
+        if self._thread.is_alive():
+            os.write(self._wake_w, b"\0")
+            self._thread.join()
+
+    def __running(self) -> dict[str, str]:
+        """Get the running containers of the selected pods.
+
+        :raises RuntimeError: when crictl fails
+        :return: container id => target name (namespace/pod/container)
+        """
+        args = ["pods", "-o", "json", "--state", "ready"]
+        for label in self._selector:
+            args += ["--label", label]
+        pods = {}
+        for pod in json.loads(crictl(*args) or "{}").get("items") or []:
+            meta = pod.get("metadata") or {}
+            if self._namespace is None or meta.get("namespace") == self._namespace:
+                pods[pod["id"]] = f"{meta.get('namespace')}/{meta.get('name')}"
+
+        running = {}
+        for item in (
+            json.loads(crictl("ps", "-o", "json") or "{}").get("containers") or []
+        ):
+            name = (item.get("metadata") or {}).get("name")
+            if item.get("podSandboxId") not in pods:
+                continue
+            if self._container is not None and name != self._container:
+                continue
+            running[item["id"]] = f"{pods[item['podSandboxId']]}/{name}"
+        return running
+
+    def __sync(self):
+        """Attach the new containers, detach the stopped ones."""
+        try:
+            running = self.__running()
+        except RuntimeError as e:
+            logging.warning(f"cannot list the pods: {e}")
+            return
+
+        for cid in list(self._attached):
+            if cid not in running:
+                cgid, index = self._attached.pop(cid)
+                _control(cgid, 0)
+                self._targets[index - 1]["stopped"] = time.time()
+                logging.info(f"detached {self._targets[index - 1]['name']}")
+                self._unsaved = True
+
+        for cid, name in running.items():
+            if cid in self._attached:
+                continue
+            try:
+                cgid = container_cgroup(cid)
+            except RuntimeError as e:
+                logging.warning(f"cannot resolve the cgroup of {name}: {e}")
+                continue
+            if not cgid:
+                continue
+            self._targets.append(
+                {"name": name, "id": cgid, "container": cid, "started": time.time()}
+            )
+            self._attached[cid] = (cgid, len(self._targets))
+            logging.info(f"attached {name} => {cgid} (target {len(self._targets)})")
+            self._unsaved = True
+
+        if self._unsaved:
+            try:
+                export_targets(self._output_dir, self._targets)
+                self._unsaved = False
+            except OSError as e:
+                # the next sync writes it again
+                logging.warning(f"cannot save the targets: {e}")
+
+        # set every attached cgroup again, so tracers that started later have them too
+        for cgid, index in self._attached.values():
+            _control(cgid, index)
+
+    def __run(self):
+        """Sync on every runtime event, and at least once per interval."""
+        events = watch_events()
+        try:
+            while not self._stopping.is_set():
+                self.__sync()
+
+                watched = [self._wake_r]
+                if events is not None and events.poll() is None:
+                    watched.append(events.stdout)
+                ready, _, _ = select.select(watched, [], [], self._interval)
+                if events is not None and events.stdout in ready:
+                    # one sync for the whole burst of events
+                    if not os.read(events.stdout.fileno(), 64 * 1024):
+                        # the event stream ended, only the interval poll is left
+                        close_events(events)
+                        events = None
+        finally:
+            if events is not None:
+                close_events(events)
+
+            for cgid, _ in self._attached.values():
+                _control(cgid, 0)
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+
+
+def _control(cgid: str, index: int):
+    """Set the target index of a cgroup in the pods scripts (0 to remove it).
+
+    The scripts read the call from the probe of lseek on the control fd, the
+    call itself fails with EBADF.
+    """
+    try:
+        os.lseek(_CONTROL_FD, int(cgid), index)
+    except OSError:
+        pass
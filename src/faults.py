@@ -0,0 +1,271 @@
+from bisect import bisect_right
+from collections import Counter
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from src.parser import (
+    Call,
+    group_segments,
+    iter_segment_events,
+    list_segments,
+    pair_events,
+)
+
+PAGE_SIZE = 4096
+
+# mmap returns -errno on failure, printed as an unsigned 64-bit value
+_MMAP_FAILED = (1 << 64) - 4096
+
+
+class Fault(NamedTuple):
+    """Fault is a user page fault resolved to a mapped file.
+
+    :param ts: fault timestamp in nanoseconds
+    :param pid: process id
+    :param tid: thread id
+    :param comm: process command name
+    :param addr: faulting virtual address
+    :param path: the mapped file (None for anonymous or unknown memory)
+    :param page: page index in the file (None if the address is not mapped)
+    :param latency: fault handling time in nanoseconds (None if not paired)
+    """
+
+    ts: int
+    pid: int
+    tid: int
+    comm: str
+    addr: int
+    path: Optional[str]
+    page: Optional[int]
+    latency: Optional[int]
+
+
+class RegionIndex:
+    """RegionIndex holds the mapped regions of one process.
+
+    Regions never overlap and are kept in parallel lists sorted by start
+    address, so a lookup is a single bisect.
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self._files = []  # (path, file offset of the region start)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __iter__(self) -> Iterator[tuple[int, int, Optional[str], int]]:
+        """Iterate over the regions as (start, end, path, offset), by address."""
+        for start, end, (path, offset) in zip(self._starts, self._ends, self._files):
+            yield start, end, path, offset
+
+    def copy(self) -> "RegionIndex":
+        """Copy the index (a forked child inherits the mappings)."""
+        index = RegionIndex()
+        index._starts = self._starts.copy()
+        index._ends = self._ends.copy()
+        index._files = self._files.copy()
+        return index
+
+    def map(self, start: int, length: int, path: Optional[str], offset: int = 0):
+        """Add a region, replacing what was mapped in its range.
+
+        :param start: start address
+        :param length: region length in bytes
+        :param path: the mapped file (None for anonymous memory)
+        :param offset: file offset of the start address
+        """
+        self.unmap(start, length)
+        i = bisect_right(self._starts, start)
+        self._starts.insert(i, start)
+        self._ends.insert(i, start + length)
+        self._files.insert(i, (path, offset))
+
+    def unmap(self, start: int, length: int):
+        """Remove a range, splitting the regions that are partly inside it.
+
+        :param start: start address
+        :param length: range length in bytes
+        """
+        end = start + length
+        i = bisect_right(self._starts, start) - 1
+        if i < 0 or self._ends[i] <= start:
+            i += 1
+
+        j = i
+        keep = []
+        while j < len(self._starts) and self._starts[j] < end:
+            rstart, rend, (path, offset) = (
+                self._starts[j],
+                self._ends[j],
+                self._files[j],
+            )
+            if rstart < start:
+                keep.append((rstart, start, (path, offset)))
+            if rend > end:
+                keep.append((end, rend, (path, offset + end - rstart)))
+            j += 1
+
+        if i == j:
+            return
+
+        self._starts[i:j] = [r[0] for r in keep]
+        self._ends[i:j] = [r[1] for r in keep]
+        self._files[i:j] = [r[2] for r in keep]
+
+    def lookup(self, addr: int) -> Optional[tuple[Optional[str], int]]:
+        """Find the region of an address.
+
+        :param addr: virtual address
+        :return: (path, file offset of the address), or None if it is not mapped
+        """
+        i = bisect_right(self._starts, addr) - 1
+        if i < 0 or addr >= self._ends[i]:
+            return None
+        path, offset = self._files[i]
+        return path, offset + addr - self._starts[i]
+
+
+class FaultResolver:
+    """FaultResolver replays the calls of a tracer and resolves its page faults.
+
+    It keeps the fd => path table of each process (open, dup, close) and the
+    mapped regions of each process (mmap, munmap), both inherited on fork.
+    """
+
+    def __init__(self, page_size: int = PAGE_SIZE):
+        """FaultResolver constructor.
+
+        :param page_size: page size of the traced machine
+        """
+        self._page_size = page_size
+        self._fds = {}  # pid => {fd: path}
+        self._regions = {}  # pid => RegionIndex
+
+    def __regions(self, pid: int) -> RegionIndex:
+        index = self._regions.get(pid)
+        if index is None:
+            index = self._regions[pid] = RegionIndex()
+        return index
+
+    def feed(self, call: Call) -> Optional[Fault]:
+        """Apply a call to the tables.
+
+        :param call: a paired call in exit order
+        :return: the resolved fault if the call is a page fault
+        """
+        op, args, ret = call.op, call.args, call.ret
+
+        if op == "page_fault_user":
+            addr = args.get("addr")
+            if addr is None:
+                return None
+            path, page = None, None
+            index = self._regions.get(call.pid)
+            found = index.lookup(addr) if index is not None else None
+            if found is not None:
+                path, page = found[0], found[1] // self._page_size
+            return Fault(
+                call.ts, call.pid, call.tid, call.comm, addr, path, page, call.latency
+            )
+
+        if op == "mmap":
+            if ret is None or ret >= _MMAP_FAILED:
+                return None
+            fd = args.get("fd", -1)
+            path = args.get("fname")
+            if path is None and fd >= 0:
+                path = self._fds.get(call.pid, {}).get(fd)
+            self.__regions(call.pid).map(
+                ret, args.get("len", 0), path if fd >= 0 else None, args.get("off", 0)
+            )
+        elif op == "munmap":
+            if ret == 0 and "addr" in args:
+                self.__regions(call.pid).unmap(args["addr"], args.get("len", 0))
+        elif op in ("open", "openat", "creat"):
+            if ret is not None and ret >= 0 and "fname" in args:
+                self._fds.setdefault(call.pid, {})[ret] = args["fname"]
+        elif op in ("dup", "dup2", "dup3"):
+            fds = self._fds.get(call.pid)
+            if fds is not None and ret is not None and ret >= 0:
+                old = fds.get(args.get("fd", args.get("oldfd")))
+                if old is not None:
+                    fds[ret] = old
+        elif op == "close":
+            if ret == 0:
+                self._fds.get(call.pid, {}).pop(args.get("fd"), None)
+        elif op == "fork":
+            child = args.get("pid")
+            if child is not None and child != call.pid:
+                self._fds[child] = dict(self._fds.get(call.pid, {}))
+                if call.pid in self._regions:
+                    self._regions[child] = self._regions[call.pid].copy()
+        elif op == "exec":
+            # the new image starts with fresh mappings, fds stay open
+            self._regions.pop(args.get("pid", call.pid), None)
+        elif op == "process" and call.tid == call.pid:
+            # only the exit of the main thread ends the process
+            self._fds.pop(call.pid, None)
+            self._regions.pop(call.pid, None)
+
+        return None
+
+
+def resolve_faults(
+    calls: Iterable[Call], page_size: int = PAGE_SIZE
+) -> Iterator[Fault]:
+    """Resolve the page faults of a call stream.
+
+    :param calls: paired calls of one tracer in exit order
+    :param page_size: page size of the traced machine
+    """
+    resolver = FaultResolver(page_size)
+    for call in calls:
+        fault = resolver.feed(call)
+        if fault is not None:
+            yield fault
+
+
+def iter_faults(
+    path: str, tracer: Optional[str] = None, page_size: int = PAGE_SIZE
+) -> Iterator[Fault]:
+    """Stream the resolved page faults of an output directory (or a single segment).
+
+    Each tracer is replayed on its own, since only its log has the opens and
+    mmaps of the processes it traced (memory or all).
+
+    :param path: an output directory or a single segment file
+    :param tracer: only read the segments of this tracer
+    :param page_size: page size of the traced machine
+    """
+    for chain in group_segments(list_segments(path, tracer)).values():
+        yield from resolve_faults(pair_events(iter_segment_events(chain)), page_size)
+
+
+def summarize_faults(
+    faults: Iterable[Fault], region_pages: int = 256, top: int = 20
+) -> dict:
+    """Count faults per file and per file region.
+
+    :param faults: resolved faults
+    :param region_pages: number of pages per region
+    :param top: number of files and regions to keep
+    :return: total, unresolved (anonymous or unknown) and the top files and
+        regions as ((path, first page), count) pairs
+    """
+    files, regions = Counter(), Counter()
+    total = unresolved = 0
+    for fault in faults:
+        total += 1
+        if fault.path is None:
+            unresolved += 1
+            continue
+        files[fault.path] += 1
+        regions[(fault.path, fault.page - fault.page % region_pages)] += 1
+
+    return {
+        "total": total,
+        "unresolved": unresolved,
+        "files": files.most_common(top),
+        "regions": regions.most_common(top),
+    }
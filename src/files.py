@@ -12,12 +12,33 @@ def create_dir(directory: str):
     os.makedirs(directory, exist_ok=True)
 
 
-def get_tracing_scripts(dir_path: str) -> dict[str:str]:
+# extra bpftrace options of the tracing scripts
+SCRIPT_OPTIONS = {
+    "aggregate": ["-f", "json"],  # maps are printed as json summaries
+}
+
+
+def get_tracing_scripts(
+    dir_path: str,
+    unified: bool = False,
+    aggregate: bool = False,
+    paired: bool = False,
+) -> dict[str:str]:
     """Return the path of tracing scripts based on input directory path.
 
     :param dir_path: base directory of the target tracer
+    :param unified: return the single script that attaches io and memory probes once
+    :param aggregate: return the in-kernel aggregation script
+    :param paired: return the scripts that print one line per call at exit
     """
+    if aggregate:
+        return {"aggregate": os.path.join(dir_path, "aggregate_trace.bt")}
+
+    suffix = "_paired" if paired else ""
+    if unified:
+        return {"all": os.path.join(dir_path, f"all_trace{suffix}.bt")}
+
     return {
-        "io": os.path.join(dir_path, "io_trace.bt"),
-        "memory": os.path.join(dir_path, "memory_trace.bt"),
+        "io": os.path.join(dir_path, f"io_trace{suffix}.bt"),
+        "memory": os.path.join(dir_path, f"memory_trace{suffix}.bt"),
     }
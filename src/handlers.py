@@ -1,65 +1,63 @@
-from src.files import get_tracing_scripts
+import logging
+import os
+import sys
+from typing import Optional
+
+from src.files import SCRIPT_OPTIONS, get_tracing_scripts
+from src.launcher import Launcher
+from src.live import LiveMetrics
+from src.options import TraceOptions
+from src.parser.reader import zstandard
+from src.render import render_cached
+from src.segments import default_codec
+from src.targets import split_targets
 from src.tracer import MonoTracer, RotateTracer, Tracer
 from src.utils import ensure_script
 
 
 def handle_execute(
-    output_dir: str,
-    execute: str,
-    rotate: bool = False,
-    rotate_size: int = 100 * 1024 * 1024,
+    output_dir: str, launcher: Launcher, options: TraceOptions
 ) -> list[Tracer]:
     """Handle the execute command.
 
-    running: bpftrace -o output -c "command" bpftrace/execute/<tracer>.bt
+    running: bpftrace -o output bpftrace/pid/<tracer>.bt <pid>
+    the launcher forks the command stopped, and runs it once every tracer is attached.
 
     :param output_dir: tracing output directory
-    :param execute: the command to execute
-    :param rotate: enable rotate tracing
-    :param rotate_size: set the rotation size
+    :param launcher: the launcher of the command to execute (src/launcher.py)
+    :param options: the tracing options (src/options.py)
     :return: list of tracing scripts
     """
-    tracers = []
+    # the scripts are checked before the fork, a failure leaves no stopped command
+    tracers = __new_tracers("pid", output_dir, options)
 
-    for tname, tpath in get_tracing_scripts("bpftrace/execute").items():
-        tracer = __new_tracer(tname, tpath, output_dir, rotate, rotate_size)
-        tracer.with_options(["-c", execute])
-        tracers.append(tracer)
+    pid = str(launcher.spawn())
+    for tracer in tracers:
+        tracer.with_args([pid])
+    launcher.with_tracers(tracers)
 
     return tracers
 
 
-def handle_pid(
-    output_dir: str,
-    pid: str,
-    rotate: bool = False,
-    rotate_size: int = 100 * 1024 * 1024,
-) -> list[Tracer]:
+def handle_pid(output_dir: str, pid: str, options: TraceOptions) -> list[Tracer]:
     """Handle the pid tracing.
 
     running: bpftrace -o output bpftrace/pid/<tracer>.bt <pid>
+    with more than one pid, a single session traces all of them (pids mode).
 
     :param output_dir: tracing output directory
-    :param pid: the pid to trace
-    :param rotate: enable rotate tracing
-    :param rotate_size: set the rotation size
+    :param pid: the pid to trace, or comma separated pids
+    :param options: the tracing options (src/options.py)
     :return: list of tracing scripts
     """
-    tracers = []
-
-    for tname, tpath in get_tracing_scripts("bpftrace/pid").items():
-        tracer = __new_tracer(tname, tpath, output_dir, rotate, rotate_size)
-        tracer.with_args([pid])
-        tracers.append(tracer)
-
-    return tracers
+    pids = split_targets(pid)
+    if len(pids) > 1:
+        return __new_tracers("pids", output_dir, options, targets=pids)
+    return __new_tracers("pid", output_dir, options, args=pids)
 
 
 def handle_command(
-    output_dir: str,
-    command: str,
-    rotate: bool = False,
-    rotate_size: int = 100 * 1024 * 1024,
+    output_dir: str, command: str, options: TraceOptions
 ) -> list[Tracer]:
     """Handle the command tracing.
 
@@ -67,26 +65,14 @@ def handle_command(
 
     :param output_dir: tracing output directory
     :param command: the command to trace
-    :param rotate: enable rotate tracing
-    :param rotate_size: set the rotation size
+    :param options: the tracing options (src/options.py)
     :return: list of tracing scripts
     """
-    tracers = []
-
-    for tname, tpath in get_tracing_scripts("bpftrace/command").items():
-        tracer = __new_tracer(tname, tpath, output_dir, rotate, rotate_size)
-        tracer.with_args([command])
-        tracers.append(tracer)
-
-    return tracers
+    return __new_tracers("command", output_dir, options, args=[command])
 
 
 def handle_cgroup_and_command(
-    output_dir: str,
-    cgid: str,
-    filter_command: str,
-    rotate: bool = False,
-    rotate_size: int = 100 * 1024 * 1024,
+    output_dir: str, cgid: str, filter_command: str, options: TraceOptions
 ) -> list[Tracer]:
     """Handle the cgroup and command tracing.
 
@@ -95,58 +81,169 @@ def handle_cgroup_and_command(
     :param output_dir: tracing output directory
     :param cgid: the cgroup to trace
     :param filter_command: the command to filter
-    :param rotate: enable rotate tracing
-    :param rotate_size: set the rotation size
+    :param options: the tracing options (src/options.py)
     :return: list of tracing scripts
     """
-    tracers = []
+    if len(split_targets(cgid)) > 1:
+        logging.error("a command filter only supports a single cgroup")
+        sys.exit(1)
 
-    for tname, tpath in get_tracing_scripts("bpftrace/cgroup_and_command").items():
-        tracer = __new_tracer(tname, tpath, output_dir, rotate, rotate_size)
-        tracer.with_args([cgid, filter_command])
-        tracers.append(tracer)
+    return __new_tracers(
+        "cgroup_and_command", output_dir, options, args=[cgid, filter_command]
+    )
 
-    return tracers
 
-
-def handle_cgroup(
-    output_dir: str,
-    cgid: str,
-    rotate: bool = False,
-    rotate_size: int = 100 * 1024 * 1024,
-) -> list[Tracer]:
+def handle_cgroup(output_dir: str, cgid: str, options: TraceOptions) -> list[Tracer]:
     """Handle the cgroup tracing.
 
     running: bpftrace -o output bpftrace/cgroup/<tracer>.bt <cgroup>
+    with more than one cgroup, a single session traces all of them (cgroups mode).
 
     :param output_dir: tracing output directory
-    :param cgid: the cgroup to trace
-    :param rotate: enable rotate tracing
-    :param rotate_size: set the rotation size
+    :param cgid: the cgroup to trace, or comma separated cgroups
+    :param options: the tracing options (src/options.py)
     :return: list of tracing scripts
     """
-    tracers = []
+    cgids = split_targets(cgid)
+    if len(cgids) > 1:
+        return __new_tracers("cgroups", output_dir, options, targets=cgids)
+    return __new_tracers("cgroup", output_dir, options, args=cgids)
+
 
-    for tname, tpath in get_tracing_scripts("bpftrace/cgroup").items():
-        tracer = __new_tracer(tname, tpath, output_dir, rotate, rotate_size)
-        tracer.with_args([cgid])
+def handle_pods(
+    output_dir: str, daemon_pid: int, options: TraceOptions
+) -> list[Tracer]:
+    """Handle the pods tracing, the cgroups are attached while tracing (src/daemon.py).
+
+    running: bpftrace -o output bpftrace/pods/<tracer>.bt <daemon pid>
+
+    :param output_dir: tracing output directory
+    :param daemon_pid: the pid of the process that attaches the cgroups
+    :param options: the tracing options (src/options.py)
+    :return: list of tracing scripts
+    """
+    return __new_tracers("pods", output_dir, options, args=[str(daemon_pid)])
+
+
+def handle_live_metrics(
+    tracers: list[Tracer],
+    address: Optional[str] = None,
+    textfile: Optional[str] = None,
+    top_k: int = 20,
+) -> Optional[LiveMetrics]:
+    """Handle the live metrics of the rotate tracers.
+
+    :param tracers: the tracers of the session
+    :param address: serve the metrics over HTTP on this [host:]port
+    :param textfile: write the metrics into this node-exporter textfile
+    :param top_k: number of commands and files with their own counters
+    :return: the started live metrics (None if not asked), stop it after the session
+    """
+    if not address and not textfile:
+        return None
+
+    rotated = [tracer for tracer in tracers if isinstance(tracer, RotateTracer)]
+    if not rotated:
+        logging.error("live metrics read the tracer pipes, they require -r|--rotate")
+        sys.exit(1)
+    if textfile and not textfile.endswith(".prom"):
+        logging.error("the node-exporter textfile collector only reads .prom files")
+        sys.exit(1)
+
+    live = LiveMetrics(top_k=top_k, textfile=textfile)
+    for tracer in rotated:
+        tracer.with_live_metrics(live)
+    live.start()
+
+    if address:
+        try:
+            live.serve(address)
+        except (OSError, ValueError) as e:
+            logging.error(f"cannot serve live metrics at {address}: {e}")
+            sys.exit(1)
+
+    return live
+
+
+def __new_tracers(
+    mode: str,
+    output_dir: str,
+    options: TraceOptions,
+    args: Optional[list[str]] = None,
+    targets: Optional[list[str]] = None,
+) -> list[Tracer]:
+    """Create the tracers of a tracing mode, with the arguments of their scripts.
+    multi-target modes (cgroups, pids) take their targets in the rendered scripts.
+    """
+    tracers = []
+    for name, path in __get_scripts(mode, options, targets).items():
+        tracer = __new_tracer(name, path, output_dir, options)
+        if args:
+            tracer.with_args(args)
         tracers.append(tracer)
 
     return tracers
 
 
+def __get_scripts(
+    mode: str, options: TraceOptions, targets: Optional[list[str]] = None
+) -> dict[str, str]:
+    """Get the scripts of a tracing mode.
+    without runtime options, the pregenerated scripts in bpftrace/<mode> are used.
+    multi-target modes (cgroups, pids) are always rendered, with their targets.
+    """
+    dir_path = os.path.join("bpftrace", mode)
+    if options.rendered() or targets:
+        try:
+            dir_path = render_cached(
+                mode,
+                options.probes,
+                options.cache_dir,
+                options.sample,
+                options.rate_limit,
+                options.path_prefix,
+                targets,
+            )
+        except ValueError as e:
+            logging.error(f"rendering scripts failed: {e}")
+            sys.exit(1)
+
+    scripts = get_tracing_scripts(
+        dir_path, options.unified, options.aggregate, options.paired
+    )
+
+    # scripts that attach none of the selected probes are not rendered
+    return {
+        name: path
+        for name, path in scripts.items()
+        if not options.probes or os.path.isfile(path)
+    }
+
+
 def __new_tracer(
-    name: str, path: str, output_dir: str, rotate: str, rotate_size: int
+    name: str, path: str, output_dir: str, options: TraceOptions
 ) -> Tracer:
     """Create a new tracer based on the inputs.
     it also checks if the tracer script exists.
     """
     ensure_script(path)
 
-    if rotate:
+    compress = options.compress
+    if compress == "auto":
+        compress = default_codec()
+    elif compress == "zstd" and zstandard is None:
+        logging.error("zstd compression requires the zstandard package")
+        sys.exit(1)
+
+    if options.rotate:
         tracer = RotateTracer(name, path, output_dir)
-        tracer.with_rotate_size(rotate_size=rotate_size)
+        tracer.with_rotate_size(
+            rotate_size=options.rotate_size, rotate_interval=options.rotate_interval
+        )
+        tracer.with_retention(compress, options.max_bytes, options.max_segments)
     else:
         tracer = MonoTracer(name, path, output_dir)
 
+    tracer.with_options(SCRIPT_OPTIONS.get(name, []))
+
     return tracer
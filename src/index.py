@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import re
+from typing import Iterable, Iterator, Optional
+
+from src.parser.reader import list_segments, open_segment
+
+# the sidecar of trace_<tracer>_<index>.log[.gz|.zst] is trace_<tracer>_<index>.log.idx
+INDEX_SUFFIX = ".idx"
+
+# number of events per indexed block
+INDEX_EVERY = 4096
+
+INDEX_VERSION = 1
+
+# timestamp, pid and command of an event line
+_HEADER = re.compile(rb"^(\d+) \{pid=(-?\d+) tid=-?\d+ proc=(.*?)\}", re.M)
+
+# size of the reads when an index is built from an existing segment
+_BUILD_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class SegmentIndexer:
+    """SegmentIndexer summarizes a segment, fed in chunks of any size.
+
+    It keeps the time range, the pids and the commands of the segment, and
+    splits it into blocks of `every` events with their byte offset and time
+    range. A query only reads the blocks that overlap its time range, and the
+    per-block range stays correct when bpftrace prints events out of order.
+    """
+
+    def __init__(self, every: int = INDEX_EVERY):
+        """SegmentIndexer constructor.
+
+        :param every: number of events per block
+        """
+        self._every = every
+        self._size = 0  # bytes fed so far
+        self._carry = None  # start of a line that continues in the next chunk
+        self._carry_at = 0  # offset of that line
+        self._pids = set()
+        self._comms = set()
+        self._blocks = []  # [offset, min ts, max ts, events]
+
+    def __scan(self, data: bytes, start: int, stop: int, base: int):
+        """Index the complete lines of data[start:stop], data[0] is at offset base."""
+        found = _HEADER.findall(data, start, stop)
+        if not found:
+            return
+
+        stamps, pids, comms = zip(*found)
+        self._pids.update(pids)
+        self._comms.update(comms)
+        tss = list(map(int, stamps))
+
+        i = 0
+        while i < len(tss):
+            if not self._blocks or self._blocks[-1][3] >= self._every:
+                # a new block starts at the line of the i-th event
+                line = re.compile(rb"^" + stamps[i] + rb" \{", re.M)
+                offset = base + line.search(data, start, stop).start()
+                self._blocks.append([offset, tss[i], tss[i], 0])
+
+            block = self._blocks[-1]
+            j = min(len(tss), i + self._every - block[3])
+            part = tss[i:j]
+            block[1] = min(block[1], min(part))
+            block[2] = max(block[2], max(part))
+            block[3] += j - i
+            i = j
+
+    def feed(self, data: bytes):
+        """Index the next chunk of the segment.
+
+        :param data: bytes appended to the segment (any split of the lines)
+        """
+        data = bytes(data)
+        base = self._size
+        self._size += len(data)
+
+        start = 0
+        if self._carry is not None:
+            end = data.find(b"\n") + 1
+            if end == 0:
+                self._carry += data
+                return
+            line = self._carry + data[:end]
+            self.__scan(line, 0, len(line), self._carry_at)
+            self._carry = None
+            start = end
+
+        stop = max(data.rfind(b"\n", start) + 1, start)
+        if stop < len(data):
+            self._carry = data[stop:]
+            self._carry_at = base + stop
+
+        self.__scan(data, start, stop, base)
+
+    def summary(self) -> dict:
+        """Finish the last line and get the index of the segment."""
+        if self._carry is not None:
+            self.__scan(self._carry, 0, len(self._carry), self._carry_at)
+            self._carry = None
+
+        return {
+            "version": INDEX_VERSION,
+            "size": self._size,
+            "every": self._every,
+            "events": sum(block[3] for block in self._blocks),
+            "min_ts": min((block[1] for block in self._blocks), default=None),
+            "max_ts": max((block[2] for block in self._blocks), default=None),
+            "pids": sorted(int(pid) for pid in self._pids),
+            "comms": sorted(comm.decode("utf-8", "replace") for comm in self._comms),
+            "blocks": self._blocks,
+        }
+
+    def save(self, path: str):
+        """Write the index next to its segment.
+
+        :param path: the segment path
+        """
+        with open(index_path(path), "w") as f:
+            json.dump(self.summary(), f, separators=(",", ":"))
+
+
+def index_path(path: str) -> str:
+    """Get the sidecar path of a segment, the same for its compressed file.
+
+    :param path: the segment path
+    """
+    for suffix in (".gz", ".zst"):
+        if path.endswith(suffix):
+            path = path[: -len(suffix)]
+    return path + INDEX_SUFFIX
+
+
+def build_index(path: str, every: int = INDEX_EVERY) -> dict:
+    """Index an existing segment and write its sidecar.
+
+    :param path: the segment path
+    :param every: number of events per block
+    :return: the index
+    """
+    indexer = SegmentIndexer(every)
+    with open_segment(path) as f:
+        while chunk := f.read(_BUILD_CHUNK_SIZE):
+            indexer.feed(chunk)
+
+    try:
+        indexer.save(path)
+    except OSError as e:
+        logging.warning(f"cannot save the index of {path}: {e}")
+
+    return indexer.summary()
+
+
+def load_index(path: str) -> dict:
+    """Read the index of a segment, and build it if it is missing or stale.
+
+    :param path: the segment path
+    :return: the index
+    """
+    try:
+        with open(index_path(path)) as f:
+            index = json.load(f)
+        # compressed segments are never written again
+        fresh = path.endswith((".gz", ".zst")) or (
+            index["size"] == os.path.getsize(path)
+        )
+        if index.get("version") == INDEX_VERSION and fresh:
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+
+    logging.debug(f"indexing {path}")
+    return build_index(path)
+
+
+def _ranges(index: dict, start: Optional[int], end: Optional[int]) -> list:
+    """Get the byte ranges of the blocks that overlap [start, end] (adjacent ones joined)."""
+    ranges = []
+    blocks = index["blocks"]
+    for i, (offset, min_ts, max_ts, _) in enumerate(blocks):
+        if (start is not None and max_ts < start) or (end is not None and min_ts > end):
+            continue
+        stop = blocks[i + 1][0] if i + 1 < len(blocks) else index["size"]
+        if ranges and ranges[-1][1] == offset:
+            ranges[-1][1] = stop
+        else:
+            ranges.append([offset, stop])
+    return ranges
+
+
+def query(
+    path: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    pids: Optional[Iterable[int]] = None,
+    comms: Optional[Iterable[str]] = None,
+    tracer: Optional[str] = None,
+) -> Iterator[bytes]:
+    """Stream the event lines that match a time window, pids and commands.
+
+    Segments are skipped by their index, and only the blocks that overlap the
+    window are read (compressed segments are decompressed up to the first block).
+    Lines are yielded per tracer in log order.
+
+    :param path: an output directory or a single segment file
+    :param start: first timestamp in nanoseconds (bpftrace nsecs)
+    :param end: last timestamp in nanoseconds
+    :param pids: only keep these pids
+    :param comms: only keep these commands
+    :param tracer: only read the segments of this tracer
+    :return: raw lines
+    """
+    pids = None if pids is None else set(pids)
+    comms = None if comms is None else set(comms)
+    raw_comms = None if comms is None else {comm.encode() for comm in comms}
+
+    for segment in list_segments(path, tracer):
+        index = load_index(segment)
+        if index["min_ts"] is None:
+            continue
+        if (start is not None and index["max_ts"] < start) or (
+            end is not None and index["min_ts"] > end
+        ):
+            continue
+        if pids is not None and pids.isdisjoint(index["pids"]):
+            continue
+        if comms is not None and comms.isdisjoint(index["comms"]):
+            continue
+
+        ranges = _ranges(index, start, end)
+        logging.debug(f"reading {len(ranges)} ranges of {segment}")
+        with open_segment(segment) as f:
+            pos = 0
+            for offset, stop in ranges:
+                if f.seekable():
+                    f.seek(offset)
+                else:  # zstd streams only read forward
+                    while pos < offset:
+                        pos += len(f.read(min(offset - pos, _BUILD_CHUNK_SIZE)))
+                pos = stop
+                for line in f.read(stop - offset).splitlines(keepends=True):
+                    match = _HEADER.match(line)
+                    if match is None:
+                        continue
+                    ts = int(match.group(1))
+                    if (start is not None and ts < start) or (
+                        end is not None and ts > end
+                    ):
+                        continue
+                    if pids is not None and int(match.group(2)) not in pids:
+                        continue
+                    if raw_comms is not None and match.group(3) not in raw_comms:
+                        continue
+                    yield line
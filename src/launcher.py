@@ -0,0 +1,149 @@
+import logging
+import os
+import shlex
+import signal
+import sys
+import threading
+import time
+from typing import Optional
+
+from src.tracer import Tracer
+
+# seconds to wait for the BEGIN output of every tracer (bpftrace compiles first)
+READY_TIMEOUT = 60.0
+
+# seconds between two checks of the tracers
+READY_POLL_INTERVAL = 0.01
+
+
+class Launcher:
+    """Launcher runs the command of the execute mode once, for every tracer.
+
+    The command is forked in a stopped state, the tracers trace its pid, and
+    it is released (SIGCONT) once every tracer printed its BEGIN output. The
+    session ends when the command exits, like `bpftrace -c` does.
+    """
+
+    def __init__(self, command: str, timeout: float = READY_TIMEOUT):
+        """Launcher constructor.
+
+        :param command: the command to execute (split like a shell does)
+        :param timeout: seconds to wait for the tracers before releasing anyway
+        """
+        self._argv = shlex.split(command)
+        self._timeout = timeout
+        self._tracers = []
+        self._pid = None
+        self._spawned = None  # monotonic time of the fork
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self.__run, name="launcher", daemon=True)
+
+    def spawn(self) -> int:
+        """Fork the command, stopped before its exec.
+
+        :return: the pid of the command
+        """
+        if not self._argv:
+            logging.error("empty command to execute")
+            sys.exit(1)
+
+        pid = os.fork()
+        if pid == 0:
+            # the child stops itself, the exec happens once it is released
+            try:
+                for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGPIPE):
+                    signal.signal(signum, signal.SIG_DFL)
+                os.kill(os.getpid(), signal.SIGSTOP)
+                os.execvp(self._argv[0], self._argv)
+            except OSError as e:
+                print(f"cannot execute {self._argv[0]}: {e}", file=sys.stderr)
+            finally:
+                os._exit(127)
+
+        # the tracers may only see the pid once it is stopped
+        os.waitpid(pid, os.WUNTRACED)
+        self._pid = pid
+        self._spawned = time.monotonic()
+
+        logging.info(f"command forked (stopped): {pid}")
+        return pid
+
+    def with_tracers(self, tracers: list[Tracer]):
+        """Set the tracers to wait for.
+
+        :param tracers: the tracers of the command's pid
+        """
+        self._tracers = tracers
+
+    def start(self):
+        """Release the command once the tracers are ready, in the background."""
+        self._thread.start()
+
+    def stop(self):
+        """Terminate the command if it is still running.
+
+        A command that was never released (the session failed before the
+        launcher started) is killed and reaped.
+        """
+        self._stopping.set()
+        if self._pid is None:
+            return
+
+        if self._thread.is_alive():
+            try:
+                os.kill(self._pid, signal.SIGTERM)
+                os.kill(self._pid, signal.SIGCONT)
+            except ProcessLookupError:
+                pass
+            self._thread.join()
+        elif self._thread.ident is None:
+            os.kill(self._pid, signal.SIGKILL)
+            os.waitpid(self._pid, 0)
+            logging.info(f"command killed before its release: {self._pid}")
+
+    def __wait_ready(self) -> Optional[bool]:
+        """Wait for the BEGIN output of every tracer.
+
+        :return: True when ready, False on timeout, None if the session ended
+        """
+        deadline = self._spawned + self._timeout
+        while time.monotonic() < deadline:
+            if all(tracer.ready() for tracer in self._tracers):
+                return True
+            for tracer in self._tracers:
+                # the supervisor reaps the tracers, running() turns false then
+                if tracer.process() is not None and not tracer.running():
+                    logging.error(f"[{tracer.name()}] exited before attaching")
+                    return None
+            if self._stopping.wait(READY_POLL_INTERVAL):
+                return None
+        return False
+
+    def __run(self):
+        """Release the command, wait for its exit and stop the tracers."""
+        ready = self.__wait_ready()
+        if ready is None:
+            os.kill(self._pid, signal.SIGKILL)
+        else:
+            if not ready:
+                logging.warning(
+                    f"tracers not attached after {self._timeout}s, "
+                    "releasing the command anyway"
+                )
+            logging.info(
+                f"command released after {time.monotonic() - self._spawned:.3f}s "
+                "of session startup"
+            )
+            os.kill(self._pid, signal.SIGCONT)
+        released = time.monotonic()
+
+        _, status = os.waitpid(self._pid, 0)
+        logging.info(
+            f"command exited: {os.waitstatus_to_exitcode(status)} "
+            f"({time.monotonic() - released:.3f}s)"
+        )
+
+        # the session ends with the command (unless it is already ending)
+        if not self._stopping.is_set():
+            for tracer in self._tracers:
+                tracer.stop()
@@ -0,0 +1,477 @@
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from src.parser import parse_args
+
+# chunks waiting for the live consumer, more are skipped (never waited for)
+LIVE_QUEUE_CHUNKS = 64
+
+# number of commands and files kept with their counters
+LIVE_TOP_K = 20
+
+# seconds of the rolling window of the per-second rates
+LIVE_WINDOW = 10
+
+# the consumer parses at most this share of each second (the rest is for the drain)
+LIVE_CPU_SHARE = 0.1
+
+# latency histogram buckets: powers of two from 1.024us (2^10 ns) to 8.6s (2^33 ns)
+_LATENCY_MIN_BITS = 10
+_LATENCY_BUCKETS = 24
+
+# the fields of a trace line that the live metrics count
+_CALL = re.compile(
+    rb"^(\d+) \{pid=-?\d+ tid=(-?\d+) proc=(.*?)\}\{(EN|EX|PA) (\w+)\}\{(.*)\}$", re.M
+)
+
+# operations that only print an `EN` line (see src/parser/records.py)
+_SINGLE_SHOT_OPS = frozenset({b"fork", b"exec", b"process", b"target"})
+
+# enter events waiting for their exit, more are dropped (their exits were lost)
+_PENDING_LIMIT = 1 << 16
+
+# parsed argument sections
+_bodies: dict[bytes, dict] = {}
+_BODIES_LIMIT = 1 << 16
+
+
+class TopK:
+    """TopK keeps the heaviest keys of a stream in constant memory (Space-Saving).
+
+    A new key takes the place of the lightest one when the table is full and
+    inherits its weight, so a counter may be over by at most the weight it
+    inherited, and a key heavier than total / k is never evicted.
+    """
+
+    def __init__(self, k: int):
+        """TopK constructor.
+
+        :param k: maximum number of keys
+        """
+        self._k = k
+        self._items = {}  # key => [weight, ops, bytes]
+
+    def add(self, key: tuple, weight: int, ops: int, nbytes: int):
+        """Count a call of a key.
+
+        :param key: the counted key
+        :param weight: the rank of the key grows by this
+        :param ops: number of calls
+        :param nbytes: transferred bytes
+        """
+        item = self._items.get(key)
+        if item is None:
+            if len(self._items) >= self._k:
+                lightest = min(self._items, key=lambda k: self._items[k][0])
+                item = self._items.pop(lightest)
+            else:
+                item = [0, 0, 0]
+            self._items[key] = item
+        item[0] += weight
+        item[1] += ops
+        item[2] += nbytes
+
+    def items(self) -> dict[tuple, tuple[int, int]]:
+        """Get the kept keys with their (ops, bytes) counters."""
+        return {key: (item[1], item[2]) for key, item in self._items.items()}
+
+
+def _args(body: bytes) -> dict:
+    """Parse an argument section, most of them repeat (e.g. `fd=3 count=4096`)."""
+    args = _bodies.get(body)
+    if args is None:
+        if len(_bodies) >= _BODIES_LIMIT:
+            _bodies.clear()
+        args = _bodies[body] = parse_args(body)
+    return args
+
+
+def _tally(
+    tally: dict,
+    latency: dict,
+    op: bytes,
+    comm: bytes,
+    args: dict,
+    ret: Optional[int],
+    took: Optional[int],
+):
+    """Count a call in the tallies of a chunk."""
+    nbytes = ret if ret and ret > 0 and "count" in args else 0
+    key = (op, comm, args.get("fname"))
+    counters = tally.get(key)
+    if counters is None:
+        counters = tally[key] = [0, 0]
+    counters[0] += 1
+    counters[1] += nbytes
+
+    if took is not None:
+        key = (op, max(took.bit_length() - _LATENCY_MIN_BITS, 0))
+        counters = latency.get(key)
+        if counters is None:
+            counters = latency[key] = [0, 0]
+        counters[0] += 1
+        counters[1] += took
+
+
+class _Stream:
+    """Parse state of one tracer: the start of a split line and the calls in flight."""
+
+    def __init__(self):
+        self.carry = b""
+        self.gap = False  # a chunk was not queued (drain side)
+        self.skipping = False  # a chunk was not parsed (consumer side)
+        self.pending = {}
+
+
+def _escape(value) -> str:
+    """Escape a Prometheus label value."""
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+class LiveMetrics:
+    """LiveMetrics aggregates the tracer output while it is written.
+
+    The rotate tracers offer their chunks without waiting: when the consumer
+    thread is behind, or already used its cpu share of the second, chunks are
+    skipped and counted, so the pipe drain never slows down for the metrics.
+    Memory is constant: counters per operation, the top-k commands and files,
+    and a fixed latency histogram per operation.
+
+    The metrics are served in the Prometheus text format over HTTP, or written
+    into a node-exporter textfile every interval.
+    """
+
+    def __init__(
+        self,
+        top_k: int = LIVE_TOP_K,
+        textfile: Optional[str] = None,
+        interval: float = 5.0,
+        window: int = LIVE_WINDOW,
+        cpu_share: float = LIVE_CPU_SHARE,
+    ):
+        """LiveMetrics constructor.
+
+        :param top_k: number of commands and files with their own counters
+        :param textfile: write the metrics into this file (must end with .prom)
+        :param interval: seconds between two textfile writes
+        :param window: seconds of the rolling per-second rates
+        :param cpu_share: share of each second the consumer may spend parsing
+        """
+        self._textfile = textfile
+        self._interval = interval
+        self._cpu_share = cpu_share
+
+        self._queue = queue.Queue(LIVE_QUEUE_CHUNKS)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._server = None
+
+        self._streams = {}  # tracer name => _Stream
+        self._coverage = {}  # tracer name => [offered bytes, parsed bytes, lines]
+        self._ops = {}  # (tracer, op) => [calls, bytes]
+        self._latency = {}  # (tracer, op) => [bucket counts..., count, sum in ns]
+        self._comms = TopK(top_k)
+        self._files = TopK(top_k)
+        self._window = deque(maxlen=window + 1)  # (monotonic time, rate counters)
+
+    def offer(self, tracer: str, chunk: bytes):
+        """Queue a chunk of tracer output, or skip it if the consumer is behind.
+
+        :param tracer: the tracer name
+        :param chunk: raw bytes read from the tracer pipe
+        """
+        if tracer not in self._streams:
+            self._streams[tracer] = _Stream()
+            self._coverage[tracer] = [0, 0, 0]
+        self._coverage[tracer][0] += len(chunk)
+        stream = self._streams[tracer]
+        try:
+            self._queue.put_nowait((tracer, chunk, stream.gap))
+            stream.gap = False
+        except queue.Full:
+            stream.gap = True
+
+    def start(self):
+        """Start the consumer thread."""
+        self._thread = threading.Thread(
+            target=self.__consume, name="live-metrics", daemon=True
+        )
+        self._thread.start()
+
+    def serve(self, address: str):
+        """Serve the metrics over HTTP at /metrics.
+
+        :param address: [host:]port to listen on (every interface without host)
+        """
+        host, _, port = address.rpartition(":")
+        live = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = live.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f"metrics request: {format % args}")
+
+        self._server = ThreadingHTTPServer((host, int(port)), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever, name="live-metrics-http", daemon=True
+        ).start()
+        logging.info(f"serving live metrics at http://{address}/metrics")
+
+    def stop(self):
+        """Parse the queued chunks, write the last textfile and stop the server."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+        if self._textfile:
+            self.__write_textfile()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __consume(self):
+        """Parse the queued chunks within the cpu share (consumer thread)."""
+        second, busy = time.monotonic(), 0.0
+        next_write = second + self._interval
+        self.__snapshot(second)
+
+        while True:
+            try:
+                item = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                item = ()
+
+            if item is None:
+                return
+
+            now = time.monotonic()
+            if now - second >= 1.0:
+                self.__snapshot(now)
+                second, busy = now, 0.0
+            if self._textfile and now >= next_write:
+                self.__write_textfile()
+                next_write = now + self._interval
+
+            if not item:
+                continue
+
+            tracer, chunk, gap = item
+            if gap:
+                self._streams[tracer].skipping = True
+            if busy >= self._cpu_share:
+                self._streams[tracer].skipping = True
+                continue
+
+            start = time.perf_counter()
+            self.__feed(tracer, chunk)
+            busy += time.perf_counter() - start
+
+    def __feed(self, tracer: str, chunk: bytes):
+        """Parse the complete lines of a chunk and count their calls.
+
+        The calls are tallied per (op, comm, file) in the chunk first, so the
+        shared counters and the top-k tables are updated once per distinct key.
+        """
+        stream = self._streams[tracer]
+        if stream.skipping:
+            # the previous chunk was skipped, this one starts in the middle of a line
+            stream.skipping = False
+            stream.carry = b""
+            cut = chunk.find(b"\n") + 1
+            if cut == 0:
+                stream.skipping = True
+                return
+            chunk = chunk[cut:]
+
+        data = stream.carry + chunk
+        cut = data.rfind(b"\n") + 1
+        stream.carry = data[cut:]
+
+        pending = stream.pending
+        if len(pending) > _PENDING_LIMIT:
+            pending.clear()  # enter events whose exit was lost
+
+        tally = {}  # (op, comm, fname) => [calls, bytes]
+        latency = {}  # (op, bucket) => [calls, sum in ns]
+        lines = 0
+        for ts, tid, comm, kind, op, body in _CALL.findall(data, 0, cut):
+            lines += 1
+            if kind == b"EN":
+                if op in _SINGLE_SHOT_OPS:
+                    _tally(tally, latency, op, comm, _args(body), None, None)
+                    continue
+                stale = pending.get((tid, op))
+                if stale is not None:
+                    _tally(tally, latency, op, stale[1], _args(stale[2]), None, None)
+                pending[(tid, op)] = (ts, comm, body)
+                continue
+
+            args = _args(body)
+            ret = args.get("ret")
+            if kind == b"PA":
+                _tally(tally, latency, op, comm, args, ret, args.get("latency"))
+                continue
+
+            entry = pending.pop((tid, op), None)
+            if entry is None:
+                _tally(tally, latency, op, comm, {}, ret, None)
+            else:
+                enter, comm, body = entry
+                _tally(tally, latency, op, comm, _args(body), ret, int(ts) - int(enter))
+
+        with self._lock:
+            coverage = self._coverage[tracer]
+            coverage[1] += len(chunk)
+            coverage[2] += lines
+
+            for (op, comm, fname), (calls, nbytes) in tally.items():
+                op, comm = op.decode(), comm.decode("utf-8", "replace")
+                counters = self._ops.get((tracer, op))
+                if counters is None:
+                    counters = self._ops[(tracer, op)] = [0, 0]
+                counters[0] += calls
+                counters[1] += nbytes
+
+                self._comms.add((tracer, comm), calls, calls, nbytes)
+                if fname:
+                    self._files.add((tracer, fname), nbytes or calls, calls, nbytes)
+
+            for (op, bucket), (calls, total) in latency.items():
+                key = (tracer, op.decode())
+                hist = self._latency.get(key)
+                if hist is None:
+                    hist = self._latency[key] = [0] * (_LATENCY_BUCKETS + 2)
+                if bucket < _LATENCY_BUCKETS:
+                    hist[bucket] += calls
+                hist[-2] += calls
+                hist[-1] += total
+
+    def __rated(self) -> dict[tuple, tuple[int, int]]:
+        """Get every counter that has a per-second rate, keyed by series."""
+        counters = {("op",) + key: tuple(value) for key, value in self._ops.items()}
+        for key, value in self._comms.items().items():
+            counters[("comm",) + key] = value
+        for key, value in self._files.items().items():
+            counters[("file",) + key] = value
+        return counters
+
+    def __snapshot(self, now: float):
+        with self._lock:
+            self._window.append((now, self.__rated()))
+
+    def render(self) -> str:
+        """Get the metrics in the Prometheus text format."""
+        with self._lock:
+            counters = self.__rated()
+            latency = {key: list(hist) for key, hist in self._latency.items()}
+            coverage = {key: list(value) for key, value in self._coverage.items()}
+            window = list(self._window)
+
+        # the totals only count the parsed chunks, the rates are scaled up to the
+        # whole output of the tracer
+        scale = {
+            tracer: offered / parsed
+            for tracer, (offered, parsed, _) in coverage.items()
+            if parsed
+        }
+
+        # rate of each series since the oldest snapshot of the window that has it
+        rates = {}
+        now = time.monotonic()
+        for key, (ops, nbytes) in counters.items():
+            for then, previous in window:
+                if key in previous and now > then:
+                    ops_then, bytes_then = previous[key]
+                    rates[key] = (
+                        (ops - ops_then) / (now - then),
+                        (nbytes - bytes_then) / (now - then),
+                    )
+                    break
+
+        lines = []
+
+        def family(name: str, kind: str, text: str):
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        dims = {
+            "op": ("op", "per operation"),
+            "comm": ("comm", "per command (top-k)"),
+            "file": ("path", "per file (top-k)"),
+        }
+        for dim, (label, text) in dims.items():
+            series = {k[1:]: v for k, v in counters.items() if k[0] == dim}
+            for index, unit in ((0, "calls"), (1, "bytes")):
+                name = f"flak_{dim}_{unit}_total"
+                family(name, "counter", f"Traced {unit} {text}.")
+                for (tracer, value), numbers in sorted(series.items()):
+                    lines.append(
+                        f"{name}{{{_labels(tracer=tracer, **{label: value})}}} "
+                        f"{numbers[index]}"
+                    )
+
+                name = f"flak_{dim}_{unit}_per_second"
+                family(name, "gauge", f"Estimated {unit} per second {text}.")
+                for (tracer, value), numbers in sorted(series.items()):
+                    rate = rates.get((dim, tracer, value))
+                    if rate is not None:
+                        lines.append(
+                            f"{name}{{{_labels(tracer=tracer, **{label: value})}}} "
+                            f"{rate[index] * scale.get(tracer, 1.0):.3f}"
+                        )
+
+        name = "flak_op_latency_seconds"
+        family(name, "histogram", "Latency of the paired calls per operation.")
+        for (tracer, op), hist in sorted(latency.items()):
+            labels = _labels(tracer=tracer, op=op)
+            total = 0
+            for bucket in range(_LATENCY_BUCKETS):
+                total += hist[bucket]
+                le = (1 << (bucket + _LATENCY_MIN_BITS)) / 1e9
+                lines.append(f'{name}_bucket{{{labels},le="{le:g}"}} {total}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist[-2]}')
+            lines.append(f"{name}_sum{{{labels}}} {hist[-1] / 1e9:.9f}")
+            lines.append(f"{name}_count{{{labels}}} {hist[-2]}")
+
+        for index, (name, text) in enumerate(
+            (
+                ("flak_live_offered_bytes_total", "Bytes read from the tracer pipe."),
+                ("flak_live_parsed_bytes_total", "Bytes parsed for the live metrics."),
+                ("flak_live_lines_total", "Lines parsed for the live metrics."),
+            )
+        ):
+            family(name, "counter", text)
+            for tracer, value in sorted(coverage.items()):
+                lines.append(f"{name}{{{_labels(tracer=tracer)}}} {value[index]}")
+
+        return "\n".join(lines) + "\n"
+
+    def __write_textfile(self):
+        """Write the metrics for the node-exporter textfile collector (atomically)."""
+        try:
+            with open(self._textfile + ".tmp", "w") as f:
+                f.write(self.render())
+            os.replace(self._textfile + ".tmp", self._textfile)
+        except OSError as e:
+            logging.warning(f"cannot write {self._textfile}: {e}")
@@ -1,34 +1,198 @@
 import logging
+import os
+import selectors
+import time
+from typing import Optional
 
 from src.files import create_dir
+from src.stats import StatsRecorder
+from src.targets import export_targets
 from src.timestamp import export_reference_timestamps
 from src.tracer import Tracer
 
+# poll interval when the kernel does not support pidfd (Linux < 5.3)
+FALLBACK_POLL_INTERVAL = 0.2
 
-def ignite_tracing(output_dir: str, tracers: list[Tracer]):
+# selector event kinds
+_WAKE, _STREAM, _EXIT = range(3)
+
+
+class Supervisor:
+    """Supervisor owns every bpftrace child and multiplexes them in one loop.
+
+    Output pipes, process exits (pidfd) and stop requests (self-pipe) are
+    all descriptors in one selector, so the loop sleeps until something
+    happens and reacts to it immediately.
+    """
+
+    def __init__(self, tracers: list[Tracer], stats: Optional[StatsRecorder] = None):
+        """Supervisor constructor.
+
+        :param tracers: a list of tracers to run
+        :param stats: writes the tracer counters periodically and at the end
+        """
+        self._tracers = tracers
+        self._stats = stats
+        self._sel = selectors.DefaultSelector()
+        self._live = {}  # tracer name => tracer, for tracers that are not reaped
+        self._pidfds = {}  # tracer name => pidfd
+
+        # self-pipe to wake up the loop from signal handlers and other threads
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._sel.register(self._wake_r, selectors.EVENT_READ, (_WAKE, None))
+
+    def wake(self):
+        """Wake up the loop (signal-safe)."""
+        try:
+            os.write(self._wake_w, b"\0")
+        except BlockingIOError:
+            pass  # the loop is already awake
+
+    def __watch(self, tracer: Tracer):
+        """Start a tracer and register its pipes and process."""
+        tracer.with_waker(self.wake)
+        proc = tracer.start()
+        self._live[tracer.name()] = tracer
+
+        for fd in tracer.streams():
+            self._sel.register(fd, selectors.EVENT_READ, (_STREAM, tracer))
+
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except (AttributeError, OSError):
+            logging.debug(f"[{tracer.name()}] pidfd not supported, polling for exit")
+            return
+
+        self._pidfds[tracer.name()] = pidfd
+        self._sel.register(pidfd, selectors.EVENT_READ, (_EXIT, tracer))
+
+    def __unregister(self, fd: int):
+        try:
+            self._sel.unregister(fd)
+        except KeyError:
+            pass
+
+    def __reap(self, tracer: Tracer):
+        """Collect an exited tracer and flush what is left in its pipes."""
+        code = tracer.process().wait()
+        logging.debug(f"[{tracer.name()}] exited with code {code}")
+
+        for fd in tracer.streams():
+            if fd in self._sel.get_map():
+                try:
+                    while tracer.drain(fd):
+                        pass
+                except BlockingIOError:
+                    pass  # the pipe is still held open by a child of bpftrace
+                self.__unregister(fd)
+
+        pidfd = self._pidfds.pop(tracer.name(), None)
+        if pidfd is not None:
+            self.__unregister(pidfd)
+            os.close(pidfd)
+
+        tracer.finish()
+        del self._live[tracer.name()]
+
+    def __timeout(self) -> Optional[float]:
+        """Time until the next deadline (None to sleep until an event)."""
+        deadlines = [t.deadline() for t in self._live.values() if t.deadline()]
+        timeout = None
+        if deadlines:
+            timeout = max(0.0, min(deadlines) - time.monotonic())
+        if len(self._pidfds) < len(self._live):
+            timeout = min(timeout or FALLBACK_POLL_INTERVAL, FALLBACK_POLL_INTERVAL)
+        if self._stats:
+            wait = max(0.0, self._stats.deadline() - time.monotonic())
+            timeout = wait if timeout is None else min(timeout, wait)
+        return timeout
+
+    def run(self):
+        """Start the tracers and supervise them until all of them exit."""
+        for tracer in self._tracers:
+            logging.info(f"starting {tracer.name()} ...")
+            try:
+                self.__watch(tracer)
+            except Exception as e:
+                logging.error(f"[{tracer.name()}] failed: {e}")
+
+        logging.info("all tracers started")
+
+        while self._live:
+            for key, _ in self._sel.select(self.__timeout()):
+                kind, tracer = key.data
+                if kind == _WAKE:
+                    while True:
+                        try:
+                            if not os.read(self._wake_r, 512):
+                                break
+                        except BlockingIOError:
+                            break
+                elif kind == _STREAM:
+                    try:
+                        if not tracer.drain(key.fd):
+                            self.__unregister(key.fd)
+                    except BlockingIOError:
+                        pass
+                elif kind == _EXIT and tracer.name() in self._live:
+                    self.__reap(tracer)
+
+            now = time.monotonic()
+            for tracer in list(self._live.values()):
+                if (
+                    tracer.name() not in self._pidfds
+                    and tracer.process().poll() is not None
+                ):
+                    self.__reap(tracer)
+                elif tracer.deadline() and now >= tracer.deadline():
+                    tracer.kill()
+
+            if self._stats and now >= self._stats.deadline():
+                self._stats.write()
+
+        if self._stats:
+            self._stats.write(final=True)
+
+        # late stop requests (signals, the launcher) must not write to a closed pipe
+        for tracer in self._tracers:
+            tracer.with_waker(None)
+        self._sel.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+
+def ignite_tracing(
+    output_dir: str,
+    tracers: list[Tracer],
+    targets: Optional[list[dict]] = None,
+    fresh: bool = True,
+):
     """Start the tracers.
 
     :param output_dir: the output directory to store tracing results
     :param tracers: a list of tracers to run
+    :param targets: the targets of a multi-target session, in the order of their tags
+    :param fresh: empty the output directory first (False when it is already set up)
     """
     # create the output directory
-    create_dir(output_dir)
-    logging.debug("output directory initialized")
+    if fresh:
+        create_dir(output_dir)
+        logging.debug("output directory initialized")
 
     # store the reference timestamps to convert raw clock numbers to datetime
     export_reference_timestamps(output_dir)
     logging.debug("reference timestamps exported")
 
-    # loop over tracers and start
-    for tracer in tracers:
-        logging.info(f"starting {tracer.name()} ...")
-        tracer.start()
-    
-    logging.info("all tracers started")
+    # store the names of the targets, events are tagged with their position
+    if targets:
+        export_targets(output_dir, targets)
+
+    # start and supervise all tracers in one loop, with their counters in stats.json
+    Supervisor(tracers, StatsRecorder(output_dir, tracers)).run()
 
-    # wait for all tracers
-    for tracer in tracers:
-        tracer.wait()
+    logging.info("all tracers stopped")
 
 
 def extinguish_tracing(tracers: list[Tracer]):
@@ -42,11 +206,9 @@ def extinguish_tracing(tracers: list[Tracer]):
         if signum is not None:
             logging.info(f"received signal {signum}, shutting down safely ...")
 
-        # loop over tracers and stop them
+        # ask every tracer to stop, the supervisor waits for all of them in parallel
         for tracer in tracers:
             logging.info(f"stopping {tracer.name()} ...")
             tracer.stop()
-        
-        logging.info("all tracers stopped")
 
     return handle_shutdown
@@ -0,0 +1,215 @@
+import argparse
+from dataclasses import dataclass
+from typing import Optional
+
+from src.utils import parse_perf_rb_pages
+
+
+def add_trace_arguments(parser: argparse.ArgumentParser):
+    """Add the output, bpftrace and tracing options shared by app.py and boot.py.
+
+    :param parser: the argument parser of an entrypoint
+    """
+    parser.add_argument(
+        "-o",
+        "--out",
+        default="logs",
+        help="Folder path to export the tracing logs (default: logs)",
+    )
+    parser.add_argument(
+        "-mxsl",
+        "--max_str_len",
+        default="150",
+        help="bpf MAX_STRLEN in bytes (default: 150)",
+    )
+    parser.add_argument(
+        "-mmk",
+        "--max_map_keys",
+        default="16384",
+        help="bpf map size in keys, for the path table and the aggregate maps of each interval (default: 16384)",
+    )
+    parser.add_argument(
+        "-rb",
+        "--perf_rb_pages",
+        type=parse_perf_rb_pages,
+        help="bpf perf ring buffer pages per cpu, a power of two or auto to size it from the free memory (default: bpftrace default, 64)",
+    )
+    parser.add_argument(
+        "-d",
+        "--debug",
+        action="store_true",
+        help="Enable debug mode (print debug messages)",
+    )
+    parser.add_argument(
+        "-r",
+        "--rotate",
+        action="store_true",
+        help="Enable log rotation (useful to break large tracing log output)",
+    )
+    parser.add_argument(
+        "-rs",
+        "--rotate_size",
+        type=int,
+        default=100 * 1024 * 1024,
+        help="Setting the rotate size (default is 100MB)",
+    )
+    parser.add_argument(
+        "-u",
+        "--unified",
+        action="store_true",
+        help="Run io and memory probes in one bpftrace process (each probe attached once)",
+    )
+    parser.add_argument(
+        "-ag",
+        "--aggregate",
+        action="store_true",
+        help="Aggregate counts, bytes and latency histograms in kernel and print json summaries every interval (set in tracers.json)",
+    )
+    parser.add_argument(
+        "-pa",
+        "--paired",
+        action="store_true",
+        help="Print one line per call with its arguments, return value and latency (instead of EN/EX lines)",
+    )
+    parser.add_argument(
+        "-pr",
+        "--probes",
+        type=lambda value: [name.strip() for name in value.split(",") if name.strip()],
+        help="Only attach these probes, comma separated (e.g. read,pread64,mmap,page_fault_user)",
+    )
+    parser.add_argument(
+        "-cd",
+        "--cache_dir",
+        help="Folder path to cache the scripts rendered for runtime options (default: ~/.cache/flak/bpftrace)",
+    )
+    parser.add_argument(
+        "-sa",
+        "--sample",
+        type=int,
+        default=1,
+        help="Only trace 1 in N files (fds) of each process, and 1 in N pages for page faults (default: 1)",
+    )
+    parser.add_argument(
+        "-rl",
+        "--rate_limit",
+        type=int,
+        default=0,
+        help="Maximum events per second of each process, extra events are dropped in kernel (default: 0, no limit)",
+    )
+    parser.add_argument(
+        "-pp",
+        "--path_prefix",
+        type=lambda value: [path.strip() for path in value.split(",") if path.strip()],
+        help="Only trace files under these absolute path prefixes, comma separated (e.g. /data/,/var/lib/db/)",
+    )
+    parser.add_argument(
+        "-ri",
+        "--rotate_interval",
+        type=float,
+        default=0,
+        help="Also rotate log files older than this many seconds (default: 0, size only)",
+    )
+    parser.add_argument(
+        "-cz",
+        "--compress",
+        nargs="?",
+        const="auto",
+        choices=["auto", "gzip", "zstd"],
+        help="Compress closed log files in background, auto picks zstd if installed, else gzip (default: off)",
+    )
+    parser.add_argument(
+        "-mb",
+        "--max_bytes",
+        type=int,
+        default=0,
+        help="Delete the oldest log files when all of them exceed this size in bytes (default: 0, no limit)",
+    )
+    parser.add_argument(
+        "-ms",
+        "--max_segments",
+        type=int,
+        default=0,
+        help="Delete the oldest log files when there are more than this number (default: 0, no limit)",
+    )
+    parser.add_argument(
+        "-ma",
+        "--metrics_address",
+        help="Serve live Prometheus metrics of the traced I/O at [host:]port/metrics, requires -r (default: off)",
+    )
+    parser.add_argument(
+        "-mt",
+        "--metrics_textfile",
+        help="Write live Prometheus metrics into this node-exporter textfile (.prom) every 5 seconds, requires -r (default: off)",
+    )
+    parser.add_argument(
+        "-mk",
+        "--metrics_top_k",
+        type=int,
+        default=20,
+        help="Number of commands and files with their own live metrics (default: 20)",
+    )
+
+
+@dataclass(frozen=True)
+class TraceOptions:
+    """TraceOptions holds the tracing options shared by every mode.
+
+    :param rotate: enable rotate tracing
+    :param rotate_size: set the rotation size
+    :param rotate_interval: also rotate files older than this (seconds, 0 to disable)
+    :param compress: compress closed files with gzip, zstd or auto (None for plain)
+    :param max_bytes: delete the oldest files above this total size (0 for no limit)
+    :param max_segments: delete the oldest files above this count (0 for no limit)
+    :param unified: run io and memory probes in a single bpftrace process
+    :param aggregate: aggregate events in kernel maps and print interval summaries
+    :param paired: print one line per call (arguments, ret and latency) at exit
+    :param probes: only attach these probes (scripts are rendered into the cache)
+    :param cache_dir: the directory of the rendered scripts
+    :param sample: keep 1 in `sample` fds (pages for page faults) of each process
+    :param rate_limit: maximum events per second of each process (0 for no limit)
+    :param path_prefix: only trace the files under these absolute path prefixes
+    """
+
+    rotate: bool = False
+    rotate_size: int = 100 * 1024 * 1024
+    rotate_interval: float = 0
+    compress: Optional[str] = None
+    max_bytes: int = 0
+    max_segments: int = 0
+    unified: bool = False
+    aggregate: bool = False
+    paired: bool = False
+    probes: Optional[list[str]] = None
+    cache_dir: Optional[str] = None
+    sample: int = 1
+    rate_limit: int = 0
+    path_prefix: Optional[list[str]] = None
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "TraceOptions":
+        """Build the options from the parsed arguments of an entrypoint.
+
+        :param args: the arguments of app.py or boot.py
+        """
+        return cls(
+            rotate=args.rotate,
+            rotate_size=args.rotate_size,
+            rotate_interval=args.rotate_interval,
+            compress=args.compress,
+            max_bytes=args.max_bytes,
+            max_segments=args.max_segments,
+            unified=args.unified,
+            aggregate=args.aggregate,
+            paired=args.paired,
+            probes=args.probes,
+            cache_dir=args.cache_dir,
+            sample=args.sample,
+            rate_limit=args.rate_limit,
+            path_prefix=args.path_prefix,
+        )
+
+    def rendered(self) -> bool:
+        """Check if the scripts must be rendered (the pregenerated ones lack the options)."""
+        return bool(
+            self.probes or self.sample != 1 or self.rate_limit or self.path_prefix
+        )
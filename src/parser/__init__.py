@@ -0,0 +1,37 @@
+# src.parser: streaming reader for FLAK trace logs
+from src.parser.aggregates import dropped_counts, iter_summaries
+from src.parser.merge import iter_merged_events, iter_merged_lines, write_timeline
+from src.parser.reader import (
+    group_segments,
+    iter_calls,
+    iter_events,
+    iter_lines,
+    iter_segment_events,
+    list_segments,
+    open_segment,
+    pair_events,
+    segment_info,
+)
+from src.parser.records import Call, Event
+from src.parser.tokenizer import parse_args, parse_line
+
+__all__ = [
+    "Call",
+    "Event",
+    "dropped_counts",
+    "group_segments",
+    "iter_calls",
+    "iter_events",
+    "iter_lines",
+    "iter_merged_events",
+    "iter_merged_lines",
+    "iter_segment_events",
+    "iter_summaries",
+    "list_segments",
+    "open_segment",
+    "pair_events",
+    "parse_args",
+    "parse_line",
+    "segment_info",
+    "write_timeline",
+]
@@ -0,0 +1,97 @@
+import json
+import logging
+import re
+from typing import Iterator, Optional
+
+from src.parser.reader import group_segments, iter_lines, list_segments
+
+# maps printed by templates/bpftrace/aggregate_trace.bt.j2 on each interval
+SUMMARY_MAPS = ("@ops", "@bytes", "@latency")
+
+# text map lines printed by templates/bpftrace/partials/dropped.bt.j2 at END
+_MAP_LINE = re.compile(
+    rb"^@(?P<name>\w+)(?:\[(?P<key>[^\]]*)\])?: (?P<value>-?\d+)\s*$"
+)
+
+
+def _split_key(key: str) -> tuple:
+    """Split a bpftrace json map key ("1234,cat,read,/data/a") into typed fields.
+
+    The path is the last field, so it keeps its commas.
+    """
+    pid, *fields = key.split(",", 3)
+    try:
+        pid = int(pid)
+    except ValueError:
+        pass
+    return (pid, *fields)
+
+
+def iter_summaries(path: str) -> Iterator[dict]:
+    """Stream the interval summaries of an aggregation log (bpftrace -f json).
+
+    Each summary holds the flush timestamp (ts) and the ops, bytes and
+    latency maps, keyed by (pid, comm, op, path) tuples.
+
+    :param path: a trace_aggregate_<n>.log file
+    """
+    summary = None
+    for line in iter_lines(path):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            logging.debug(f"skipping non-json line: {line[:80]}")
+            continue
+
+        data = record.get("data")
+        if not isinstance(data, dict):
+            continue
+
+        if "@flush_ts" in data:
+            if summary is not None:
+                yield summary
+            summary = {"ts": data["@flush_ts"], "ops": {}, "bytes": {}, "latency": {}}
+            continue
+
+        for name in SUMMARY_MAPS:
+            if summary is not None and name in data:
+                values = data[name] or {}
+                summary[name[1:]] = {_split_key(str(k)): v for k, v in values.items()}
+
+    if summary is not None:
+        yield summary
+
+
+def dropped_counts(path: str, tracer: Optional[str] = None) -> dict[str, dict]:
+    """Read the sampling settings and the dropped event counts of each tracer.
+
+    Sampled and rate-limited scripts print them at END, so only the last
+    segment of each tracer is read. Rate limits apply after sampling, so a
+    total can be estimated as (observed + `rate` drops) * `sample_every`.
+
+    :param path: an output directory or a single segment file
+    :param tracer: only read the segments of this tracer
+    :return: tracer => {"sample_every": n, "rate_limit": n, "dropped": {(reason, op): n}}
+    """
+    results = {}
+    for name, chain in group_segments(list_segments(path, tracer)).items():
+        stats = {"sample_every": 1, "rate_limit": 0, "dropped": {}}
+        found = False
+        for line in iter_lines(chain[-1]):
+            if not line.startswith(b"@"):
+                continue
+            match = _MAP_LINE.match(line)
+            if match is None:
+                continue
+
+            found = True
+            key, value = match.group("key"), int(match.group("value"))
+            if match.group("name") == b"dropped" and key is not None:
+                reason, op = (f.strip().strip('"') for f in key.decode().split(","))
+                stats["dropped"][(reason, op)] = value
+            elif match.group("name") in (b"sample_every", b"rate_limit"):
+                stats[match.group("name").decode()] = value
+
+        if found:
+            results[name] = stats
+    return results
@@ -0,0 +1,197 @@
+import heapq
+import logging
+import re
+from collections import deque
+from typing import Iterable, Iterator, Optional
+
+from src.parser.reader import group_segments, iter_lines, list_segments
+from src.parser.records import Event
+from src.parser.tokenizer import parse_line
+
+# the timestamp of an event line, the rest of the line is the same in every tracer
+_EVENT_TS = re.compile(rb"(\d+) \{")
+
+# the operation of an event line
+_EVENT_OP = re.compile(rb"\}\{(?:EN|EX|PA) (\w+)\}")
+
+# metadata operations, logged by every tracer (the meta probes of probes.json
+# and the process events of the begin sections)
+METADATA_OPS = frozenset(
+    {
+        b"creat",
+        b"open",
+        b"openat",
+        b"dup",
+        b"dup2",
+        b"dup3",
+        b"statfs",
+        b"statx",
+        b"newstat",
+        b"newlstat",
+        b"close",
+        b"fork",
+        b"exec",
+        b"process",
+        b"target",
+    }
+)
+
+# default reordering slack, bpftrace reads its per-cpu buffers one after another
+DEFAULT_SLACK_NS = 10_000_000
+
+
+def _reorder(
+    lines: Iterable[bytes], rank: int, slack: int
+) -> Iterator[tuple[int, int, int, bytes]]:
+    """Sort a nearly ordered log with a heap that only holds `slack` nanoseconds.
+
+    :param lines: raw lines of one tracer in log order
+    :param rank: tracer rank, breaks timestamp ties between tracers
+    :param slack: maximum disorder of the log in nanoseconds
+    :return: (ts, rank, seq, line) items in timestamp order, lines that are not
+        events (banners, END maps) are skipped
+    """
+    heap = []
+    newest = 0
+    for seq, line in enumerate(lines):
+        match = _EVENT_TS.match(line)
+        if match is None:
+            continue
+
+        ts = int(match.group(1))
+        if not line.endswith(b"\n"):
+            line += b"\n"
+        heapq.heappush(heap, (ts, rank, seq, line))
+
+        newest = max(newest, ts)
+        while heap[0][0] <= newest - slack:
+            yield heapq.heappop(heap)
+
+    while heap:
+        yield heapq.heappop(heap)
+
+
+def _chain_lines(chain: list[str]) -> Iterator[bytes]:
+    """Read the segments of a tracer as one stream."""
+    for path in chain:
+        logging.debug(f"merging {path}")
+        yield from iter_lines(path)
+
+
+def iter_merged_lines(
+    path: str,
+    tracers: Optional[Iterable[str]] = None,
+    slack: int = DEFAULT_SLACK_NS,
+    dedupe: bool = True,
+) -> Iterator[bytes]:
+    """Stream the event lines of every tracer as one timeline in timestamp order.
+
+    The rotated segments of a tracer follow each other in time, so each tracer
+    is one sorted stream and the streams are merged with a heap. Memory is bounded
+    by the number of tracers and the events of the last `slack` nanoseconds.
+
+    Metadata probes (open, close, dup, fork, exec) are attached by more than one
+    tracer. A metadata line that another tracer already logged within `slack` is
+    dropped, only the timestamps of the two copies differ. Other lines are never
+    dropped, two identical reads of a process are two calls.
+
+    :param path: an output directory or a single segment file
+    :param tracers: only merge these tracers (default: every tracer)
+    :param slack: maximum disorder of a log, and distance of two copies of an event
+    :param dedupe: drop the copies of metadata events
+    :return: raw lines ending with a newline
+    """
+    chains = group_segments(list_segments(path))
+    if tracers is not None:
+        chains = {name: chain for name, chain in chains.items() if name in tracers}
+
+    streams = [
+        _reorder(_chain_lines(chain), rank, slack)
+        for rank, chain in enumerate(chains.values())
+    ]
+    merged = heapq.merge(*streams)
+    if not dedupe or len(streams) < 2:
+        for _, _, _, line in merged:
+            yield line
+        return
+
+    seen = {}  # line without ts => [(ts, rank), ...] not yet matched by another tracer
+    window = deque()  # (ts, key) in arrival order, to forget old lines
+    dropped = 0
+    for ts, rank, _, line in merged:
+        while window and window[0][0] < ts - slack:
+            old_ts, key = window.popleft()
+            copies = seen.get(key)
+            if copies is not None:
+                copies[:] = [c for c in copies if c[0] != old_ts]
+                if not copies:
+                    del seen[key]
+
+        op = _EVENT_OP.search(line)
+        if op is None or op.group(1) not in METADATA_OPS:
+            yield line
+            continue
+
+        key = line[line.index(b" ") :]
+        copies = seen.get(key)
+        if copies is not None:
+            match = next((c for c in copies if c[1] != rank), None)
+            if match is not None:
+                copies.remove(match)
+                dropped += 1
+                continue
+        else:
+            copies = seen[key] = []
+
+        copies.append((ts, rank))
+        window.append((ts, key))
+        yield line
+
+    logging.debug(f"dropped {dropped} duplicate events")
+
+
+def iter_merged_events(
+    path: str,
+    tracers: Optional[Iterable[str]] = None,
+    slack: int = DEFAULT_SLACK_NS,
+    dedupe: bool = True,
+) -> Iterator[Event]:
+    """Stream the events of every tracer as one timeline (see iter_merged_lines).
+
+    The result can be passed to pair_events, every call is in a single tracer.
+
+    :param path: an output directory or a single segment file
+    :param tracers: only merge these tracers (default: every tracer)
+    :param slack: maximum disorder of a log, and distance of two copies of an event
+    :param dedupe: drop the copies of metadata events
+    """
+    for line in iter_merged_lines(path, tracers, slack, dedupe):
+        event = parse_line(line)
+        if event is not None:
+            yield event
+
+
+def write_timeline(
+    path: str,
+    out: str,
+    tracers: Optional[Iterable[str]] = None,
+    slack: int = DEFAULT_SLACK_NS,
+    dedupe: bool = True,
+) -> int:
+    """Write the merged timeline of a session into one log file.
+
+    The file has the trace log format, so the parser reads it as a single segment.
+
+    :param path: an output directory or a single segment file
+    :param out: the timeline file path
+    :param tracers: only merge these tracers (default: every tracer)
+    :param slack: maximum disorder of a log, and distance of two copies of an event
+    :param dedupe: drop the copies of metadata events
+    :return: the number of written lines
+    """
+    count = 0
+    with open(out, "wb", buffering=1024 * 1024) as f:
+        for line in iter_merged_lines(path, tracers, slack, dedupe):
+            f.write(line)
+            count += 1
+    return count
@@ -0,0 +1,222 @@
+import gzip
+import io
+import logging
+import mmap
+import os
+import re
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+from src.parser.records import SINGLE_SHOT_OPS, Call, Event
+from src.parser.tokenizer import parse_line
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, gzip is always available
+    zstandard = None
+
+# segment file names: trace_<tracer>_<index>.log, compressed ones end with .gz or .zst
+SEGMENT_PATTERN = re.compile(
+    r"^trace_(?P<tracer>.+)_(?P<index>\d+)\.log(?P<codec>\.gz|\.zst)?$"
+)
+
+# file extension of each compression codec
+CODEC_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def segment_info(path: str) -> Optional[tuple[str, int]]:
+    """Get the tracer name and the rotation index of a segment.
+
+    :param path: segment file path
+    :return: (tracer, index) or None if the path is not a segment
+    """
+    match = SEGMENT_PATTERN.match(os.path.basename(path))
+    if match is None:
+        return None
+    return match.group("tracer"), int(match.group("index"))
+
+
+def list_segments(path: str, tracer: Optional[str] = None) -> list[str]:
+    """List trace segments ordered by tracer name and rotation index.
+
+    :param path: an output directory or a single segment file
+    :param tracer: only return the segments of this tracer (e.g. io, memory)
+    :return: a list of segment paths
+    """
+    if os.path.isfile(path):
+        return [path]
+
+    segments = {}
+    for name in sorted(os.listdir(path)):
+        info = segment_info(name)
+        if info is None or (tracer is not None and info[0] != tracer):
+            continue
+        # a segment that is being compressed exists twice, the plain file sorts first
+        segments.setdefault(info, os.path.join(path, name))
+
+    return [segments[info] for info in sorted(segments)]
+
+
+def group_segments(paths: Iterable[str]) -> dict[str, list[str]]:
+    """Group segment paths into per-tracer chains (in rotation order).
+
+    :param paths: segment paths
+    :return: a dictionary of tracer name to its ordered segments
+    """
+    chains = {}
+    for path in paths:
+        info = segment_info(path) or (path, 0)
+        chains.setdefault(info[0], []).append((info[1], path))
+    return {name: [p for _, p in sorted(chain)] for name, chain in chains.items()}
+
+
+def open_segment(path: str) -> BinaryIO:
+    """Open a segment for reading, decompressing .gz and .zst files.
+
+    :param path: segment path
+    :raises RuntimeError: when a .zst file is read without zstandard
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {path}")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.BufferedReader(reader, 1024 * 1024)
+    return open(path, "rb")
+
+
+def iter_lines(path: str) -> Iterator[bytes]:
+    """Read the lines of a file through a read-only memory map.
+
+    Compressed segments are decompressed as a stream instead.
+
+    :param path: file path
+    """
+    if path.endswith((".gz", ".zst")):
+        with open_segment(path) as f:
+            yield from f
+        return
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+            yield from iter(mm.readline, b"")
+
+
+def iter_segment_events(paths: Iterable[str]) -> Iterator[Event]:
+    """Stream the events of the given segments, one file after another.
+
+    :param paths: segment paths
+    """
+    for path in paths:
+        logging.debug(f"parsing {path}")
+        for line in iter_lines(path):
+            event = parse_line(line)
+            if event is not None:
+                yield event
+
+
+def iter_events(path: str, tracer: Optional[str] = None) -> Iterator[Event]:
+    """Stream the events of an output directory (or a single segment).
+
+    :param path: an output directory or a single segment file
+    :param tracer: only read the segments of this tracer
+    """
+    for chain in group_segments(list_segments(path, tracer)).values():
+        yield from iter_segment_events(chain)
+
+
+def pair_events(
+    events: Iterable[Event],
+    flush: bool = True,
+    pending: Optional[dict[tuple[int, str], Event]] = None,
+) -> Iterator[Call]:
+    """Match each EN event with its EX event on the same thread.
+
+    Calls are yielded in exit order. An EN event that never sees its EX
+    (lost event, or the session stopped) is yielded with ret set to None.
+    PA events (paired output mode) are already complete calls.
+
+    :param events: events of a single tracer in log order
+    :param flush: yield unmatched EN events at the end of the stream
+    :param pending: in-flight EN events, pass the same dictionary to carry
+        them from one segment to the next
+    """
+    if pending is None:
+        pending = {}
+
+    for ev in events:
+        if ev.kind == "PA":
+            yield _paired(ev)
+            continue
+
+        if ev.kind == "EN":
+            if ev.op in SINGLE_SHOT_OPS:
+                yield Call(ev.ts, ev.pid, ev.tid, ev.comm, ev.op, ev.args)
+                continue
+
+            stale = pending.pop((ev.tid, ev.op), None)
+            if stale is not None:
+                yield _unmatched(stale)
+            pending[(ev.tid, ev.op)] = ev
+            continue
+
+        entry = pending.pop((ev.tid, ev.op), None)
+        ret = ev.args.get("ret")
+        if entry is None:
+            args = {k: v for k, v in ev.args.items() if k != "ret"}
+            yield Call(ev.ts, ev.pid, ev.tid, ev.comm, ev.op, args, ret, None, ev.ts)
+        else:
+            yield Call(
+                entry.ts,
+                entry.pid,
+                entry.tid,
+                entry.comm,
+                entry.op,
+                entry.args,
+                ret,
+                ev.ts - entry.ts,
+                ev.ts,
+            )
+
+    if flush:
+        for entry in sorted(pending.values(), key=lambda e: e.ts):
+            yield _unmatched(entry)
+        pending.clear()
+
+
+def _paired(ev: Event) -> Call:
+    """Convert a PA event (printed at exit) into a call."""
+    args = {k: v for k, v in ev.args.items() if k != "ret" and k != "latency"}
+    latency = ev.args.get("latency", 0)
+    return Call(
+        ev.ts - latency,
+        ev.pid,
+        ev.tid,
+        ev.comm,
+        ev.op,
+        args,
+        ev.args.get("ret"),
+        latency,
+        ev.ts,
+    )
+
+
+def _unmatched(ev: Event) -> Call:
+    """Convert an EN event without EX into a call."""
+    return Call(ev.ts, ev.pid, ev.tid, ev.comm, ev.op, ev.args)
+
+
+def iter_calls(path: str, tracer: Optional[str] = None) -> Iterator[Call]:
+    """Stream paired calls of an output directory (or a single segment).
+
+    Rotated segments of the same tracer are paired as one stream, so
+    calls that cross a rotation boundary are still matched.
+
+    :param path: an output directory or a single segment file
+    :param tracer: only read the segments of this tracer
+    """
+    for chain in group_segments(list_segments(path, tracer)).values():
+        yield from pair_events(iter_segment_events(chain))
@@ -0,0 +1,57 @@
+from typing import NamedTuple, Optional, Union
+
+# argument values are integers, except the string keys below
+Value = Union[int, str]
+
+# keys that hold strings in the `{k=v ...}` section of a trace line
+STRING_KEYS = frozenset({"fname", "comm"})
+
+# operations that only print an `EN` line (or only an `EX` line)
+SINGLE_SHOT_OPS = frozenset({"fork", "exec", "process", "target"})
+
+
+class Event(NamedTuple):
+    """Event is a single trace line.
+
+    :param ts: kernel timestamp in nanoseconds (bpftrace nsecs)
+    :param pid: process id
+    :param tid: thread id
+    :param comm: process command name
+    :param kind: EN for enter lines, EX for exit lines and PA for paired
+        lines (one line per call, printed at exit with ret and latency)
+    :param op: the traced operation (syscall or probe name)
+    :param args: key/value pairs of the last section
+    """
+
+    ts: int
+    pid: int
+    tid: int
+    comm: str
+    kind: str
+    op: str
+    args: dict[str, Value]
+
+
+class Call(NamedTuple):
+    """Call is an EN line matched with its EX line.
+
+    :param ts: enter timestamp in nanoseconds
+    :param pid: process id
+    :param tid: thread id
+    :param comm: process command name
+    :param op: the traced operation (syscall or probe name)
+    :param args: arguments of the EN line
+    :param ret: return value of the EX line (None if the call did not exit)
+    :param latency: time between EN and EX in nanoseconds (None if not paired)
+    :param end: exit timestamp in nanoseconds (None if the call did not exit)
+    """
+
+    ts: int
+    pid: int
+    tid: int
+    comm: str
+    op: str
+    args: dict[str, Value]
+    ret: Optional[int] = None
+    latency: Optional[int] = None
+    end: Optional[int] = None
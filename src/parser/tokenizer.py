@@ -0,0 +1,110 @@
+import re
+from typing import Optional
+
+from src.parser.records import STRING_KEYS, Event, Value
+
+# log format: [timestamp] {pid=[pid] tid=[tid] proc=[command]}{[EN|EX|PA] [operand]}{[key=value] ...}
+_LINE = re.compile(
+    rb"(\d+) \{pid=(-?\d+) tid=(-?\d+) proc=(.*?)\}\{(EN|EX|PA) (\w+)\}\{(.*)\}"
+)
+
+_KINDS = {b"EN": "EN", b"EX": "EX", b"PA": "PA"}
+
+# interned strings for the low-cardinality fields (commands, operations, keys)
+_names: dict[bytes, str] = {}
+
+# parsed argument sections, most bodies repeat (e.g. `fd=3 count=4096`, `ret=0`)
+_bodies: dict[bytes, dict] = {}
+_BODIES_LIMIT = 1 << 16
+
+# every key printed by the templates, used to tell keys apart from `=` in paths
+_KNOWN_KEYS = frozenset(
+    {
+        b"fname",
+        b"comm",
+        b"pid",
+        b"fd",
+        b"oldfd",
+        b"newfd",
+        b"count",
+        b"addr",
+        b"len",
+        b"off",
+        b"ret",
+        b"latency",
+    }
+)
+
+
+def _name(raw: bytes) -> str:
+    """Decode a low-cardinality field once and reuse the same str object."""
+    try:
+        return _names[raw]
+    except KeyError:
+        value = _names[raw] = raw.decode("utf-8", "replace")
+        return value
+
+
+def parse_args(body: bytes) -> dict[str, Value]:
+    """Parse the `k=v k=v` section of a trace line.
+
+    String values (fname, comm) may contain spaces, so a token without
+    a `=` is glued back to the previous value.
+
+    :param body: the content between the last pair of braces
+    :return: a dictionary of typed values
+    """
+    args = {}
+    if not body:
+        return args
+
+    key = None
+    for token in body.split(b" "):
+        name, sep, raw = token.partition(b"=")
+        if not sep or (key in STRING_KEYS and name not in _KNOWN_KEYS):
+            if key is not None:
+                args[key] += " " + token.decode("utf-8", "replace")
+            continue
+
+        key = _name(name)
+        if key in STRING_KEYS:
+            args[key] = raw.decode("utf-8", "replace")
+        else:
+            try:
+                args[key] = int(raw)
+            except ValueError:
+                args[key] = raw.decode("utf-8", "replace")
+
+    return args
+
+
+def parse_line(line: bytes) -> Optional[Event]:
+    """Parse a single trace line into an event.
+
+    The args dictionary is shared between events with the same argument
+    section, so it must be treated as read-only.
+
+    :param line: raw line (with or without the trailing newline)
+    :return: the event, or None for lines that are not trace events (banners, errors)
+    """
+    match = _LINE.match(line)
+    if match is None:
+        return None
+
+    ts, pid, tid, comm, kind, op, body = match.groups()
+
+    args = _bodies.get(body)
+    if args is None:
+        if len(_bodies) >= _BODIES_LIMIT:
+            _bodies.clear()
+        args = _bodies[body] = parse_args(body)
+
+    return Event(
+        int(ts),
+        int(pid),
+        int(tid),
+        _name(comm),
+        _KINDS[kind],
+        _name(op),
+        args,
+    )
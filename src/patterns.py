@@ -0,0 +1,340 @@
+from array import array
+from typing import Iterable
+
+import numpy as np
+
+from src.columnar import MISSING
+from src.faults import PAGE_SIZE, Fault
+
+IO_OPS = (
+    "read",
+    "write",
+    "pread64",
+    "pwrite64",
+    "readv",
+    "writev",
+    "preadv",
+    "pwritev",
+)
+WRITE_OPS = ("write", "pwrite64", "writev", "pwritev")
+OPEN_OPS = ("open", "openat", "creat")
+
+# I/O sizes are counted in power of two buckets, bucket k holds [2^k, 2^(k+1)) bytes
+SIZE_BUCKETS = 40
+
+# label of the accesses whose file is not known (fd opened before the session)
+UNKNOWN = "<unknown>"
+
+
+def _codes(cols: dict[str, np.ndarray], column: str, names: Iterable[str]):
+    """Get the dictionary codes of the given strings in a column."""
+    return np.flatnonzero(np.isin(cols[f"{column}_dict"], list(names)))
+
+
+def io_accesses(cols: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Build the file access stream of the io calls of a columnar trace.
+
+    The path of each call is the path of the last open of its (pid, fd),
+    and calls without an explicit offset (read, write, readv, writev) are
+    placed at the bytes moved since that open, since lseek is not traced.
+
+    :param cols: columns created by src.columnar (load_columns)
+    :return: access columns (ts, pid, stream, file, off, size, write) and
+        `files`, the path of each file code
+    """
+    op, ret = cols["op"], cols["ret"]
+    is_io = np.isin(op, _codes(cols, "op", IO_OPS)) & (ret > 0) & (ret != MISSING)
+    is_open = np.isin(op, _codes(cols, "op", OPEN_OPS)) & (ret >= 0)
+    is_close = np.isin(op, _codes(cols, "op", ("close",))) & (ret == 0)
+
+    rows = np.flatnonzero(is_io | is_open | is_close)
+    is_io, is_open, is_close = is_io[rows], is_open[rows], is_close[rows]
+
+    # opens return the fd, the other calls take it as an argument
+    pid = cols["pid"][rows].astype(np.int64)
+    fd = np.where(is_open, ret[rows], cols["fd"][rows]).astype(np.int64)
+    key = (pid << 32) | (fd & 0xFFFFFFFF)
+    ts = cols["ts"][rows]
+
+    order = np.lexsort((ts, key))
+    key, ts, pid = key[order], ts[order], pid[order]
+    is_io, is_open, is_close = is_io[order], is_open[order], is_close[order]
+    path = cols["path"][rows][order]
+    size = np.where(is_io, ret[rows][order], 0)
+    off = cols["off"][rows][order]
+
+    # each run of a (pid, fd) starts a session at every open and close, the
+    # session is the index of its first row (forward filled over the run)
+    pos = np.arange(len(key))
+    start = np.ones(len(key), dtype=bool)
+    start[1:] = key[1:] != key[:-1]
+    session = np.maximum.accumulate(np.where(start | is_open | is_close, pos, 0))
+
+    file = np.where(is_open[session], path[session], -1)
+    # calls that carry the path (path prefix mode)
+    file = np.where(path >= 0, path, file)
+
+    implicit = is_io & (off == MISSING)
+    moved = np.cumsum(np.where(implicit, size, 0)) - np.where(implicit, size, 0)
+    off = np.where(implicit, moved - moved[session], off)
+
+    write = np.isin(cols["op"][rows][order], _codes(cols, "op", WRITE_OPS))
+    return {
+        "ts": ts[is_io],
+        "pid": pid[is_io],
+        "stream": session[is_io],
+        "file": file[is_io].astype(np.int64),
+        "off": off[is_io],
+        "size": size[is_io],
+        "write": write[is_io],
+        "files": cols["path_dict"],
+    }
+
+
+def fault_accesses(
+    faults: Iterable[Fault], page_size: int = PAGE_SIZE
+) -> dict[str, np.ndarray]:
+    """Build the access stream of resolved page faults (one page per fault).
+
+    :param faults: faults from src.faults (iter_faults)
+    :param page_size: page size of the traced machine
+    :return: the same access columns as io_accesses
+    """
+    cols = {name: array("q") for name in ("ts", "pid", "file", "off")}
+    files = {}
+    for fault in faults:
+        if fault.path is None:
+            continue
+        cols["ts"].append(fault.ts)
+        cols["pid"].append(fault.pid)
+        cols["file"].append(files.setdefault(fault.path, len(files)))
+        cols["off"].append(fault.page * page_size)
+
+    acc = {name: np.frombuffer(values, dtype=np.int64) for name, values in cols.items()}
+    acc["stream"] = (acc["pid"] << 32) | acc["file"]
+    acc["size"] = np.full(len(acc["ts"]), page_size, dtype=np.int64)
+    acc["write"] = np.zeros(len(acc["ts"]), dtype=bool)
+    acc["files"] = np.array(list(files), dtype=str)
+    return acc
+
+
+def sequentiality(acc: dict[str, np.ndarray], group: np.ndarray, groups: int):
+    """Get the ratio of accesses that start where the previous one of their stream ended.
+
+    :param acc: access columns
+    :param group: group index of each access
+    :param groups: number of groups
+    :return: the ratio per group (nan for groups without consecutive accesses)
+    """
+    order = np.lexsort((acc["ts"], acc["stream"]))
+    stream, off, size = acc["stream"][order], acc["off"][order], acc["size"][order]
+    group = group[order]
+
+    follows = stream[1:] == stream[:-1]
+    sequential = follows & (off[1:] == off[:-1] + size[:-1])
+
+    total = np.bincount(group[1:], weights=follows, minlength=groups)
+    hits = np.bincount(group[1:], weights=sequential, minlength=groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, hits / total, np.nan)
+
+
+def size_histogram(size: np.ndarray, group: np.ndarray, groups: int) -> np.ndarray:
+    """Count the I/O sizes of each group in power of two buckets.
+
+    :param size: access sizes in bytes
+    :param group: group index of each access
+    :param groups: number of groups
+    :return: a (groups, SIZE_BUCKETS) array of counts
+    """
+    bucket = np.clip(np.log2(np.maximum(size, 1)).astype(np.int64), 0, SIZE_BUCKETS - 1)
+    counts = np.bincount(group * SIZE_BUCKETS + bucket, minlength=groups * SIZE_BUCKETS)
+    return counts.reshape(groups, SIZE_BUCKETS)
+
+
+def expand_blocks(
+    acc: dict[str, np.ndarray], block_size: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Split the accesses into the fixed-size blocks they touch.
+
+    :param acc: access columns
+    :param block_size: block size in bytes
+    :return: the access index of each block and a dense id per (file, block)
+    """
+    first = acc["off"] // block_size
+    last = (acc["off"] + np.maximum(acc["size"], 1) - 1) // block_size
+    count = last - first + 1
+
+    owner = np.repeat(np.arange(len(first)), count)
+    within = np.arange(len(owner)) - np.repeat(np.cumsum(count) - count, count)
+    number = first[owner] + within
+
+    # accesses of unknown files are told apart by their stream
+    file = np.where(acc["file"][owner] >= 0, acc["file"][owner], ~acc["stream"][owner])
+    _, file = np.unique(file, return_inverse=True)
+    file = file.reshape(-1)
+
+    # one int64 key per (file, block) when it fits, it sorts much faster than pairs
+    span = int(number.max()) + 1 if len(number) else 1
+    if (int(file.max()) + 1 if len(file) else 1) < (1 << 62) // span:
+        _, block = np.unique(file * span + number, return_inverse=True)
+    else:
+        pairs = np.stack([file, number], axis=1)
+        _, block = np.unique(pairs, axis=0, return_inverse=True)
+    return owner, block.reshape(-1)
+
+
+def working_set(
+    ts: np.ndarray, block: np.ndarray, group: np.ndarray, groups: int, window: int
+) -> np.ndarray:
+    """Count the distinct blocks of each group in each time window.
+
+    :param ts: timestamp of each block access in nanoseconds
+    :param block: block id of each block access
+    :param group: group index of each block access
+    :param groups: number of groups
+    :param window: window length in nanoseconds
+    :return: a (groups, windows) array of distinct blocks
+    """
+    if len(ts) == 0:
+        return np.zeros((groups, 0), dtype=np.int64)
+
+    slot = (ts - ts.min()) // window
+    slots = int(slot.max()) + 1
+
+    order = np.lexsort((block, slot, group))
+    g, s, b = group[order], slot[order], block[order]
+    distinct = np.ones(len(order), dtype=bool)
+    distinct[1:] = (g[1:] != g[:-1]) | (s[1:] != s[:-1]) | (b[1:] != b[:-1])
+
+    counts = np.bincount(g[distinct] * slots + s[distinct], minlength=groups * slots)
+    return counts.reshape(groups, slots)
+
+
+def _tail_sums(values: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Get sum((v - w) for v in values if v > w) for each w in points."""
+    values = np.sort(values)
+    suffix = np.concatenate([np.cumsum(values[::-1])[::-1], [0]])
+    index = np.searchsorted(values, points, side="right")
+    return suffix[index] - points * (len(values) - index)
+
+
+def miss_ratio_curve(block: np.ndarray, points: int = 32) -> np.ndarray:
+    """Estimate the LRU miss ratio curve of a block stream from its reuse times.
+
+    It uses the average footprint of the higher order theory of locality
+    (HOTL, Xiang et al., ASPLOS 2013): fp(w) is computed from the reuse time,
+    first access and last access histograms, and the miss ratio of a cache
+    of fp(w) blocks is fp(w + 1) - fp(w). It runs in O(n log n).
+
+    :param block: block ids in access order
+    :param points: number of (log-spaced) window lengths to evaluate
+    :return: a (k, 2) array of (cache size in blocks, miss ratio)
+    """
+    n = len(block)
+    if n < 2:
+        return np.zeros((0, 2))
+
+    position = np.arange(1, n + 1)
+    order = np.argsort(block, kind="stable")
+    b, p = block[order], position[order]
+
+    same = b[1:] == b[:-1]
+    reuse = p[1:][same] - p[:-1][same]
+    first = p[np.concatenate([[True], ~same])]
+    last = n + 1 - p[np.concatenate([~same, [True]])]
+    distinct = len(first)
+
+    windows = np.unique(np.geomspace(1, n - 1, points).astype(np.int64))
+    ws = np.concatenate([windows, windows + 1])
+    tails = _tail_sums(first, ws) + _tail_sums(last, ws) + _tail_sums(reuse, ws)
+    footprint = distinct - tails / (n - ws + 1)
+
+    size, after = footprint[: len(windows)], footprint[len(windows) :]
+    return np.stack([size, np.clip(after - size, 0.0, 1.0)], axis=1)
+
+
+def analyze(
+    acc: dict[str, np.ndarray],
+    by: str = "file",
+    block_size: int = PAGE_SIZE,
+    window: float = 60.0,
+    top: int = 20,
+    points: int = 32,
+) -> dict:
+    """Classify the access patterns of each file (or pid).
+
+    :param acc: access columns from io_accesses or fault_accesses
+    :param by: group the accesses by file or pid
+    :param block_size: block size of the reuse and working set analysis
+    :param window: working set window in seconds
+    :param top: number of groups to report (by accesses)
+    :param points: number of points of the miss ratio curves
+    :return: a json-serializable report with a total and a list of groups
+    """
+    if by not in ("file", "pid"):
+        raise ValueError(f"unknown grouping {by}, use file or pid")
+
+    key = acc["file"] if by == "file" else acc["pid"]
+    labels, group = np.unique(key, return_inverse=True)
+    group = group.reshape(-1)
+    groups = len(labels)
+
+    accesses = np.bincount(group, minlength=groups)
+    volume = np.bincount(group, weights=acc["size"], minlength=groups)
+    writes = np.bincount(group, weights=acc["write"], minlength=groups)
+    sequential = sequentiality(acc, group, groups)
+    sizes = size_histogram(acc["size"], group, groups)
+
+    owner, block = expand_blocks(acc, block_size)
+    window_ns = max(int(window * 1e9), 1)
+    footprint = working_set(acc["ts"][owner], block, group[owner], groups, window_ns)
+
+    # miss ratio curves need the blocks in time order
+    timeline = np.argsort(acc["ts"][owner], kind="stable")
+    block, owner = block[timeline], owner[timeline]
+
+    def curve(blocks: np.ndarray) -> list:
+        return [
+            [float(size * block_size), float(ratio)]
+            for size, ratio in miss_ratio_curve(blocks, points)
+        ]
+
+    def name(label: int) -> str:
+        if by == "pid":
+            return str(label)
+        return str(acc["files"][label]) if label >= 0 else UNKNOWN
+
+    report = {
+        "by": by,
+        "block_size": block_size,
+        "window": window,
+        "total": {
+            "accesses": int(len(group)),
+            "bytes": int(acc["size"].sum()),
+            "blocks": int(block.max()) + 1 if len(block) else 0,
+            "mrc": curve(block),
+        },
+        "groups": [],
+    }
+
+    for g in np.argsort(-accesses, kind="stable")[:top]:
+        buckets = np.flatnonzero(sizes[g])
+        report["groups"].append(
+            {
+                "name": name(int(labels[g])),
+                "accesses": int(accesses[g]),
+                "bytes": int(volume[g]),
+                "writes": int(writes[g]),
+                "sequential": None if np.isnan(sequential[g]) else float(sequential[g]),
+                "sizes": {str(1 << int(k)): int(sizes[g, k]) for k in buckets},
+                "working_set": {
+                    "max": int(footprint[g].max() * block_size),
+                    "mean": float(footprint[g][footprint[g] > 0].mean() * block_size),
+                    "windows": (footprint[g] * block_size).tolist(),
+                },
+                "mrc": curve(block[group[owner] == g]),
+            }
+        )
+
+    return report
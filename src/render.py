@@ -0,0 +1,335 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Iterable, Optional, Sequence
+
+from jinja2 import Environment, FileSystemLoader
+
+CONFIG_PATH = "tracers.json"
+
+# the page fault probes are not syscalls, they are selected by this name
+PAGE_FAULT_PROBE = "page_fault_user"
+
+# multiplier of the sampling hash, so consecutive fds and pids spread over the buckets
+SAMPLE_HASH = 2654435761
+
+# probe groups attached by each script (scripts not listed attach every group)
+SCRIPT_GROUPS = {
+    "io_trace.bt": ("meta", "io"),
+    "memory_trace.bt": ("meta", "memory"),
+}
+
+
+def default_cache_dir() -> str:
+    """Get the default directory of the rendered scripts."""
+    base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "flak", "bpftrace")
+
+
+def import_json(path: str) -> dict:
+    """Import json data into a dictionary.
+
+    :param path: path to the json file
+    """
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def read_to_str(path: str) -> str:
+    """Read a file data into a string (empty if the file cannot be read).
+
+    :param path: file path
+    :return str: file content
+    """
+    try:
+        with open(path, "r") as file:
+            return file.read()
+    except Exception:
+        return ""
+
+
+def new_environment(templates_dir: str) -> Environment:
+    """Create the jinja2 environment of the bpftrace templates.
+
+    :param templates_dir: the directory of the j2 files
+    """
+    return Environment(
+        loader=FileSystemLoader(templates_dir),
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+
+
+def load_probes(path: str, track_paths: bool = False) -> list[dict]:
+    """Load the syscall probes table and prepare the printf parts.
+
+    :param path: path to the probes json file
+    :param track_paths: print the path of the fd (from @fname) in the fd probes
+    :return list: probes with `fields` (printf format), `exprs` (printf arguments),
+        `paired_exprs` (printf arguments read back from the per-tid maps at exit)
+        `fd` (the file descriptor argument, -1 if there is none), `path` (the path
+        argument, None if there is none) and `sample_key` (the sampling hash of io
+        and memory probes with a file descriptor)
+    """
+    probes = import_json(path)
+    for probe in probes:
+        probe["fd"] = next(
+            (value for key, _, value in probe["args"] if key in ("fd", "oldfd")), "-1"
+        )
+        if track_paths and probe["fd"] != "-1":
+            probe["args"].append(["fname", "%s", f"@fname[pid, (int64){probe['fd']}]"])
+        probe["path"] = next(
+            (value for key, _, value in probe["args"] if key == "fname"), None
+        )
+        probe["prefix"] = None
+
+        probe["fields"] = " ".join(f"{key}={fmt}" for key, fmt, _ in probe["args"])
+        probe["exprs"] = ", ".join(value for _, _, value in probe["args"])
+        probe["paired_exprs"] = ", ".join(
+            f"@pa_{probe['name']}_{key}[tid]" for key, _, _ in probe["args"]
+        )
+        probe.setdefault("ret", "%d")
+
+        # sampling is consistent per (pid, fd), so every sampled file keeps all its calls
+        probe["sample_key"] = None
+        if probe["group"] in ("io", "memory") and probe["fd"] != "-1":
+            probe["sample_key"] = f"(uint64)pid * {SAMPLE_HASH} + (uint64){probe['fd']}"
+    return probes
+
+
+def select_probes(probes: list[dict], names: Iterable[str]) -> tuple[list[dict], bool]:
+    """Keep the selected probes of the table.
+
+    :param probes: the probes table
+    :param names: syscall names and/or `page_fault_user`
+    :raises ValueError: when a name is unknown or nothing is selected
+    :return: the selected syscall probes and whether page faults are selected
+    """
+    names = set(names)
+    known = {probe["name"] for probe in probes} | {PAGE_FAULT_PROBE}
+    unknown = names - known
+    if unknown:
+        raise ValueError(
+            f"unknown probes {sorted(unknown)}, use any of {sorted(known)}"
+        )
+    if not names:
+        raise ValueError("no probes selected")
+
+    return [probe for probe in probes if probe["name"] in names], (
+        PAGE_FAULT_PROBE in names
+    )
+
+
+def prefix_condition(path: str, prefixes: Sequence[str]) -> str:
+    """Create the bpftrace condition that matches a path against the prefixes.
+
+    :param path: a bpftrace string expression
+    :param prefixes: absolute path prefixes
+    """
+    return "({})".format(
+        " || ".join(
+            f'strncmp({path}, "{prefix}", {len(prefix.encode())}) == 0'
+            for prefix in prefixes
+        )
+    )
+
+
+def attaches(script: str, probes: list[dict], page_fault: bool) -> bool:
+    """Check if a script attaches at least one of the selected probes.
+
+    :param script: the script name (e.g. io_trace.bt)
+    :param probes: the selected syscall probes
+    :param page_fault: page faults are selected
+    """
+    groups = SCRIPT_GROUPS.get(script)
+    if groups is None:
+        return bool(probes) or page_fault
+    if page_fault and "memory" in groups:
+        return True
+    return any(probe["group"] in groups for probe in probes)
+
+
+def render_scripts(
+    env: Environment,
+    cfg: dict,
+    entry: str,
+    probes: list[dict],
+    page_fault: bool = True,
+    sample: int = 1,
+    rate_limit: int = 0,
+    path_prefixes: Sequence[str] = (),
+    trackers: Sequence[dict] = (),
+    targets: Sequence[str] = (),
+) -> dict[str, str]:
+    """Render the scripts of one tracing mode.
+
+    :param env: jinja2 environment of the bpftrace templates
+    :param cfg: the tracers.json configs
+    :param entry: the tracing mode (one of the configured inputs)
+    :param probes: the syscall probes to attach
+    :param page_fault: attach the page fault probes
+    :param sample: keep 1 in `sample` fds (pages for page faults) of each process
+    :param rate_limit: maximum events per second of each process (0 for no limit)
+    :param path_prefixes: drop the events of paths (and their fds) outside these prefixes
+    :param trackers: the open, dup and close probes that maintain @fname[pid, fd],
+        used by the path filter and by the aggregate script (maps keyed by path)
+    :param targets: the cgroup ids or pids of a multi-target mode (cgroups, pids)
+    :return: script name => script content, scripts that attach nothing are skipped
+    """
+    if path_prefixes:
+        probes = [
+            (
+                dict(probe, prefix=prefix_condition(probe["path"], path_prefixes))
+                if probe["path"]
+                else probe
+            )
+            for probe in probes
+        ]
+
+    dir_path = os.path.join(cfg["templates_dir"], cfg["inputs_dir"], entry)
+    filter_section = read_to_str(os.path.join(dir_path, "filter.bt"))
+    begin_section = read_to_str(os.path.join(dir_path, "begin.bt"))
+
+    # multi-target modes tag each process with the index of its target (the
+    # `tag` expression), their membership map is filled in BEGIN (cgroups,
+    # pids) or while tracing (pods)
+    tag_section = read_to_str(os.path.join(dir_path, "tag.bt"))
+    if targets:
+        begin_section = env.from_string(begin_section).render(targets=targets)
+
+    scripts = {}
+    for out in cfg["sources"]:
+        if not attaches(out, probes, page_fault):
+            continue
+
+        tmp = env.get_template(out + ".j2")
+
+        # sources listed in `paired` also get a <name>_paired.bt
+        for paired in (False, True) if out in cfg["paired"] else (False,):
+            name = out.replace(".bt", "_paired.bt") if paired else out
+            scripts[name] = tmp.render(
+                begin_section=begin_section,
+                filter=filter_section,
+                probes=probes,
+                page_fault=page_fault,
+                paired=paired,
+                interval=cfg["aggregate_interval"],
+                limited=sample > 1 or rate_limit > 0 or bool(path_prefixes),
+                path_filter=bool(path_prefixes),
+                sample=sample,
+                rate_limit=rate_limit,
+                trackers=trackers,
+                tag=tag_section,
+            )
+
+    return scripts
+
+
+def __fingerprint(cfg: dict, entry: str, *options) -> str:
+    """Hash the mode, the render options and every input of the rendered scripts."""
+    digest = hashlib.sha256(json.dumps([entry, options, cfg]).encode())
+
+    inputs_dir = os.path.join(cfg["templates_dir"], cfg["inputs_dir"], entry)
+    templates_dir = os.path.join(cfg["templates_dir"], cfg["sources_dir"])
+    for base in (inputs_dir, templates_dir):
+        for root, dirs, files in os.walk(base):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(path.encode())
+                with open(path, "rb") as file:
+                    digest.update(file.read())
+
+    return digest.hexdigest()[:16]
+
+
+def render_cached(
+    entry: str,
+    names: Optional[Iterable[str]] = None,
+    cache_dir: Optional[str] = None,
+    sample: int = 1,
+    rate_limit: int = 0,
+    path_prefixes: Optional[Sequence[str]] = None,
+    targets: Optional[Sequence[str]] = None,
+    config_path: str = CONFIG_PATH,
+) -> str:
+    """Render the scripts of a tracing mode with runtime options, once per configuration.
+
+    The scripts are stored in `<cache_dir>/<entry>-<hash>`, where the hash covers
+    the mode, the options, the filter and the templates. Running the same
+    configuration again reuses the directory without rendering.
+
+    :param entry: the tracing mode (e.g. pid)
+    :param names: syscall names and/or `page_fault_user` (None for every probe)
+    :param cache_dir: the cache directory (default: ~/.cache/flak/bpftrace)
+    :param sample: keep 1 in `sample` fds (pages for page faults) of each process
+    :param rate_limit: maximum events per second of each process (0 for no limit)
+    :param path_prefixes: only trace the files under these absolute path prefixes
+    :param targets: the cgroup ids or pids of a multi-target mode, in tag order
+    :param config_path: path to tracers.json
+    :raises ValueError: when the options are invalid
+    :return: the directory of the rendered scripts
+    """
+    if sample < 1 or rate_limit < 0:
+        raise ValueError(f"invalid sample {sample} or rate limit {rate_limit}")
+    path_prefixes = sorted(set(path_prefixes or ()))
+    for prefix in path_prefixes:
+        if not prefix.startswith("/") or any(c in prefix for c in '"\\'):
+            raise ValueError(f"invalid path prefix {prefix}, use absolute paths")
+    targets = list(targets or ())
+    for target in targets:
+        if not target.isdigit():
+            raise ValueError(f"invalid target {target}, use cgroup ids or pids")
+
+    cfg = import_json(config_path)
+    names = None if names is None else sorted(set(names))
+    cache_dir = cache_dir or default_cache_dir()
+
+    fingerprint = __fingerprint(
+        cfg, entry, names, sample, rate_limit, path_prefixes, targets
+    )
+    target = os.path.join(cache_dir, f"{entry}-{fingerprint}")
+    if os.path.isdir(target):
+        logging.debug(f"using cached scripts: {target}")
+        return target
+
+    templates_dir = os.path.join(cfg["templates_dir"], cfg["sources_dir"])
+    table = load_probes(
+        os.path.join(templates_dir, cfg["probes"]), track_paths=bool(path_prefixes)
+    )
+    trackers = [probe for probe in table if probe.get("track")]
+
+    probes, page_fault = table, True
+    if names is not None:
+        probes, page_fault = select_probes(probes, names)
+
+    scripts = render_scripts(
+        new_environment(templates_dir),
+        cfg,
+        entry,
+        probes,
+        page_fault,
+        sample,
+        rate_limit,
+        path_prefixes,
+        trackers,
+        targets,
+    )
+
+    # render into a temporary directory and move it, so a cache entry is never partial
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=f".{entry}-", dir=cache_dir)
+    for name, data in scripts.items():
+        with open(os.path.join(tmp_dir, name), "w") as file:
+            file.write(data)
+
+    try:
+        os.rename(tmp_dir, target)
+    except OSError:
+        shutil.rmtree(tmp_dir)  # rendered by a concurrent run
+
+    logging.info(f"rendered {len(scripts)} scripts for {entry}: {target}")
+    return target
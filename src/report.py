@@ -0,0 +1,923 @@
+import heapq
+import json
+import logging
+import mmap
+import os
+import pickle
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Union
+
+from src.faults import RegionIndex
+from src.parser import (
+    Call,
+    Event,
+    group_segments,
+    iter_lines,
+    list_segments,
+    pair_events,
+    parse_line,
+    segment_info,
+)
+from src.parser.reader import CODEC_SUFFIXES
+from src.parser.records import SINGLE_SHOT_OPS
+from src.patterns import IO_OPS, OPEN_OPS, UNKNOWN, WRITE_OPS
+
+# calls that change the fd table or the mapped regions of a process
+STATE_OPS = frozenset({*OPEN_OPS, "dup", "dup2", "dup3", "close", "mmap", "munmap"})
+
+# syscalls printed with %lu (mmap, munmap) return -errno as an unsigned 64-bit value
+_ERRNO_MIN = (1 << 64) - 4096
+
+# local table entries of a segment that hide the tables of the previous ones
+_CLOSED = "\0closed"
+_UNMAPPED = "\0unmapped"
+
+# smallest byte range of a segment parsed by one worker
+MIN_RANGE_SIZE = 4 * 1024 * 1024
+
+# seconds between two refreshes of a followed session
+FOLLOW_INTERVAL = 2.0
+
+# bumped when the partial reports change, older caches are read again
+CACHE_VERSION = 1
+
+# files of the report cache, next to the <segment>.<start>.part partial reports
+_CACHE_INDEX = "index.json"
+_CACHE_SESSIONS = "sessions.pkl"
+
+# calls that are not attributed to a file
+_NO_FILE = object()
+
+# a file is a path, None (unknown or anonymous memory), or a reference to the
+# tables at the start of a segment: ("fd", pid, fd) or ("addr", pid, addr)
+File = Union[str, None, tuple]
+
+
+class _Proc:
+    """_Proc holds the fd table and the mapped regions of one process.
+
+    In the tables of a segment, what the segment did not change comes from
+    the tables of a process (the base) at the start of the segment, which
+    are only known by the reduce step.
+    """
+
+    __slots__ = ("fds", "fd_base", "regions", "region_base")
+
+    def __init__(
+        self, fd_base: Optional[int] = None, region_base: Optional[int] = None
+    ):
+        self.fds = {}  # fd => path, reference or _CLOSED
+        self.fd_base = fd_base
+        self.regions = RegionIndex()
+        self.region_base = region_base
+
+    def copy(self) -> "_Proc":
+        proc = _Proc(self.fd_base, self.region_base)
+        proc.fds = dict(self.fds)
+        proc.regions = self.regions.copy()
+        return proc
+
+    def fd_path(self, fd: int) -> File:
+        path = self.fds.get(fd)
+        if path is not None:
+            return None if path == _CLOSED else path
+        return None if self.fd_base is None else ("fd", self.fd_base, fd)
+
+    def region_path(self, addr: int) -> File:
+        found = self.regions.lookup(addr)
+        if found is not None:
+            return None if found[0] == _UNMAPPED else found[0]
+        return None if self.region_base is None else ("addr", self.region_base, addr)
+
+    def set_fd(self, fd: int, path: File):
+        if path is not None:
+            self.fds[fd] = path
+        elif self.fd_base is None:
+            self.fds.pop(fd, None)
+        else:
+            self.fds[fd] = _CLOSED
+
+
+class _Tables:
+    """_Tables replays the fd and mapping changes of the processes of a tracer.
+
+    The tables of a session start empty. The tables of a segment start
+    unknown: each process refers to its own tables at the start of the
+    segment (until it execs or exits), and lookups that miss the changes of
+    the segment return a reference, resolved by the reduce step.
+    """
+
+    def __init__(self, session: bool):
+        """_Tables constructor.
+
+        :param session: the tables of a whole session (instead of a segment)
+        """
+        self._session = session
+        self.procs = {}  # pid => _Proc
+
+    def view(self, pid: int) -> _Proc:
+        """Get the tables of a process (not stored when it has none yet)."""
+        proc = self.procs.get(pid)
+        if proc is None:
+            proc = _Proc() if self._session else _Proc(pid, pid)
+        return proc
+
+    def __proc(self, pid: int) -> _Proc:
+        proc = self.procs.get(pid)
+        if proc is None:
+            proc = self.procs[pid] = self.view(pid)
+        return proc
+
+    def resolve(self, path: File) -> File:
+        """Resolve a reference of the next segment with these tables."""
+        if not isinstance(path, tuple):
+            return path
+        kind, pid, key = path
+        proc = self.procs.get(pid)
+        if proc is None:
+            return None
+        return proc.fd_path(key) if kind == "fd" else proc.region_path(key)
+
+    def apply(self, call: Call):
+        """Apply a call to the tables (the rules of FaultResolver).
+
+        :param call: a paired call in exit order
+        """
+        op, args, ret = call.op, call.args, call.ret
+
+        if op in OPEN_OPS:
+            if ret is not None and ret >= 0 and "fname" in args:
+                self.__proc(call.pid).fds[ret] = args["fname"]
+        elif op in ("dup", "dup2", "dup3"):
+            if ret is not None and ret >= 0:
+                proc = self.__proc(call.pid)
+                proc.set_fd(ret, proc.fd_path(args.get("fd", args.get("oldfd"))))
+        elif op == "close":
+            if ret == 0 and "fd" in args:
+                self.__proc(call.pid).set_fd(args["fd"], None)
+        elif op == "mmap":
+            if ret is None or ret >= _ERRNO_MIN:
+                return
+            proc = self.__proc(call.pid)
+            fd, path = args.get("fd", -1), None
+            if fd >= 0:
+                path = args.get("fname") or proc.fd_path(fd)
+            proc.regions.map(ret, args.get("len", 0), path, args.get("off", 0))
+        elif op == "munmap":
+            if ret == 0 and "addr" in args:
+                proc = self.__proc(call.pid)
+                if proc.region_base is None:
+                    proc.regions.unmap(args["addr"], args.get("len", 0))
+                else:
+                    proc.regions.map(args["addr"], args.get("len", 0), _UNMAPPED)
+        elif op == "fork":
+            child = args.get("pid")
+            if child is not None and child != call.pid:
+                self.procs[child] = self.view(call.pid).copy()
+        elif op == "exec":
+            # the new image starts with fresh mappings, fds stay open
+            proc = self.__proc(args.get("pid", call.pid))
+            proc.regions, proc.region_base = RegionIndex(), None
+        elif op == "process" and call.tid == call.pid:
+            # only the exit of the main thread ends the process
+            if self._session:
+                self.procs.pop(call.pid, None)
+            else:
+                self.procs[call.pid] = _Proc()
+
+    def absorb(self, tables: "_Tables"):
+        """Apply the changes of the next segment to the tables of a session.
+
+        :param tables: the tables of the segment
+        """
+        procs = {}
+        for pid, local in tables.procs.items():
+            proc = _Proc()
+            if local.fd_base is not None:
+                proc.fds = dict(self.view(local.fd_base).fds)
+            for fd, path in local.fds.items():
+                proc.set_fd(fd, None if path == _CLOSED else self.resolve(path))
+
+            if local.region_base is not None:
+                proc.regions = self.view(local.region_base).regions.copy()
+            # the local regions never overlap, their order does not matter
+            for start, end, path, offset in local.regions:
+                if path == _UNMAPPED:
+                    proc.regions.unmap(start, end - start)
+                else:
+                    proc.regions.map(start, end - start, self.resolve(path), offset)
+
+            procs[pid] = proc if proc.fds or len(proc.regions) else None
+
+        for pid, proc in procs.items():
+            if proc is None:
+                self.procs.pop(pid, None)
+            else:
+                self.procs[pid] = proc
+
+
+def _moved(call: Call) -> int:
+    """Get the bytes moved by an io call."""
+    ret = call.ret
+    if call.op in IO_OPS and ret is not None and 0 < ret < _ERRNO_MIN:
+        return ret
+    return 0
+
+
+def _file(call: Call, proc: Optional[_Proc]) -> File:
+    """Get the file of a completed io call or page fault (_NO_FILE for the others)."""
+    if call.latency is None:
+        return _NO_FILE
+    if call.op == "page_fault_user":
+        addr = call.args.get("addr")
+        return _NO_FILE if addr is None else proc.region_path(addr)
+    if _moved(call):
+        if "fname" in call.args:
+            return call.args["fname"]
+        fd = call.args.get("fd")
+        return None if fd is None else proc.fd_path(fd)
+    return _NO_FILE
+
+
+class Totals:
+    """Totals holds the counters of a report, they can be merged in any order."""
+
+    def __init__(self):
+        self.events = 0
+        self.first = None  # first and last event timestamps
+        self.last = None
+        # op => [calls, errors, unpaired, bytes, latency sum, latency max]
+        self.ops = {}
+        self.latency = {}  # op => {log2 bucket: calls}
+        self.comms = {}  # comm => [calls, bytes]
+        self.files = {}  # file => [reads, read bytes, writes, written bytes, faults]
+
+    def event(self, ev: Event):
+        """Count a trace line."""
+        self.events += 1
+        if self.first is None or ev.ts < self.first:
+            self.first = ev.ts
+        if self.last is None or ev.ts > self.last:
+            self.last = ev.ts
+
+    def add(self, call: Call, file: File = _NO_FILE):
+        """Count a call.
+
+        :param call: a paired call
+        :param file: the file of the call (from _file)
+        """
+        counts = self.ops.get(call.op)
+        if counts is None:
+            counts = self.ops[call.op] = [0, 0, 0, 0, 0, 0]
+            self.latency[call.op] = {}
+        counts[0] += 1
+        ret = call.ret
+        if ret is not None and (ret < 0 or ret >= _ERRNO_MIN):
+            counts[1] += 1
+        size = _moved(call)
+        counts[3] += size
+
+        if call.latency is None:
+            counts[2] += 1
+        else:
+            counts[4] += call.latency
+            counts[5] = max(counts[5], call.latency)
+            hist = self.latency[call.op]
+            bucket = call.latency.bit_length()
+            hist[bucket] = hist.get(bucket, 0) + 1
+
+        comm = self.comms.get(call.comm)
+        if comm is None:
+            comm = self.comms[call.comm] = [0, 0]
+        comm[0] += 1
+        comm[1] += size
+
+        if file is _NO_FILE:
+            return
+        counts = self.files.get(file)
+        if counts is None:
+            counts = self.files[file] = [0, 0, 0, 0, 0]
+        if call.op == "page_fault_user":
+            counts[4] += 1
+        elif call.op in WRITE_OPS:
+            counts[2] += 1
+            counts[3] += size
+        else:
+            counts[0] += 1
+            counts[1] += size
+
+    def merge(self, other: "Totals", resolve=None, files: bool = True):
+        """Add the counters of another report.
+
+        :param other: the other counters
+        :param resolve: resolves the file references of the other counters
+        :param files: also add the file counters
+        """
+        self.events += other.events
+        for ts in (other.first, other.last):
+            if ts is not None:
+                self.first = ts if self.first is None else min(self.first, ts)
+                self.last = ts if self.last is None else max(self.last, ts)
+
+        for op, counts in other.ops.items():
+            mine = self.ops.get(op)
+            if mine is None:
+                self.ops[op] = list(counts)
+                self.latency[op] = dict(other.latency[op])
+                continue
+            for i in range(5):
+                mine[i] += counts[i]
+            mine[5] = max(mine[5], counts[5])
+            hist = self.latency[op]
+            for bucket, count in other.latency[op].items():
+                hist[bucket] = hist.get(bucket, 0) + count
+
+        tables = [(self.comms, other.comms)]
+        if files:
+            tables.append((self.files, other.files))
+        for table, theirs in tables:
+            for key, counts in theirs.items():
+                if resolve is not None and table is self.files:
+                    key = resolve(key)
+                mine = table.get(key)
+                if mine is None:
+                    table[key] = list(counts)
+                else:
+                    for i, count in enumerate(counts):
+                        mine[i] += count
+
+    def summary(self, top: int = 20) -> dict:
+        """Get a json-serializable summary.
+
+        :param top: number of commands and files to keep (by calls and bytes)
+        """
+        ops = {}
+        for op, (calls, errors, unpaired, size, total, longest) in sorted(
+            self.ops.items(), key=lambda item: (-item[1][0], item[0])
+        ):
+            paired = calls - unpaired
+            ops[op] = {
+                "calls": calls,
+                "errors": errors,
+                "unpaired": unpaired,
+                "bytes": size,
+                "latency": {
+                    "mean": total / paired if paired else None,
+                    "max": longest,
+                    # bucket k holds [2^(k-1), 2^k) nanoseconds
+                    "hist": {
+                        str(1 << k >> 1): count
+                        for k, count in sorted(self.latency[op].items())
+                    },
+                },
+            }
+
+        comms = heapq.nsmallest(
+            top, self.comms.items(), key=lambda item: (-item[1][0], item[0])
+        )
+        files = heapq.nsmallest(
+            top,
+            self.files.items(),
+            key=lambda item: (
+                -(item[1][1] + item[1][3]),
+                -item[1][4],
+                item[0] or "",
+            ),
+        )
+        return {
+            "events": self.events,
+            "first_ts": self.first,
+            "last_ts": self.last,
+            "ops": ops,
+            "comms": [
+                {"name": name, "calls": calls, "bytes": size}
+                for name, (calls, size) in comms
+            ],
+            "files": [
+                {
+                    "path": UNKNOWN if path is None else path,
+                    "reads": counts[0],
+                    "read_bytes": counts[1],
+                    "writes": counts[2],
+                    "written_bytes": counts[3],
+                    "faults": counts[4],
+                }
+                for path, counts in files
+            ],
+        }
+
+
+def _consume(events: Iterable[Event], report: Union["SegmentReport", "SessionReport"]):
+    """Pair events and count the calls into a partial or a session report.
+
+    The counters and tables are looked up on each call, since a segment
+    report replaces them when it restarts.
+    """
+    for call in pair_events(events, flush=False, pending=report.pending):
+        report.totals.add(call, _file(call, report.tables.view(call.pid)))
+        report.tables.apply(call)
+
+
+class SegmentReport:
+    """SegmentReport is the partial report of a segment or of a byte range of it.
+
+    It is the map step: it is built without the state of what came before
+    the range, and keeps aside what depends on it for the reduce step.
+
+    - stale: the threads and ops whose first line is an EN, an EN left
+      pending before the range never exits.
+    - head: the EX lines whose EN may be before the range, with the tables
+      of their process at that point.
+    - references to the tables at the start of the range, in the file
+      counters and in the tables themselves.
+
+    A call that changes the tables and started before the range cannot be
+    applied without its EN, so the report restarts after its EX and the
+    lines up to it are replayed by the reduce step (`prefix`).
+    """
+
+    def __init__(self, path: str, start: int = 0, end: Optional[int] = None):
+        """SegmentReport constructor.
+
+        :param path: segment path
+        :param start: offset of the first line of the range
+        :param end: offset of the end of the range (None for the whole segment)
+        """
+        self.path = path
+        self.start = start
+        self.end = end
+        self.lines = 0
+        self.size = 0  # bytes read
+        self.prefix = []  # the lines replayed by the reduce step
+        self.pending = {}  # (tid, op) => EN event
+        self.__restart()
+
+    def __restart(self):
+        self.replay = self.lines
+        self.totals = Totals()
+        self.tables = _Tables(session=False)
+        self.pending.clear()
+        self.touched = set()  # (tid, op) seen in the range
+        self.stale = set()
+        self.head = []  # (EX event, tables of its process or None)
+
+    def __events(self, lines: Iterable[bytes]) -> Iterator[Event]:
+        for line in lines:
+            self.lines += 1
+            self.size += len(line)
+            ev = parse_line(line)
+            if ev is None:
+                continue
+            self.totals.event(ev)
+
+            if ev.kind != "PA" and ev.op not in SINGLE_SHOT_OPS:
+                key = (ev.tid, ev.op)
+                if key not in self.touched:
+                    self.touched.add(key)
+                    if ev.kind == "EN":
+                        self.stale.add(key)
+                    elif ev.op in STATE_OPS:
+                        self.__restart()
+                        continue
+                    else:
+                        proc = None
+                        if ev.op in IO_OPS or ev.op == "page_fault_user":
+                            proc = self.tables.view(ev.pid).copy()
+                        self.head.append((ev, proc))
+                        continue
+            yield ev
+
+    def feed(self, lines: Iterable[bytes]):
+        """Count the calls of the next lines of the range.
+
+        :param lines: trace lines
+        """
+        _consume(self.__events(lines), self)
+
+
+def read_range(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """Read the lines of a byte range of a segment.
+
+    :param path: segment path
+    :param start: offset of the first line (in the decompressed stream of
+        compressed segments)
+    :param end: offset after the last line (None to read until the end)
+    """
+    if end is None:
+        offset = 0
+        for line in iter_lines(path):
+            if offset >= start:
+                yield line
+            offset += len(line)
+        return
+    if end <= start:
+        return
+
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), end, access=mmap.ACCESS_READ) as mm:
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+            mm.seek(start)
+            yield from iter(mm.readline, b"")
+
+
+def split_segment(
+    path: str, size: int, start: int = 0
+) -> list[tuple[int, Optional[int]]]:
+    """Split the complete lines of a segment into byte ranges of about `size` bytes.
+
+    A line without its newline is still being written, it is left for later.
+    Compressed segments are read as one stream, so they are not split.
+
+    :param path: segment path
+    :param size: range size in bytes
+    :param start: offset of the first line
+    :return: (start, end) offsets, end is None for a compressed segment
+    """
+    if path.endswith(tuple(CODEC_SUFFIXES.values())):
+        return [(start, None)]
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size <= start:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            last = mm.rfind(b"\n", start) + 1
+            bounds = [start]
+            while bounds[-1] < last:
+                cut = mm.find(b"\n", bounds[-1] + size - 1, last) + 1
+                bounds.append(last if cut <= 0 else cut)
+    return list(zip(bounds, bounds[1:]))
+
+
+def map_segment(path: str, start: int = 0, end: Optional[int] = None) -> SegmentReport:
+    """Build the partial report of a byte range of a segment (in a worker).
+
+    :param path: segment path
+    :param start: offset of the first line of the range
+    :param end: offset of the end of the range (None to read until the end)
+    """
+    logging.debug(f"mapping {path} [{start}, {end})")
+    part = SegmentReport(path, start, end)
+    part.feed(read_range(path, start, end))
+    if end is None:
+        part.end = start + part.size
+    if part.replay:
+        # kept in the report, the segment may be compressed or removed later
+        part.prefix = list(islice(read_range(path, start, end), part.replay))
+    return part
+
+
+def _stem(name: str) -> str:
+    """Get the name of a segment without its compression suffix."""
+    for suffix in CODEC_SUFFIXES.values():
+        name = name.removesuffix(suffix)
+    return name
+
+
+class SessionReport:
+    """SessionReport merges the partial reports of a tracer in log order.
+
+    It carries the state of the session from one range to the next (the
+    pending EN events and the tables of the processes) and uses it to
+    resolve what each partial report kept aside.
+    """
+
+    def __init__(self):
+        self.segments = set()
+        self.totals = Totals()
+        self.tables = _Tables(session=True)
+        self.pending = {}
+
+    def add(self, part: SegmentReport):
+        """Merge the partial report of the next range.
+
+        :param part: the partial report
+        """
+        self.segments.add(_stem(os.path.basename(part.path)))
+        if part.prefix:
+            logging.debug(f"replaying {len(part.prefix)} lines of {part.path}")
+            events = (parse_line(line) for line in part.prefix)
+            _consume(self.__count(events), self)
+
+        for key in part.stale:
+            entry = self.pending.pop(key, None)
+            if entry is not None:
+                self.totals.add(next(pair_events([entry])))
+
+        for ev, proc in part.head:
+            entry = self.pending.pop((ev.tid, ev.op), None)
+            call = next(pair_events([ev] if entry is None else [entry, ev]))
+            self.totals.add(call, self.tables.resolve(_file(call, proc)))
+
+        self.totals.merge(part.totals, self.tables.resolve)
+        self.tables.absorb(part.tables)
+        self.pending.update(part.pending)
+
+    def __count(self, events: Iterable[Optional[Event]]) -> Iterator[Event]:
+        for ev in events:
+            if ev is not None:
+                self.totals.event(ev)
+                yield ev
+
+    def summary(self, top: int = 20) -> dict:
+        """Get the summary of the session, the pending EN events count as unpaired.
+
+        :param top: number of commands and files to keep
+        """
+        # pending calls are never attributed to a file, the file counters are shared
+        totals = Totals()
+        totals.merge(self.totals, files=False)
+        totals.files = self.totals.files
+        for call in pair_events([], pending=dict(self.pending)):
+            totals.add(call)
+        return {"segments": len(self.segments), **totals.summary(top)}
+
+
+class ReportCache:
+    """ReportCache keeps the partial report of each range of the segments.
+
+    A segment is known by its path, size and mtime. An unchanged segment is
+    not read again, a grown one (the active segment) is only read after its
+    last range, and a segment compressed after it was read keeps its
+    ranges. Any other change reads the segment again.
+
+    The merged report of each tracer is kept too, with the ranges it
+    covers, so a refresh only merges the new ranges. It is rebuilt from the
+    partial reports when a range it covers is gone (e.g. by retention).
+    With a directory, everything is saved there for the next runs.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        """ReportCache constructor.
+
+        :param cache_dir: the directory of the cache (None to keep it in memory)
+        """
+        self._dir = cache_dir
+        self._segments = {}  # stem => {"path", "size", "mtime", "ranges"}
+        self._parts = {}  # (stem, start) => SegmentReport, without a directory
+        self._sessions = {}  # tracer => (covered ranges, SessionReport)
+        self._changed = False
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.__load()
+
+    def __file(self, name: str) -> str:
+        return os.path.join(self._dir, name)
+
+    def __load(self):
+        try:
+            with open(self.__file(_CACHE_INDEX)) as f:
+                index = json.load(f)
+            if index.get("version") != CACHE_VERSION:
+                return
+            with open(self.__file(_CACHE_SESSIONS), "rb") as f:
+                self._sessions = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, pickle.UnpicklingError, AttributeError) as e:
+            logging.warning(f"ignoring the report cache in {self._dir}: {e}")
+            return
+        self._segments = index["segments"]
+
+    def save(self):
+        """Write the index and the merged reports into the cache directory."""
+        if self._dir is None or not self._changed:
+            return
+        index = {"version": CACHE_VERSION, "segments": self._segments}
+        for name, data, mode in (
+            (_CACHE_SESSIONS, pickle.dumps(self._sessions), "wb"),
+            (_CACHE_INDEX, json.dumps(index), "w"),
+        ):
+            tmp = self.__file(f".{name}.tmp")
+            with open(tmp, mode) as f:
+                f.write(data)
+            os.replace(tmp, self.__file(name))
+        self._changed = False
+
+    def __part(self, stem: str, start: int) -> SegmentReport:
+        if self._dir is None:
+            return self._parts[(stem, start)]
+        with open(self.__file(f"{stem}.{start}.part"), "rb") as f:
+            return pickle.load(f)
+
+    def __store(self, stem: str, part: SegmentReport):
+        self._segments[stem]["ranges"].append([part.start, part.end])
+        if self._dir is None:
+            self._parts[(stem, part.start)] = part
+        else:
+            with open(self.__file(f"{stem}.{part.start}.part"), "wb") as f:
+                pickle.dump(part, f)
+
+    def __drop(self, stem: str):
+        self._changed = True
+        entry = self._segments.pop(stem)
+        for name, (covered, _) in list(self._sessions.items()):
+            if any(r[0] == stem for r in covered):
+                del self._sessions[name]
+        for start, _ in entry["ranges"]:
+            self._parts.pop((stem, start), None)
+            if self._dir is not None:
+                try:
+                    os.remove(self.__file(f"{stem}.{start}.part"))
+                except FileNotFoundError:
+                    pass
+
+    def __check(self, path: str, stat: os.stat_result) -> Optional[int]:
+        """Find the new data of a segment.
+
+        :param path: segment path
+        :param stat: the status of the segment
+        :return: the offset of its new data (None if the segment did not change)
+        """
+        name = os.path.basename(path)
+        stem = _stem(name)
+        entry = self._segments.get(stem)
+
+        if entry is not None:
+            read = entry["ranges"][-1][1] if entry["ranges"] else 0
+            if entry["path"] == name:
+                if (entry["size"], entry["mtime"]) == (stat.st_size, stat.st_mtime_ns):
+                    return None
+                if name == stem and stat.st_size >= read:
+                    return read  # grown
+            elif name != stem and not os.path.exists(
+                os.path.join(os.path.dirname(path), stem)
+            ):
+                return read  # compressed after it was read
+            self.__drop(stem)
+
+        self._segments[stem] = {"path": name, "size": None, "mtime": None, "ranges": []}
+        return 0
+
+    def refresh(
+        self,
+        path: str,
+        tracer: Optional[str] = None,
+        pool: Optional[ProcessPoolExecutor] = None,
+        jobs: int = 1,
+    ) -> dict[str, SessionReport]:
+        """Read the new data of the segments and merge it into the reports.
+
+        :param path: an output directory or a single segment file
+        :param tracer: only read the segments of this tracer
+        :param pool: the worker processes of the map step (None to map here)
+        :param jobs: number of worker processes
+        :return: tracer => merged report
+        """
+        chains = group_segments(list_segments(path, tracer))
+
+        new = []  # (segment, stat before reading, offset of the new data)
+        for chain in chains.values():
+            for segment in chain:
+                stat = os.stat(segment)
+                start = self.__check(segment, stat)
+                if start is not None:
+                    new.append((segment, stat, start))
+
+        # the segments that are gone
+        listed = {_stem(os.path.basename(s)) for c in chains.values() for s in c}
+        for stem in list(self._segments):
+            info = segment_info(stem)
+            if stem not in listed and (tracer is None or (info and info[0] == tracer)):
+                self.__drop(stem)
+
+        # a few ranges per worker balance the load, small ranges cost more to merge
+        size = sum(max(stat.st_size - start, 0) for _, stat, start in new)
+        size = max(MIN_RANGE_SIZE, size // (jobs * 4))
+        tasks = [
+            (segment, *r)
+            for segment, _, start in new
+            for r in split_segment(segment, size, start)
+        ]
+        if pool is None:
+            parts = (map_segment(*task) for task in tasks)
+        else:
+            parts = (f.result() for f in [pool.submit(map_segment, *t) for t in tasks])
+        fresh = {}
+        for part in parts:
+            stem = _stem(os.path.basename(part.path))
+            if part.end > part.start:
+                self.__store(stem, part)
+                fresh[(stem, part.start)] = part
+
+        # the new data is read, the next refresh starts after it
+        for segment, stat, _ in new:
+            self._segments[_stem(os.path.basename(segment))].update(
+                path=os.path.basename(segment),
+                size=stat.st_size,
+                mtime=stat.st_mtime_ns,
+            )
+            self._changed = True
+
+        sessions = {}
+        for name, chain in chains.items():
+            ranges = [
+                (stem, start, end)
+                for stem in (_stem(os.path.basename(s)) for s in chain)
+                for start, end in self._segments[stem]["ranges"]
+            ]
+            covered, session = self._sessions.get(name, ([], None))
+            if session is None or ranges[: len(covered)] != covered:
+                logging.debug(f"merging every range of {name} again")
+                covered, session = [], SessionReport()
+            for stem, start, _ in ranges[len(covered) :]:
+                session.add(fresh.get((stem, start)) or self.__part(stem, start))
+            self._sessions[name] = (ranges, session)
+            sessions[name] = session
+
+        for name in list(self._sessions):
+            if name not in chains and (tracer is None or name == tracer):
+                del self._sessions[name]
+
+        if fresh:
+            logging.info(
+                f"{len(fresh)} new ranges in {len(new)} segments, "
+                f"{sum(p.size for p in fresh.values())} bytes read"
+            )
+        return sessions
+
+
+def _init_worker():
+    """Leave ctrl-c to the main process, which stops the pool."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _workers(jobs: int):
+    """Get the pool of the map step (a null context for a single job)."""
+    if jobs == 1:
+        return nullcontext()
+    return ProcessPoolExecutor(jobs, initializer=_init_worker)
+
+
+def build_report(
+    path: str,
+    tracer: Optional[str] = None,
+    jobs: Optional[int] = None,
+    top: int = 20,
+    cache_dir: Optional[str] = None,
+) -> dict:
+    """Count the calls, bytes, latency and files of every tracer.
+
+    The segments are split into ranges, parsed in parallel (map) and merged
+    in log order (reduce). The results are the same as a single pass over
+    the logs. With a cache, only the data written since the last run is read.
+
+    :param path: an output directory or a single segment file
+    :param tracer: only read the segments of this tracer
+    :param jobs: number of worker processes (default: one per cpu)
+    :param top: number of commands and files to keep per tracer
+    :param cache_dir: the directory of the partial reports (None for no cache)
+    :return: tracer => summary
+    """
+    jobs = jobs or os.cpu_count() or 1
+    cache = ReportCache(cache_dir)
+    with _workers(jobs) as pool:
+        sessions = cache.refresh(path, tracer, pool, jobs)
+    cache.save()
+    return {name: session.summary(top) for name, session in sessions.items()}
+
+
+def follow_report(
+    path: str,
+    tracer: Optional[str] = None,
+    jobs: Optional[int] = None,
+    top: int = 20,
+    cache_dir: Optional[str] = None,
+    interval: float = FOLLOW_INTERVAL,
+) -> Iterator[dict]:
+    """Follow the segments of a running session, like `tail -F` across rotations.
+
+    Each refresh reads what was written since the previous one (the new
+    lines of the active segment, and the new segments) and merges it. The
+    cache is saved when the stream is closed.
+
+    :param path: an output directory
+    :param tracer: only read the segments of this tracer
+    :param jobs: number of worker processes (default: one per cpu)
+    :param top: number of commands and files to keep per tracer
+    :param cache_dir: the directory of the partial reports (None to keep them in memory)
+    :param interval: seconds between two refreshes
+    :return: a stream of tracer => summary
+    """
+    jobs = jobs or os.cpu_count() or 1
+    cache = ReportCache(cache_dir)
+    try:
+        with _workers(jobs) as pool:
+            while True:
+                started = time.monotonic()
+                try:
+                    sessions = cache.refresh(path, tracer, pool, jobs)
+                except FileNotFoundError as e:
+                    # not created yet, or rotated away while it was read
+                    logging.debug(f"refresh skipped: {e}")
+                else:
+                    yield {
+                        name: session.summary(top) for name, session in sessions.items()
+                    }
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    finally:
+        cache.save()
@@ -0,0 +1,294 @@
+import gzip
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Optional
+
+from src.index import build_index, index_path
+from src.parser.reader import CODEC_SUFFIXES, group_segments, list_segments, zstandard
+
+# size of the userspace write buffer of a segment file
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# compression levels, fast enough to keep up with a busy tracer on one core
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# worker process that indexes, compresses and prunes the closed segments
+_worker = None
+
+
+def default_codec() -> str:
+    """Get the best available compression codec (zstd if installed, else gzip)."""
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def compress_segment(path: str, codec: str) -> str:
+    """Compress a closed segment and remove the plain file.
+
+    The compressed file is written under a temporary name and renamed, so
+    readers see either the plain or the complete compressed segment.
+
+    :param path: the segment path
+    :param codec: gzip or zstd
+    :return: the compressed segment path
+    """
+    target = path + CODEC_SUFFIXES[codec]
+    with open(path, "rb") as src, open(target + ".tmp", "wb") as dst:
+        if codec == "zstd":
+            cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+            cctx.copy_stream(src, dst)
+        else:
+            with gzip.GzipFile(fileobj=dst, mode="wb", compresslevel=GZIP_LEVEL) as gz:
+                shutil.copyfileobj(src, gz, 1024 * 1024)
+
+    # keep the close time, retention removes the oldest segments first
+    shutil.copystat(path, target + ".tmp")
+    os.replace(target + ".tmp", target)
+    os.remove(path)
+    return target
+
+
+def enforce_retention(output_dir: str, max_bytes: int = 0, max_segments: int = 0):
+    """Delete the oldest segments until the output directory is within the limits.
+
+    The limits count the segments of every tracer. The last segment of each
+    tracer is kept, since it may still be written.
+
+    :param output_dir: the output directory of the session
+    :param max_bytes: maximum total size of the segments (0 for no limit)
+    :param max_segments: maximum number of segments (0 for no limit)
+    """
+    segments = list_segments(output_dir)
+    sizes = {path: os.path.getsize(path) for path in segments}
+    total, count = sum(sizes.values()), len(segments)
+
+    # oldest closed segments first
+    candidates = sorted(
+        (path for chain in group_segments(segments).values() for path in chain[:-1]),
+        key=os.path.getmtime,
+    )
+    for path in candidates:
+        if (not max_bytes or total <= max_bytes) and (
+            not max_segments or count <= max_segments
+        ):
+            break
+
+        os.remove(path)
+        try:
+            os.remove(index_path(path))
+        except FileNotFoundError:
+            pass
+        total -= sizes[path]
+        count -= 1
+        logging.info(f"retention: removed {path}")
+
+
+def finish_segment(
+    path: str,
+    index: bool = True,
+    codec: Optional[str] = None,
+    max_bytes: int = 0,
+    max_segments: int = 0,
+):
+    """Index, compress and apply the retention limits after a segment is closed.
+
+    :param path: the closed segment path
+    :param index: build the sidecar index of the segment
+    :param codec: compress the segment with gzip or zstd (None to keep it plain)
+    :param max_bytes: maximum total size of the segments (0 for no limit)
+    :param max_segments: maximum number of segments (0 for no limit)
+    """
+    if not os.path.exists(path):
+        return  # already removed by the retention limits
+
+    if index:
+        build_index(path)
+    if codec:
+        compress_segment(path, codec)
+    if max_bytes or max_segments:
+        enforce_retention(os.path.dirname(path), max_bytes, max_segments)
+
+
+def _init_worker():
+    """Run the worker below the tracers, and leave ctrl-c to the supervisor."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.nice(10)
+
+
+def _finished(future: Future):
+    if future.exception() is not None:
+        logging.warning(f"processing a closed segment failed: {future.exception()}")
+
+
+def finish_in_background(path: str, *options):
+    """Run finish_segment in a worker process.
+
+    Parsing and compressing cost more than writing, so they are kept out of
+    the supervisor loop. Every writer shares one worker, so retention never
+    races with compression. Pending segments are done before the interpreter
+    exits, and a segment without index is indexed by its first query.
+
+    :param path: the closed segment path
+    :param options: the other arguments of finish_segment
+    """
+    global _worker
+    try:
+        if _worker is None:
+            _worker = ProcessPoolExecutor(
+                1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        _worker.submit(finish_segment, path, *options).add_done_callback(_finished)
+    except Exception as e:
+        logging.warning(f"cannot process {path} in background: {e}")
+
+
+def wait_background():
+    """Wait until every closed segment queued so far is processed."""
+    global _worker
+    if _worker is not None:
+        _worker.shutdown(wait=True)
+        _worker = None
+
+
+class SegmentWriter:
+    """SegmentWriter writes a byte stream into rotated trace segments.
+
+    Segments are named trace_<name>_<index>.log and are only cut on
+    newline boundaries, so every segment holds complete lines. A segment
+    is cut when it reaches the rotate size or the rotate interval. Closed
+    segments are indexed, compressed and pruned in background.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        name: str,
+        rotate_size: int = 100 * 1024 * 1024,
+        buffer_size: int = WRITE_BUFFER_SIZE,
+        index: bool = True,
+        rotate_interval: float = 0,
+        compress: Optional[str] = None,
+        max_bytes: int = 0,
+        max_segments: int = 0,
+    ):
+        """SegmentWriter constructor.
+
+        :param output_dir: the output directory to store segments
+        :param name: the segment name (usually the tracer id)
+        :param rotate_size: the maximum segment size in bytes
+        :param buffer_size: the write buffer size in bytes
+        :param index: index each closed segment for time and pid queries
+        :param rotate_interval: the maximum segment age in seconds (0 for no limit)
+        :param compress: compress closed segments with gzip or zstd (None for plain)
+        :param max_bytes: maximum total size of the session segments (0 for no limit)
+        :param max_segments: maximum number of session segments (0 for no limit)
+        """
+        self._output_dir = output_dir
+        self._name = name
+        self._rotate_size = rotate_size
+        self._buffer_size = buffer_size
+        self._indexed = index
+        self._rotate_interval = rotate_interval
+        self._compress = compress
+        self._max_bytes = max_bytes
+        self._max_segments = max_segments
+
+        self._index = 0  # index of the next segment
+        self._size = 0  # bytes written to the current segment
+        self._partial = False  # the current segment ends in the middle of a line
+        self._opened = 0.0  # monotonic time the current segment was opened
+        self._f = None
+
+    def path(self, index: int) -> str:
+        """Get the path of a segment.
+
+        :param index: the segment index
+        """
+        return os.path.join(self._output_dir, f"trace_{self._name}_{index}.log")
+
+    def open(self):
+        """Close the current segment (if any) and open the next one."""
+        self.close()
+
+        filename = self.path(self._index)
+        logging.info(f"[{self._name}] rotating to {filename}")
+
+        self._f = open(filename, "wb", buffering=self._buffer_size)
+        self._size = 0
+        self._partial = False
+        self._opened = time.monotonic()
+        self._index += 1
+
+    def close(self):
+        """Flush and close the current segment."""
+        if self._f:
+            self._f.close()
+            self._f = None
+            options = (self._compress, self._max_bytes, self._max_segments)
+            if self._size and (self._indexed or any(options)):
+                finish_in_background(
+                    self.path(self._index - 1), self._indexed, *options
+                )
+
+    def __write(self, data: memoryview):
+        self._f.write(data)
+        self._size += len(data)
+        self._partial = data[-1] != 0x0A  # "\n"
+
+    def write(self, data: bytes):
+        """Write a chunk of the stream, rotating on newline boundaries.
+
+        The chunk does not have to end on a newline, a trailing partial
+        line is completed by the next chunk in the same segment.
+
+        :param data: raw bytes read from the tracer
+        """
+        if self._f is None:
+            self.open()
+
+        view = memoryview(data)
+        start, end = 0, len(data)
+
+        # the segment is old enough, cut at the first line boundary
+        expired = (
+            self._rotate_interval
+            and self._size
+            and time.monotonic() - self._opened >= self._rotate_interval
+        )
+        if expired:
+            cut = data.find(b"\n") + 1 if self._partial else 0
+            if cut or not self._partial:
+                if cut:
+                    self.__write(view[:cut])
+                    start = cut
+                self.open()
+
+        while self._size + (end - start) > self._rotate_size:
+            # cut after the last newline that still fits in the segment
+            room = self._rotate_size - self._size
+            cut = data.rfind(b"\n", start, start + max(room, 0)) + 1
+
+            if cut == 0 and (self._size == 0 or self._partial):
+                # a line longer than the segment, or the tail of an open line,
+                # is finished in the current segment
+                cut = data.find(b"\n", start) + 1
+                if cut == 0:
+                    break
+
+            if cut:
+                self.__write(view[start:cut])
+                start = cut
+                if start == end:
+                    return
+
+            self.open()
+
+        if start < end:
+            self.__write(view[start:])
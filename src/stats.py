@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from src.tracer import Tracer
+
+# seconds between two writes of stats.json
+STATS_INTERVAL = 5.0
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def proc_stat(pid: int) -> Optional[dict]:
+    """Read the cpu time and resident memory of a process from /proc/<pid>/stat.
+
+    :param pid: process id
+    :return: cpu_seconds (user + system) and rss_bytes, or None if the process is gone
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    # the command may hold spaces and parentheses, the fields start after the last ")"
+    fields = data[data.rfind(")") + 2 :].split()
+    utime, stime, rss = int(fields[11]), int(fields[12]), int(fields[21])
+    return {
+        "cpu_seconds": (utime + stime) / _CLK_TCK,
+        "rss_bytes": rss * _PAGE_SIZE,
+    }
+
+
+class StatsRecorder:
+    """StatsRecorder writes the counters of the tracers into stats.json.
+
+    Each write has the totals since start, the rates over the last interval
+    (lines/s, bytes/s, cpu %) and the resources of every bpftrace child and
+    of FLAK itself. The last write is the final summary of the session.
+    """
+
+    def __init__(
+        self, output_dir: str, tracers: list[Tracer], interval: float = STATS_INTERVAL
+    ):
+        """StatsRecorder constructor.
+
+        :param output_dir: the output directory (stats.json is written there)
+        :param tracers: the tracers to follow
+        :param interval: seconds between two writes
+        """
+        self._path = os.path.join(output_dir, "stats.json")
+        self._tracers = tracers
+        self._interval = interval
+
+        self._start = time.monotonic()
+        self._deadline = self._start + interval
+        self._last = {}  # tracer name => (monotonic time, metrics, proc stat)
+        self._peak_rss = {}  # tracer name => peak rss in bytes
+
+    def deadline(self) -> float:
+        """Get the monotonic time of the next write."""
+        return self._deadline
+
+    def __tracer(self, tracer: Tracer, now: float) -> dict:
+        """Collect the counters of one tracer and their rates since the last write."""
+        name = tracer.name()
+        metrics = tracer.metrics()
+        proc = tracer.process()
+
+        stat = proc_stat(proc.pid) if tracer.running() else None
+        then, previous, last_stat = self._last.get(name, (self._start, {}, None))
+        if stat is None:
+            stat = last_stat  # the process exited, keep its last numbers
+        else:
+            self._peak_rss[name] = max(self._peak_rss.get(name, 0), stat["rss_bytes"])
+
+        elapsed = max(now - then, 1e-9)
+        entry = dict(metrics)
+        for key in ("lines", "bytes"):
+            if key in metrics:
+                entry[f"{key}_per_second"] = (
+                    metrics[key] - previous.get(key, 0)
+                ) / elapsed
+                entry[f"avg_{key}_per_second"] = metrics[key] / max(
+                    now - self._start, 1e-9
+                )
+
+        entry["pid"] = proc.pid if proc else None
+        entry["running"] = tracer.running()
+        if tracer.ready():
+            entry["attach_seconds"] = tracer.attach_seconds()
+        if proc is not None and proc.returncode is not None:
+            entry["exit_code"] = proc.returncode
+        if stat is not None:
+            entry["cpu_seconds"] = stat["cpu_seconds"]
+            entry["rss_bytes"] = stat["rss_bytes"]
+            entry["peak_rss_bytes"] = self._peak_rss.get(name, stat["rss_bytes"])
+            if last_stat is not None:
+                cpu = stat["cpu_seconds"] - last_stat["cpu_seconds"]
+                entry["cpu_percent"] = 100 * cpu / elapsed
+
+        self._last[name] = (now, metrics, stat)
+        return entry
+
+    def write(self, final: bool = False):
+        """Write stats.json (through a temporary file, so readers never see half of it).
+
+        :param final: this is the summary written at shutdown
+        """
+        now = time.monotonic()
+        self._deadline = now + self._interval
+
+        stats = {
+            "ts": time.time(),
+            "uptime_seconds": now - self._start,
+            "final": final,
+            "tracers": {t.name(): self.__tracer(t, now) for t in self._tracers},
+            "supervisor": proc_stat(os.getpid()),
+        }
+
+        try:
+            with open(self._path + ".tmp", "w") as f:
+                json.dump(stats, f, indent=2)
+            os.replace(self._path + ".tmp", self._path)
+        except OSError as e:
+            logging.warning(f"cannot write {self._path}: {e}")
+            return
+
+        if final:
+            for name, entry in stats["tracers"].items():
+                logging.info(
+                    f"[{name}] {entry.get('lines', '-')} lines, "
+                    f"{entry.get('bytes', 0)} bytes, "
+                    f"{entry.get('lost_events', 0)} lost events, "
+                    f"cpu {entry.get('cpu_seconds', 0):.2f}s, "
+                    f"peak rss {entry.get('peak_rss_bytes', 0) // 1024}KB"
+                )
+            logging.info(f"stats saved to: {self._path}")
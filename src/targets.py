@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+import re
+from typing import Optional
+
+from src.parser.reader import group_segments, list_segments, open_segment
+
+TARGETS_FILE = "targets.json"
+
+# the tag line a multi-target script prints for each process (once)
+_TARGET_LINE = re.compile(
+    rb"^\d+ \{pid=(-?\d+) tid=-?\d+ proc=.*?\}\{EN target\}\{target=(\d+)\}", re.M
+)
+
+# the pid of an event line
+_PID = re.compile(rb"^\d+ \{pid=(-?\d+) ")
+
+_READ_SIZE = 4 * 1024 * 1024
+
+
+def split_targets(value: str) -> list[str]:
+    """Split a comma separated list of pids, cgroup ids or pods.
+
+    :param value: the user input (e.g. 1234,5678)
+    """
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def export_targets(output_dir: str, targets: list[dict]):
+    """Write the targets of a multi-target session, in the order of their tags.
+
+    :param output_dir: the output directory to write targets.json
+    :param targets: {"name": ..., "id": ...} of each target (tag 1 is the first)
+    """
+    path = os.path.join(output_dir, TARGETS_FILE)
+    # the pods daemon rewrites the file while tools may read it
+    with open(path + ".tmp", "w") as f:
+        json.dump(targets, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+    logging.info(f"{len(targets)} targets saved to: {path}")
+
+
+def load_targets(output_dir: str) -> list[dict]:
+    """Read the targets of a multi-target session (empty for a single target).
+
+    :param output_dir: the output directory of the session
+    """
+    try:
+        with open(os.path.join(output_dir, TARGETS_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def pid_targets(path: str, tracer: Optional[str] = None) -> dict[int, str]:
+    """Map the pids of a multi-target session to the name of their target.
+
+    Each traced process prints one `{EN target}{target=N}` line before its
+    first event, N is the position of its target in targets.json.
+
+    :param path: an output directory or a single segment file
+    :param tracer: only read the segments of this tracer
+    :return: pid => target name
+    """
+    output_dir = path if os.path.isdir(path) else os.path.dirname(path)
+    names = [target["name"] for target in load_targets(output_dir)]
+
+    pids = {}
+    for segment in list_segments(path, tracer):
+        with open_segment(segment) as f:
+            carry = b""
+            while True:
+                chunk = f.read(_READ_SIZE)
+                data = carry + chunk
+                # lines are complete up to the last newline, or the end of the file
+                cut = data.rfind(b"\n") + 1 if chunk else len(data)
+                carry = data[cut:]
+                for pid, tag in _TARGET_LINE.findall(data, 0, cut):
+                    index = int(tag) - 1
+                    name = names[index] if index < len(names) else tag.decode()
+                    pids[int(pid)] = name
+                if not chunk:
+                    break
+    return pids
+
+
+def _target_dir(name: str) -> str:
+    """Get the directory name of a target (namespace/pod/container => namespace_pod_container)."""
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+
+
+def split_by_target(path: str, out_dir: str, tracer: Optional[str] = None) -> dict:
+    """Split the events of a multi-target session into one directory per target.
+
+    The events of each tracer are routed by the last tag of their pid, so a
+    pid that is reused by another target (e.g. a new pod) follows its tag.
+    Lines of untagged processes (e.g. the START line) are not copied.
+
+    :param path: an output directory or a single segment file
+    :param out_dir: the directory of the target directories
+    :param tracer: only read the segments of this tracer
+    :return: target name => number of events
+    """
+    output_dir = path if os.path.isdir(path) else os.path.dirname(path)
+    names = [target["name"] for target in load_targets(output_dir)]
+
+    counts = {}
+    files = {}  # (tracer, target name) => open output file
+    try:
+        for tname, segments in group_segments(list_segments(path, tracer)).items():
+            owners = {}  # pid => target name
+            for segment in segments:
+                with open_segment(segment) as f:
+                    for line in f:
+                        match = _PID.match(line)
+                        if match is None:
+                            continue
+                        tag = _TARGET_LINE.match(line)
+                        if tag is not None:
+                            index = int(tag.group(2)) - 1
+                            owners[int(tag.group(1))] = (
+                                names[index]
+                                if index < len(names)
+                                else tag.group(2).decode()
+                            )
+                            continue
+                        name = owners.get(int(match.group(1)))
+                        if name is None:
+                            continue
+                        if (tname, name) not in files:
+                            target_dir = os.path.join(out_dir, _target_dir(name))
+                            os.makedirs(target_dir, exist_ok=True)
+                            files[tname, name] = open(
+                                os.path.join(target_dir, f"trace_{tname}_0.log"), "wb"
+                            )
+                        files[tname, name].write(line)
+                        counts[name] = counts.get(name, 0) + 1
+    finally:
+        for f in files.values():
+            f.close()
+
+    logging.info(f"{len(counts)} targets split into {out_dir}")
+    return counts
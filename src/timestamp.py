@@ -27,3 +27,25 @@ def export_reference_timestamps(output_dir: str):
         json.dump({"ref_wall": ref_wall, "ref_mono": ref_mono}, mf, indent=2)
 
     logging.info("reference timestamps saved to: %s", meta_file)
+
+
+def load_reference_timestamps(output_dir: str) -> dict:
+    """Read the reference timestamps of a tracing session.
+
+    :param output_dir: the output directory of the session
+    :return: ref_wall (epoch seconds) and ref_mono (seconds since boot, or None)
+    """
+    with open(os.path.join(output_dir, "reference_timestamps.json")) as f:
+        return json.load(f)
+
+
+def wall_to_nsecs(ref: dict, wall: float) -> int:
+    """Convert a wall clock time into a bpftrace timestamp (nsecs).
+
+    :param ref: the reference timestamps of the session
+    :param wall: epoch seconds
+    :raises ValueError: when the session has no monotonic reference
+    """
+    if ref.get("ref_mono") is None:
+        raise ValueError("the session has no monotonic reference timestamp")
+    return int((wall - ref["ref_wall"] + ref["ref_mono"]) * 1e9)
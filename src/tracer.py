@@ -1,13 +1,40 @@
 import logging
 import os
+import queue
+import re
 import subprocess
 import threading
 import time
-from abc import ABC
+from abc import ABC, abstractmethod
+from typing import Callable, Optional
+
+from src.live import LiveMetrics
+from src.segments import SegmentWriter
+
+# maximum number of bytes taken from a tracer pipe in a single read
+READ_CHUNK_SIZE = 256 * 1024
+
+# maximum number of chunks between the pipe reader and the segment writer (64MB)
+WRITE_QUEUE_CHUNKS = 256
+
+# printed by the BEGIN probe of every script, once its probes are attached
+BEGIN_MARK = b" START tracing events "
+
+# longest end of a line kept until the rest of a lost event report is read
+LOST_TAIL_SIZE = 1024
+
+# lost event reports of bpftrace, in text and json output
+_LOST_EVENTS = re.compile(
+    rb'Lost (\d+) events|"type": ?"lost_events", ?"data": ?\{"events": ?(\d+)'
+)
 
 
 class Tracer(ABC):
-    """Tracer runs bpftrace scripts."""
+    """Tracer runs bpftrace scripts.
+
+    A tracer only spawns its bpftrace process and handles its output, the
+    process is owned and watched by the supervisor (src/matchbox.py).
+    """
 
     def __init__(
         self, tid: str, script: str, output_dir: str, termination_timeout: int = 2
@@ -27,8 +54,17 @@ class Tracer(ABC):
         self._options = []  # bpftrace options
         self._args = []  # bpftrace input arguments
 
-        self._stop_event = None
-        self._t = None
+        self._proc = None  # bpftrace process
+        self._started = None  # monotonic time of the start
+        self._attached = None  # monotonic time the BEGIN output was seen
+        self._begin_tail = b""  # end of the output scanned for the BEGIN output
+        self._begin_read = 0  # bytes of the output file scanned (mono mode)
+        self._lost_events = 0  # events bpftrace reported as lost
+        self._lost_read = 0  # bytes of the output file scanned for lost events
+        self._lost_tails = {}  # stream => its last line, until it is complete
+        self._deadline = None  # kill deadline, set once the tracer is stopping
+        self._killed = False
+        self._waker = None  # callback to wake up the supervisor
 
     def with_options(self, options: list[str]):
         """
@@ -46,152 +82,387 @@ class Tracer(ABC):
         """
         self._args += args
 
-    def start(self):
-        """Start a tracer by calling the __start_tracer in a thread."""
-        self._stop_event = threading.Event()
-        self._t = threading.Thread(target=self.start_tracer, args=(), daemon=True)
-        self._t.start()
+    def with_waker(self, waker: Optional[Callable[[], None]]):
+        """
+        Set the callback that wakes up the supervisor when the tracer is stopped.
+
+        :param waker: a signal-safe callback
+        """
+        self._waker = waker
+
+    def start(self) -> subprocess.Popen:
+        """Start the bpftrace process.
+
+        :return: the bpftrace process
+        """
+        self._started = time.monotonic()
+        self._proc = self.spawn()
+
+        # a stop request arrived while the tracer was starting
+        if self._deadline is not None:
+            self._proc.terminate()
+
+        return self._proc
 
     def stop(self):
-        """Stop the tracer by terminating its process and thread."""
-        self._stop_event.set()
-        if self._t:
-            self._t.join()
+        """Ask the tracer to stop by terminating its process.
+
+        It does not wait for the process, so it is safe to call from a signal handler.
+        """
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self._tto
+            if self.running():
+                logging.debug(f"[{self._tid}] stopping tracer")
+                self._proc.terminate()
+
+        if self._waker:
+            self._waker()
+
+    def kill(self):
+        """Kill the tracer process if it is still running."""
+        if self.running():
+            logging.debug(f"[{self._tid}] killing tracer")
+            self._proc.kill()
+        self._killed = True
+
+    def process(self) -> Optional[subprocess.Popen]:
+        """Get the bpftrace process (None if not started)."""
+        return self._proc
+
+    def running(self) -> bool:
+        """Check if the tracer process is started and not reaped yet."""
+        return self._proc is not None and self._proc.returncode is None
+
+    def deadline(self) -> Optional[float]:
+        """Get the monotonic time to kill the tracer (None if not stopping or killed)."""
+        return None if self._killed else self._deadline
+
+    def ready(self) -> bool:
+        """Check if the tracer printed its BEGIN output (its probes are attached)."""
+        return self._attached is not None
+
+    def _scan_begin(self, data: bytes):
+        """Look for the BEGIN output in the next bytes of the output.
+
+        The mark may be split between two reads, so the end of the previous
+        read is searched with them.
+        """
+        if self._attached is not None or not data:
+            return
+
+        data = self._begin_tail + data
+        if BEGIN_MARK in data:
+            self._attach()
+        else:
+            self._begin_tail = data[-(len(BEGIN_MARK) - 1) :]
+
+    def _attach(self):
+        """Record that the BEGIN output was seen."""
+        self._attached = time.monotonic()
+        logging.info(f"[{self._tid}] probes attached in {self.attach_seconds():.3f}s")
+
+    def _count_lost(self, data: bytes, end: Optional[int] = None):
+        """Count the lost event reports of bpftrace in data[:end]."""
+        end = len(data) if end is None else end
+        if data.find(b"Lost ", 0, end) < 0 and data.find(b"lost_events", 0, end) < 0:
+            return
+
+        lost = sum(
+            int(text or json) for text, json in _LOST_EVENTS.findall(data, 0, end)
+        )
+        if lost:
+            self._lost_events += lost
+            logging.warning(
+                f"[{self._tid}] bpftrace lost {lost} events (total "
+                f"{self._lost_events}), raise -rb|--perf_rb_pages "
+                f"(now {os.environ.get('BPFTRACE_PERF_RB_PAGES', 'default')})"
+            )
+
+    def _count_lost_lines(self, stream: int, chunk: bytes):
+        """Count the lost event reports in the complete lines of a stream.
 
-    def wait(self):
-        """Wait for the tracing process to finish."""
-        if self._t:
-            self._t.join()
+        The end of the last line waits for the next chunk of its stream, so a
+        report split between two reads is counted once.
+
+        :param stream: the stream of the chunk (its fd)
+        :param chunk: the next bytes of the stream (empty at its end)
+        """
+        tail = self._lost_tails.pop(stream, b"")
+        data = tail + chunk if tail else chunk
+        end = data.rfind(b"\n") + 1 if chunk else len(data)
+        self._count_lost(data, end)
+        if end < len(data):
+            # a report is a short line, the start of a longer line is dropped
+            self._lost_tails[stream] = data[max(end, len(data) - LOST_TAIL_SIZE) :]
+
+    def attach_seconds(self) -> Optional[float]:
+        """Get the seconds from the start to the BEGIN output (None until then)."""
+        if self._attached is None:
+            return None
+        return self._attached - self._started
 
     def name(self) -> str:
         """Get the name of the tracer."""
         return self._tid
 
-    @classmethod
-    def start_tracer(self):
-        pass
+    def command(self) -> list[str]:
+        """Get the bpftrace command of the tracer."""
+        return ["bpftrace"] + self._options + [self._script] + self._args
+
+    def streams(self) -> list[int]:
+        """Get the pipe descriptors the supervisor must read for this tracer."""
+        return []
+
+    def drain(self, fd: int) -> int:
+        """Read from a readable pipe of the tracer.
+
+        :param fd: one of the descriptors returned by streams
+        :raises BlockingIOError: when the pipe is empty
+        :return: the number of bytes read (0 at the end of stream)
+        """
+        return 0
+
+    def finish(self):
+        """Release the tracer resources after its process exited."""
+        logging.debug(f"[{self._tid}] exiting tracer")
+
+    def metrics(self) -> dict:
+        """Get the runtime counters of the tracer (empty without a pipe reader)."""
+        return {}
+
+    @abstractmethod
+    def spawn(self) -> subprocess.Popen:
+        """Create the bpftrace process."""
 
 
 class MonoTracer(Tracer):
-    """Tracer runs bpftrace in a separate thread with output by bpftrace."""
+    """Tracer runs bpftrace with output by bpftrace."""
 
-    def start_tracer(self):
-        """Start tracer in a new process and wait until its over or the stop event is received."""
+    def spawn(self) -> subprocess.Popen:
+        """Start tracer in a new process that writes its own output file."""
         self.with_options(
             ["-o", os.path.join(self._output_dir, f"trace_{self._tid}_0.log")]
         )
 
         # create the bpftrace command
-        bt_command = ["bpftrace"] + self._options + [self._script] + self._args
+        bt_command = self.command()
 
         logging.debug(
             "[{}] starting tracer: {}".format(self._tid, " ".join(bt_command))
         )
 
+        return subprocess.Popen(bt_command)
+
+    def ready(self) -> bool:
+        """Check the new bytes of the output file for the BEGIN output."""
+        if self._attached is None and self._started is not None:
+            try:
+                with open(
+                    os.path.join(self._output_dir, f"trace_{self._tid}_0.log"), "rb"
+                ) as f:
+                    if os.fstat(f.fileno()).st_size < self._begin_read:
+                        # truncated by bpftrace after an earlier read
+                        self._begin_read, self._begin_tail = 0, b""
+                    f.seek(self._begin_read)
+                    data = f.read(READ_CHUNK_SIZE)
+                self._begin_read += len(data)
+                self._scan_begin(data)
+            except OSError:
+                pass
+        return super().ready()
+
+    def __scan_lost(self, path: str):
+        """Count the lost event reports in the lines written since the last scan.
+
+        bpftrace prints them into its output file, only complete lines are
+        read so a report is never cut in two.
+        """
+        try:
+            with open(path, "rb") as f:
+                f.seek(self._lost_read)
+                while chunk := f.read(READ_CHUNK_SIZE):
+                    end = chunk.rfind(b"\n") + 1
+                    if end == 0:
+                        break
+                    self._count_lost(chunk, end)
+                    self._lost_read += end
+                    f.seek(self._lost_read)
+        except OSError:
+            pass
+
+    def metrics(self) -> dict:
+        """Get the output file size and the lost events (lines are not counted)."""
+        path = os.path.join(self._output_dir, f"trace_{self._tid}_0.log")
         try:
-            # run a new process
-            proc = subprocess.Popen(bt_command)
-
-            while proc.poll() is None:
-                if self._stop_event.is_set():
-                    logging.debug(f"[{self._tid}] stopping tracer")
-                    proc.terminate()
-                    try:
-                        logging.debug(f"[{self._tid}] waiting for {self._tto}s")
-                        proc.wait(timeout=self._tto)
-                    except subprocess.TimeoutExpired:
-                        logging.debug(f"[{self._tid}] killing tracer")
-                        proc.kill()
-                    return
-                time.sleep(0.2)
-        except Exception as e:
-            logging.error(f"[{self._tid}] failed: {e}")
-        finally:
-            logging.debug(f"[{self._tid}]  exiting tracer")
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        if size > self._lost_read:
+            self.__scan_lost(path)
+        return {"bytes": size, "lost_events": self._lost_events}
 
 
 class RotateTracer(Tracer):
-    """Tracer runs bpftrace in a separate thread with output log rotation."""
+    """Tracer runs bpftrace with output log rotation.
+
+    The supervisor loop only reads the pipes and queues the chunks, a writer
+    thread writes them into segments. A disk stall then fills the bounded
+    queue instead of the pipe and the perf buffers of bpftrace.
+    """
 
     def with_rotate_size(
         self,
         rotate_size: int = 100 * 1024 * 1024,
+        rotate_interval: float = 0,
     ):
         """With rotate size limit (default is 100Mb per file).
 
         :param rotate_size: the file size for rotate
+        :param rotate_interval: also rotate files older than this (seconds, 0 for none)
         """
         self._rotate_size = rotate_size
-        self._file_index = 0
-        self._current_size = 0
-        self._f = None
-
-    def __open_new_file(self):
-        """Rotate output file."""
-        if self._f:
-            self._f.close()
+        self._rotate_interval = rotate_interval
+        self._retention = (None, 0, 0)
+        self._live = None
+        self._writer = None
 
-        filename = os.path.join(
-            self._output_dir, f"trace_{self._tid}_{self._file_index}.log"
-        )
-        logging.info(f"[{self._tid}] rotating to {filename}")
+    def with_retention(
+        self, compress: Optional[str] = None, max_bytes: int = 0, max_segments: int = 0
+    ):
+        """With compression and retention of the closed files.
 
-        self._f = open(filename, "w", buffering=1)  # line-buffered
-        self._current_size = 0
-        self._file_index += 1
+        :param compress: compress closed files with gzip or zstd (None for plain)
+        :param max_bytes: delete the oldest files above this total size (0 for no limit)
+        :param max_segments: delete the oldest files above this count (0 for no limit)
+        """
+        self._retention = (compress, max_bytes, max_segments)
 
-    def __write_line(self, line: str):
-        data = line.encode()
-        if self._current_size + len(data) > self._rotate_size:
-            self.__open_new_file()
+    def with_live_metrics(self, live: LiveMetrics):
+        """With live metrics, every chunk is also offered to the live consumer.
 
-        self._f.write(line)
-        self._current_size += len(data)
+        :param live: the consumer of the tracer output (src/live.py)
+        """
+        self._live = live
 
-    def start_tracer(self):
-        """Start bpftrace and rotate logs while reading stdout."""
-        bt_cmd = ["bpftrace"] + self._options + [self._script] + self._args
+    def spawn(self) -> subprocess.Popen:
+        """Start bpftrace with its stdout and stderr connected to pipes."""
+        bt_cmd = self.command()
 
         logging.debug(f"[{self._tid}] starting tracer: {' '.join(bt_cmd)}")
 
         # setup first output file
-        self.__open_new_file()
+        compress, max_bytes, max_segments = self._retention
+        self._writer = SegmentWriter(
+            self._output_dir,
+            self._tid,
+            self._rotate_size,
+            rotate_interval=self._rotate_interval,
+            compress=compress,
+            max_bytes=max_bytes,
+            max_segments=max_segments,
+        )
+        self._writer.open()
+
+        self._queue = queue.Queue(WRITE_QUEUE_CHUNKS)
+        self._counters = {
+            "bytes": 0,
+            "lines": 0,  # counted by the writer thread
+            "chunks": 0,
+            "queue_max": 0,  # deepest queue seen by the reader, in chunks
+            "stalls": 0,  # reads that waited for a full queue
+            "stall_seconds": 0.0,
+            "write_seconds": 0.0,  # time the writer thread spent in file writes
+            "write_errors": 0,
+        }
+        self._write_thread = threading.Thread(
+            target=self.__write_loop, name=f"{self._tid}-writer", daemon=True
+        )
+        self._write_thread.start()
 
-        try:
-            proc = subprocess.Popen(
-                bt_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,  # line-buffered read
-            )
+        proc = subprocess.Popen(
+            bt_cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,  # raw binary pipe, no decoding
+        )
+        os.set_blocking(proc.stdout.fileno(), False)
+        os.set_blocking(proc.stderr.fileno(), False)
+
+        return proc
+
+    def streams(self) -> list[int]:
+        return [self._proc.stdout.fileno(), self._proc.stderr.fileno()]
+
+    def __write_loop(self):
+        """Write the queued chunks with rotation on line boundaries (writer thread)."""
+        counters = self._counters
+        while (chunk := self._queue.get()) is not None:
+            counters["lines"] += chunk.count(b"\n")
+            start = time.monotonic()
+            try:
+                self._writer.write(chunk)
+                counters["write_seconds"] += time.monotonic() - start
+            except OSError as e:
+                # keep consuming, so the reader never blocks on a dead writer
+                if not self._counters["write_errors"]:
+                    logging.error(f"[{self._tid}] writing logs failed: {e}")
+                self._counters["write_errors"] += 1
+
+    def drain(self, fd: int) -> int:
+        """Read a chunk from stdout (queued for the writer) or stderr (logged)."""
+        chunk = os.read(fd, READ_CHUNK_SIZE)
+        self._count_lost_lines(fd, chunk)
+
+        if fd == self._proc.stdout.fileno() and chunk:
+            self._scan_begin(chunk)
+
+            counters = self._counters
+            counters["bytes"] += len(chunk)
+            counters["chunks"] += 1
+            try:
+                self._queue.put_nowait(chunk)
+            except queue.Full:
+                # the disk is slower than the tracer, wait for the writer
+                start = time.monotonic()
+                self._queue.put(chunk)
+                counters["stalls"] += 1
+                counters["stall_seconds"] += time.monotonic() - start
+                logging.debug(f"[{self._tid}] write queue full, reader stalled")
+            counters["queue_max"] = max(counters["queue_max"], self._queue.qsize())
+            if self._live is not None:
+                self._live.offer(self._tid, chunk)
+        elif chunk:
+            for line in chunk.decode(errors="replace").splitlines():
+                logging.warning(f"[{self._tid}] {line}")
+
+        return len(chunk)
+
+    def metrics(self) -> dict:
+        """Get the reader and writer counters, and the current queue depth."""
+        if self._writer is None:
+            return {}
+        return dict(
+            self._counters,
+            queue_depth=self._queue.qsize(),
+            lost_events=self._lost_events,
+        )
 
-            # read until process ends or stop requested
-            while True:
-                if self._stop_event.is_set():
-                    logging.debug(f"[{self._tid}] stopping tracer")
-                    proc.terminate()
-                    try:
-                        proc.wait(timeout=self._tto)
-                    except subprocess.TimeoutExpired:
-                        logging.debug(f"[{self._tid}] killing tracer")
-                        proc.kill()
-                    break
-
-                # non-blocking line read
-                line = proc.stdout.readline()
-                if not line:
-                    # process probably exited
-                    if proc.poll() is not None:
-                        break
-                    time.sleep(0.05)
-                    continue
-
-                # write line safely with rotation
-                self.__write_line(line)
-        except Exception as e:
-            logging.error(f"[{self._tid}] tracer failed: {e}")
-        finally:
-            if self._f:
-                self._f.close()
-            logging.debug(f"[{self._tid}] exiting tracer")
+    def finish(self):
+        """Write the queued chunks, close the current segment and the pipes."""
+        if self._writer:
+            self._queue.put(None)
+            self._write_thread.join()
+            self._writer.close()
+
+            counters = self._counters
+            logging.info(
+                f"[{self._tid}] {counters['bytes']} bytes in "
+                f"{counters['chunks']} chunks, "
+                f"max queue {counters['queue_max']}/{WRITE_QUEUE_CHUNKS}, "
+                f"{counters['stalls']} stalls ({counters['stall_seconds']:.3f}s), "
+                f"{self._lost_events} lost events"
+            )
+        if self._proc:
+            self._proc.stdout.close()
+            self._proc.stderr.close()
+        super().finish()
@@ -1,8 +1,18 @@
+import argparse
 import logging
 import os
 import shutil
 import sys
 
+# bpftrace default perf ring buffer size, in pages per cpu
+DEFAULT_PERF_RB_PAGES = 64
+
+# upper bound of the auto perf ring buffer size, in pages per cpu (16MB)
+MAX_AUTO_PERF_RB_PAGES = 4096
+
+# auto gives the perf ring buffers of a tracer up to 1/256 of the available memory
+AUTO_PERF_RB_SHARE = 256
+
 
 def must_support_bpftrace():
     """Check if bpftrace is supported."""
@@ -19,3 +29,35 @@ def ensure_script(path: str):
     if not os.path.isfile(path):
         logging.error(f"required script '{path}' not found.")
         sys.exit(4)
+
+
+def auto_perf_rb_pages() -> int:
+    """Size the perf ring buffers from the available memory and the number of cpus.
+
+    :return: a power of two number of pages per cpu, at least the bpftrace default
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            fields = dict(line.split(":", 1) for line in f)
+        available = int(fields["MemAvailable"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return DEFAULT_PERF_RB_PAGES
+
+    budget = available // AUTO_PERF_RB_SHARE // (os.cpu_count() or 1)
+    pages = budget // os.sysconf("SC_PAGE_SIZE")
+    if pages < DEFAULT_PERF_RB_PAGES:
+        return DEFAULT_PERF_RB_PAGES
+    return min(1 << (pages.bit_length() - 1), MAX_AUTO_PERF_RB_PAGES)
+
+
+def parse_perf_rb_pages(value: str) -> str:
+    """Parse the BPFTRACE_PERF_RB_PAGES argument (argparse type).
+
+    :param value: a power of two number of pages per cpu, or auto
+    :return: the number of pages
+    """
+    if value == "auto":
+        return str(auto_perf_rb_pages())
+    if not value.isdigit() or int(value) < 1 or int(value) & (int(value) - 1):
+        raise argparse.ArgumentTypeError(f"{value} is not a power of two or auto")
+    return value
@@ -0,0 +1,132 @@
+# file: tests/conftest.py
+# shared helpers of the python tests, run: make test
+
+import os
+import random
+
+import pytest
+
+
+def _head(pid: int, tid: int) -> str:
+    return f"{{pid={pid} tid={tid} proc=c{pid}}}"
+
+
+def session_lines(count: int, seed: int = 0) -> list[bytes]:
+    """Create the lines of a synthetic session in the format of the templates.
+
+    Calls of the same thread may be lost (EN or EX missing), some are printed
+    as paired lines, and processes fork, exec and exit.
+
+    :param count: number of lines
+    :param seed: random seed
+    """
+    r = random.Random(seed)
+    ts = 10**9
+    lines = []
+    threads = {100: [100, 101], 200: [200]}
+    inflight = {}  # tid => (pid, op, exit args)
+    child = 300
+
+    def call(pid, tid, op, enter, exit):
+        if r.random() < 0.02:  # lost enter
+            lines.append(f"{ts} {_head(pid, tid)}{{EX {op}}}{{{exit}}}")
+        elif r.random() < 0.1:
+            latency = r.randint(1, 900)
+            lines.append(
+                f"{ts} {_head(pid, tid)}{{PA {op}}}{{{enter} {exit} latency={latency}}}"
+            )
+        else:
+            lines.append(f"{ts} {_head(pid, tid)}{{EN {op}}}{{{enter}}}")
+            inflight[tid] = (pid, op, exit)
+
+    while len(lines) < count:
+        ts += r.randint(1, 50)
+        pid = r.choice(list(threads))
+        tid = r.choice(threads[pid])
+        if tid in inflight:
+            owner, op, exit = inflight.pop(tid)
+            if r.random() > 0.02:  # lost exit
+                lines.append(f"{ts} {_head(owner, tid)}{{EX {op}}}{{{exit}}}")
+            continue
+
+        x = r.random()
+        if x < 0.12:
+            fd = r.randint(3, 12)
+            call(pid, tid, "openat", f"fname=/d/{r.randint(0, 19)}", f"ret={fd}")
+        elif x < 0.18:
+            call(pid, tid, "close", f"fd={r.randint(3, 12)}", "ret=0")
+        elif x < 0.5:
+            op = r.choice(["read", "write", "pread64", "pwrite64"])
+            ret = r.choice([4096, 100, -9, 0])
+            call(pid, tid, op, f"fd={r.randint(2, 12)} count=4096", f"ret={ret}")
+        elif x < 0.58:
+            fd = r.choice([-1, r.randint(3, 12)])
+            addr = 0x10000 * r.randint(1, 40)
+            call(pid, tid, "mmap", f"fd={fd} addr=0 len=65536 off=0", f"ret={addr}")
+        elif x < 0.62:
+            addr = 0x10000 * r.randint(1, 40)
+            call(pid, tid, "munmap", f"addr={addr} len=32768", "ret=0")
+        elif x < 0.9:
+            addr = 0x10000 * r.randint(1, 41) + r.randint(0, 0xFFFF)
+            lines.append(f"{ts} {_head(pid, tid)}{{EN page_fault_user}}{{addr={addr}}}")
+            inflight[tid] = (pid, "page_fault_user", f"latency={r.randint(1, 99)}")
+        elif x < 0.93:
+            lines.append(f"{ts} {_head(pid, tid)}{{EN fork}}{{pid={child}}}")
+            threads[child] = [child, child + 5000]
+            child += 1
+        elif x < 0.95:
+            lines.append(f"{ts} {_head(pid, tid)}{{EN exec}}{{pid={pid}}}")
+        elif x < 0.96 and len(threads) > 2 and tid == pid:
+            lines.append(f"{ts} {_head(pid, tid)}{{EX process}}{{}}")
+            del threads[pid]
+        else:
+            call(pid, tid, "newstat", "fname=/x", "ret=0")
+
+    return [line.encode() + b"\n" for line in lines]
+
+
+def write_segments(
+    out_dir: str, lines: list[bytes], segments: int, tracer: str = "all", seed: int = 0
+) -> list[str]:
+    """Cut lines into the rotated segments of a tracer, at random line boundaries.
+
+    :param out_dir: the output directory
+    :param lines: the lines of the session
+    :param segments: number of segments
+    :param tracer: the tracer name of the segments
+    :param seed: random seed of the cuts
+    :return: the segment paths in rotation order
+    """
+    cuts = sorted(random.Random(seed).sample(range(1, len(lines)), segments - 1))
+    bounds = [0] + cuts + [len(lines)]
+    paths = []
+    for i in range(segments):
+        path = os.path.join(out_dir, f"trace_{tracer}_{i}.log")
+        with open(path, "wb") as f:
+            f.writelines(lines[bounds[i] : bounds[i + 1]])
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def make_session():
+    """Get the writer of a synthetic session.
+
+    :return: a function (output directory, count, segments, seed) => (lines, paths)
+    """
+
+    def make(out_dir: str, count: int, segments: int, seed: int = 0):
+        lines = session_lines(count, seed)
+        return lines, write_segments(out_dir, lines, segments, seed=seed)
+
+    return make
+
+
+@pytest.fixture
+def session(tmp_path, make_session):
+    """Write a synthetic session of 5000 lines into 4 segments of one tracer.
+
+    :return: (output directory, lines)
+    """
+    lines, _ = make_session(str(tmp_path), 5000, 4)
+    return str(tmp_path), lines
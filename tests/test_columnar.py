@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from src.columnar import MISSING, export_segments, load_columns
+from src.parser import iter_calls
+
+# the columns of a row of _expected
+_COLUMNS = (
+    "ts",
+    "pid",
+    "tid",
+    "comm",
+    "op",
+    "ret",
+    "latency",
+    "fd",
+    "count",
+    "addr",
+    "path",
+)
+
+
+def _expected(path: str) -> list[tuple]:
+    """The rows of the calls of a session, as the columns store them."""
+    rows = []
+    for call in iter_calls(path):
+        fd = call.args.get("fd", call.args.get("oldfd", -1))
+        rows.append(
+            (
+                call.ts,
+                call.pid,
+                call.tid,
+                call.comm,
+                call.op,
+                MISSING if call.ret is None else call.ret,
+                MISSING if call.latency is None else call.latency,
+                fd,
+                call.args.get("count", MISSING),
+                call.args.get("addr", MISSING),
+                call.args.get("fname"),
+            )
+        )
+    return rows
+
+
+def _rows(cols: dict) -> list[tuple]:
+    """Read the rows back from the columns, in the order of _expected."""
+
+    def column(name: str) -> list:
+        if name not in ("comm", "op", "path"):
+            return cols[name].tolist()
+        table = cols[f"{name}_dict"]
+        return [None if code < 0 else str(table[code]) for code in cols[name]]
+
+    return list(zip(*(column(name) for name in _COLUMNS)))
+
+
+def test_npz_export_round_trip(tmp_path, session):
+    path, _ = session
+    out = os.path.join(tmp_path, "columnar")
+
+    files = export_segments(path, out)
+
+    assert [os.path.basename(f) for f in files] == [
+        f"trace_all_{i}.npz" for i in range(4)
+    ]
+    assert _rows(load_columns(files)) == _expected(path)
+
+
+def test_parquet_export_round_trip(tmp_path, session):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path, _ = session
+    out = os.path.join(tmp_path, "columnar")
+
+    files = export_segments(path, out, fmt="parquet")
+
+    rows = []
+    for file in files:
+        table = pq.read_table(file).to_pydict()
+        rows += zip(*(table[name] for name in _COLUMNS))
+    assert rows == _expected(path)
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+
+import pytest
+
+import src.containers as containers
+from src.containers import _spec_cgroup, container_cgroup, find_pod_cgroup
+from src.daemon import PodDaemon
+from src.targets import load_targets
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# the cgroup directories of the containers in fixtures/crictl/*/inspect
+_CGROUPS = {
+    "c1": "kubepods/besteffort/pod1/c1",
+    "c2": "kubepods.slice/kubepods-besteffort.slice/"
+    "kubepods-besteffort-pod2.slice/cri-containerd-c2.scope",
+    "c3": "kubepods/besteffort/pod1/c3",
+    "c9": "kubepods/pod3/c9",
+}
+
+
+@pytest.fixture
+def runtime(tmp_path, monkeypatch):
+    """Put the stub crictl on the PATH, over a cgroup tree in tmp_path.
+
+    :return: a function that sets the state of the runtime (e.g. "one")
+    """
+    root = os.path.join(tmp_path, "cgroup")
+    for path in _CGROUPS.values():
+        os.makedirs(os.path.join(root, path))
+    monkeypatch.setattr(containers, "_cgroup_root", lambda: root)
+    monkeypatch.setattr(containers, "_cgroup_ids", {})
+    monkeypatch.setenv(
+        "PATH", os.path.join(FIXTURES, "bin") + os.pathsep + os.environ["PATH"]
+    )
+
+    def state(name: str):
+        monkeypatch.setenv("CRICTL_FIXTURES", os.path.join(FIXTURES, "crictl", name))
+
+    state("one")
+    return state
+
+
+def _cgid(root: str, container: str) -> str:
+    return str(os.stat(os.path.join(root, _CGROUPS[container])).st_ino)
+
+
+def _wait(check, timeout: float = 5.0):
+    """Wait until check() is true."""
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_spec_cgroup_systemd(tmp_path):
+    scope = os.path.join(
+        tmp_path,
+        "kubepods.slice",
+        "kubepods-besteffort.slice",
+        "kubepods-besteffort-pod123.slice",
+        "cri-containerd-abc.scope",
+    )
+    os.makedirs(scope)
+
+    path = "kubepods-besteffort-pod123.slice:cri-containerd:abc"
+    assert _spec_cgroup(path, str(tmp_path)) == scope
+    assert _spec_cgroup(":cri-containerd:abc", str(tmp_path)) is None
+
+
+def test_spec_cgroup_cgroupfs(tmp_path):
+    os.makedirs(os.path.join(tmp_path, "kubepods", "besteffort", "pod123", "abc"))
+
+    path = "/kubepods/besteffort/pod123/abc"
+    assert _spec_cgroup(path, str(tmp_path)) == os.path.join(tmp_path, path[1:])
+    assert _spec_cgroup("/kubepods/besteffort/pod123/def", str(tmp_path)) is None
+
+
+def test_container_cgroup(tmp_path, runtime):
+    root = os.path.join(tmp_path, "cgroup")
+    runtime("two")
+
+    assert container_cgroup("c1") == _cgid(root, "c1")
+    assert container_cgroup("c2") == _cgid(root, "c2")
+    with pytest.raises(RuntimeError):
+        container_cgroup("c404")
+
+
+def test_find_pod_cgroup_waits_for_the_container(tmp_path, runtime):
+    root = os.path.join(tmp_path, "cgroup")
+    # the event stream of the stub ends at once, the wait polls
+    timer = threading.Timer(0.3, runtime, ["two"])
+    timer.start()
+    try:
+        assert find_pod_cgroup("default", "web-2", "app") == _cgid(root, "c2")
+    finally:
+        timer.cancel()
+
+
+def test_daemon_follows_pod_churn(tmp_path, runtime):
+    root = os.path.join(tmp_path, "cgroup")
+    out = os.path.join(tmp_path, "out")
+    daemon = PodDaemon(out, selector=["app=web"], interval=0.05)
+
+    def names():
+        return [(t["name"], t["container"]) for t in load_targets(out)]
+
+    daemon.start()
+    try:
+        _wait(lambda: names() == [("default/web-1/app", "c1")])
+        assert load_targets(out)[0]["id"] == _cgid(root, "c1")
+
+        runtime("two")
+        _wait(lambda: len(names()) == 2)
+        assert names()[1] == ("default/web-2/app", "c2")
+
+        # c1 exits and is restarted as c3, which gets a new index
+        runtime("three")
+        _wait(lambda: len(names()) == 3)
+    finally:
+        daemon.stop()
+
+    targets = load_targets(out)
+    assert names() == [
+        ("default/web-1/app", "c1"),
+        ("default/web-2/app", "c2"),
+        ("default/web-1/app", "c3"),
+    ]
+    assert [t["id"] for t in targets] == [_cgid(root, c) for c in ("c1", "c2", "c3")]
+    assert targets[0]["started"] <= targets[0]["stopped"] <= targets[2]["started"]
+    assert "stopped" not in targets[1] and "stopped" not in targets[2]
+    assert not os.path.exists(os.path.join(out, "targets.json.tmp"))
+
+
+def test_daemon_saves_the_targets_after_a_failed_write(tmp_path, runtime):
+    out = os.path.join(tmp_path, "out")
+    # the write of targets.json fails while its temporary path is taken
+    blocker = os.path.join(out, "targets.json.tmp")
+    os.makedirs(blocker)
+    daemon = PodDaemon(out, selector=["app=web"], interval=0.05)
+
+    daemon.start()
+    try:
+        time.sleep(0.2)
+        assert daemon._thread.is_alive()
+        assert load_targets(out) == []
+
+        os.rmdir(blocker)
+        _wait(lambda: len(load_targets(out)) == 1)
+    finally:
+        daemon.stop()
@@ -0,0 +1,70 @@
+from src.faults import RegionIndex, resolve_faults, summarize_faults
+from src.parser import pair_events, parse_line
+
+
+def test_partial_munmap_splits_a_region():
+    index = RegionIndex()
+    index.map(0x10000, 0x4000, "/data/a", 0x1000)
+
+    index.unmap(0x11000, 0x1000)
+
+    assert list(index) == [
+        (0x10000, 0x11000, "/data/a", 0x1000),
+        (0x12000, 0x14000, "/data/a", 0x3000),
+    ]
+    assert index.lookup(0x10010) == ("/data/a", 0x1010)
+    assert index.lookup(0x11800) is None
+    assert index.lookup(0x12004) == ("/data/a", 0x3004)
+    assert index.lookup(0x14000) is None
+
+
+def test_map_replaces_what_it_overlaps():
+    index = RegionIndex()
+    index.map(0x10000, 0x2000, "/data/a")
+    index.map(0x12000, 0x2000, "/data/b")
+
+    # anonymous memory over the end of a and the start of b
+    index.map(0x11000, 0x2000, None)
+
+    assert list(index) == [
+        (0x10000, 0x11000, "/data/a", 0),
+        (0x11000, 0x13000, None, 0),
+        (0x13000, 0x14000, "/data/b", 0x1000),
+    ]
+    # an unmap over every region
+    index.unmap(0xF000, 0x10000)
+    assert len(index) == 0
+
+
+def _faults(text: str) -> list:
+    events = [parse_line(line.encode()) for line in text.strip().splitlines()]
+    return list(resolve_faults(pair_events(events)))
+
+
+def test_resolve_faults():
+    faults = _faults("""
+10 {pid=1 tid=1 proc=a}{PA openat}{fname=/data/a ret=3 latency=1}
+20 {pid=1 tid=1 proc=a}{PA mmap}{fd=3 addr=0 len=16384 off=4096 ret=65536 latency=1}
+30 {pid=1 tid=1 proc=a}{PA close}{fd=3 ret=0 latency=1}
+40 {pid=1 tid=1 proc=a}{EN page_fault_user}{addr=73733}
+41 {pid=1 tid=1 proc=a}{EX page_fault_user}{latency=1}
+50 {pid=1 tid=1 proc=a}{EN fork}{pid=2}
+60 {pid=1 tid=1 proc=a}{PA munmap}{addr=69632 len=4096 ret=0 latency=1}
+70 {pid=1 tid=1 proc=a}{EN page_fault_user}{addr=69632}
+80 {pid=2 tid=2 proc=a}{EN page_fault_user}{addr=69632}
+90 {pid=1 tid=1 proc=a}{EN page_fault_user}{addr=4096}
+""")
+
+    # 73733 is 8197 bytes into the region, which starts at file offset 4096
+    assert [(f.pid, f.path, f.page) for f in faults] == [
+        (1, "/data/a", 3),
+        (1, None, None),  # unmapped by the parent
+        (2, "/data/a", 2),  # the child keeps its copy of the mappings
+        (1, None, None),
+    ]
+    assert faults[0].latency == 1
+
+    summary = summarize_faults(faults, region_pages=2)
+    assert summary["total"] == 4 and summary["unresolved"] == 2
+    assert summary["files"] == [("/data/a", 2)]
+    assert sorted(summary["regions"]) == [(("/data/a", 2), 2)]
@@ -0,0 +1,116 @@
+import gzip
+import os
+import random
+import shutil
+
+import pytest
+
+from src.index import SegmentIndexer, build_index, index_path, query
+from src.parser import list_segments, parse_line
+
+
+def _scan(lines, start=None, end=None, pids=None, comms=None) -> list[bytes]:
+    """Filter every line of the session, the result of a query without index."""
+    found = []
+    for line in lines:
+        event = parse_line(line)
+        if event is None:
+            continue
+        if (start is not None and event.ts < start) or (
+            end is not None and event.ts > end
+        ):
+            continue
+        if pids is not None and event.pid not in pids:
+            continue
+        if comms is not None and event.comm not in comms:
+            continue
+        found.append(line)
+    return found
+
+
+@pytest.fixture
+def indexed(session):
+    """The session with small blocks, so a window covers part of them."""
+    path, lines = session
+    for segment in list_segments(path):
+        build_index(segment, every=64)
+    return path, lines
+
+
+def test_query_matches_a_scan(indexed):
+    path, lines = indexed
+    r = random.Random(5)
+    first, last = parse_line(lines[0]).ts, parse_line(lines[-1]).ts
+
+    for _ in range(50):
+        start, end = sorted(r.randint(first - 100, last + 100) for _ in range(2))
+        pids = r.choice([None, {100}, {200, 301}, {404}])
+        comms = r.choice([None, ["c100"], ["c200", "c300"]])
+
+        assert list(query(path, start, end, pids, comms)) == _scan(
+            lines, start, end, pids, comms
+        )
+
+
+def test_query_window_bounds(indexed):
+    path, lines = indexed
+    stamps = [parse_line(line).ts for line in lines]
+
+    # a window of one timestamp, on a block boundary and inside a block
+    for i in (0, 64, 65, len(lines) - 1):
+        assert list(query(path, stamps[i], stamps[i])) == _scan(
+            lines, stamps[i], stamps[i]
+        )
+    assert list(query(path)) == lines
+    assert list(query(path, stamps[-1] + 1)) == []
+    assert list(query(path, end=stamps[0] - 1)) == []
+
+
+def test_query_out_of_order_events(tmp_path):
+    # bpftrace prints the events of each cpu buffer in turn
+    r = random.Random(2)
+    stamps = [1000 + i * 10 + r.randint(-30, 30) for i in range(1000)]
+    lines = [
+        f"{ts} {{pid=1 tid=1 proc=a}}{{EN read}}{{fd=3}}\n".encode() for ts in stamps
+    ]
+    segment = os.path.join(tmp_path, "trace_io_0.log")
+    with open(segment, "wb") as f:
+        f.writelines(lines)
+    build_index(segment, every=16)
+
+    for start, end in ((1000, 1200), (3333, 3400), (5000, 9000)):
+        assert list(query(str(tmp_path), start, end)) == _scan(lines, start, end)
+
+
+def test_query_compressed_segments(indexed):
+    path, lines = indexed
+    for segment in list_segments(path)[:2]:
+        with open(segment, "rb") as src, gzip.open(segment + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(segment)
+    start = parse_line(lines[1000]).ts
+    end = parse_line(lines[4000]).ts
+
+    assert list(query(path, start, end, pids={100})) == _scan(
+        lines, start, end, pids={100}
+    )
+
+
+def test_indexer_chunks(session):
+    path, _ = session
+    segment = list_segments(path)[0]
+    with open(segment, "rb") as f:
+        data = f.read()
+    expected = build_index(segment, every=64)
+    assert os.path.exists(index_path(segment))
+
+    # any split of the lines gives the same index
+    r = random.Random(1)
+    indexer = SegmentIndexer(every=64)
+    pos = 0
+    while pos < len(data):
+        step = r.choice([1, 7, 100, 5000])
+        indexer.feed(data[pos : pos + step])
+        pos += step
+
+    assert indexer.summary() == expected
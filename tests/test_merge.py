@@ -0,0 +1,129 @@
+import os
+import random
+
+from src.parser import iter_merged_lines, write_timeline
+from src.parser.merge import _EVENT_TS
+
+
+def _write(path: str, lines: list[str]):
+    with open(path, "w") as f:
+        f.writelines(line + "\n" for line in lines)
+
+
+def _ts(line: bytes) -> int:
+    return int(_EVENT_TS.match(line).group(1))
+
+
+def test_merge_orders_nearly_sorted_logs(tmp_path):
+    r = random.Random(3)
+    slack = 1000
+    for tracer in ("io", "memory"):
+        # each log is sorted, except for a disorder below the slack (per-cpu buffers)
+        ts = sorted(r.randint(0, 10**6) for _ in range(2000))
+        shuffled = [t + r.randint(0, slack - 1) for t in ts]
+        _write(
+            os.path.join(tmp_path, f"trace_{tracer}_0.log"),
+            ["Attaching 12 probes..."]
+            + [f"{t} {{pid=1 tid=1 proc=a}}{{EN read}}{{fd=3}}" for t in shuffled],
+        )
+
+    merged = list(iter_merged_lines(str(tmp_path), slack=slack))
+
+    assert len(merged) == 4000
+    assert [_ts(line) for line in merged] == sorted(_ts(line) for line in merged)
+
+
+def test_merge_follows_rotated_segments(tmp_path):
+    _write(
+        os.path.join(tmp_path, "trace_io_0.log"),
+        [
+            "10 {pid=1 tid=1 proc=a}{EN read}{fd=3}",
+            "30 {pid=1 tid=1 proc=a}{EX read}{ret=1}",
+        ],
+    )
+    _write(
+        os.path.join(tmp_path, "trace_io_1.log"),
+        ["50 {pid=1 tid=1 proc=a}{EN read}{fd=3}"],
+    )
+    _write(
+        os.path.join(tmp_path, "trace_memory_0.log"),
+        [
+            "20 {pid=1 tid=1 proc=a}{EN mmap}{fd=3}",
+            "40 {pid=1 tid=1 proc=a}{EX mmap}{ret=1}",
+        ],
+    )
+
+    assert [_ts(line) for line in iter_merged_lines(str(tmp_path))] == [
+        10,
+        20,
+        30,
+        40,
+        50,
+    ]
+
+
+def test_merge_drops_only_metadata_copies(tmp_path):
+    slack = 100
+    _write(
+        os.path.join(tmp_path, "trace_io_0.log"),
+        [
+            "1000 {pid=1 tid=1 proc=a}{EN openat}{fname=/data/a}",
+            "1010 {pid=1 tid=1 proc=a}{EX openat}{ret=3}",
+            "1020 {pid=1 tid=1 proc=a}{EN read}{fd=3 count=4096}",
+            "1030 {pid=1 tid=1 proc=a}{EX read}{ret=4096}",
+            "5000 {pid=1 tid=1 proc=a}{EN close}{fd=3}",
+        ],
+    )
+    _write(
+        os.path.join(tmp_path, "trace_memory_0.log"),
+        [
+            "1002 {pid=1 tid=1 proc=a}{EN openat}{fname=/data/a}",
+            "1012 {pid=1 tid=1 proc=a}{EX openat}{ret=3}",
+            # the same text as the read of io, but another call
+            "1025 {pid=1 tid=1 proc=a}{EN read}{fd=3 count=4096}",
+            "1035 {pid=1 tid=1 proc=a}{EX read}{ret=4096}",
+            # further than the slack from the close of io
+            "5200 {pid=1 tid=1 proc=a}{EN close}{fd=3}",
+        ],
+    )
+
+    merged = [line.decode() for line in iter_merged_lines(str(tmp_path), slack=slack)]
+    ops = [line.split("}{", 1)[1].split("}", 1)[0] for line in merged]
+
+    assert ops == [
+        "EN openat",
+        "EX openat",
+        "EN read",
+        "EN read",
+        "EX read",
+        "EX read",
+        "EN close",
+        "EN close",
+    ]
+    assert len(list(iter_merged_lines(str(tmp_path), slack=slack, dedupe=False))) == 10
+
+
+def test_merge_keeps_copies_of_the_same_tracer(tmp_path):
+    _write(
+        os.path.join(tmp_path, "trace_io_0.log"),
+        [
+            "1000 {pid=1 tid=1 proc=a}{EN close}{fd=3}",
+            "1001 {pid=1 tid=1 proc=a}{EN close}{fd=3}",
+        ],
+    )
+    _write(
+        os.path.join(tmp_path, "trace_memory_0.log"),
+        ["1002 {pid=1 tid=1 proc=a}{EN close}{fd=3}"],
+    )
+
+    # the memory copy matches one of the io lines, the other io line is a call
+    assert len(list(iter_merged_lines(str(tmp_path)))) == 2
+
+
+def test_write_timeline(tmp_path, session):
+    path, lines = session
+    out = os.path.join(tmp_path, "timeline.log")
+
+    assert write_timeline(path, out) == len(lines)
+    with open(out, "rb") as f:
+        assert f.read().splitlines(keepends=True) == sorted(lines, key=_ts)
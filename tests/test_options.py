@@ -0,0 +1,30 @@
+import argparse
+from dataclasses import asdict
+
+from src.options import TraceOptions, add_trace_arguments
+
+
+def _parse(*argv: str) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    add_trace_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def test_default_arguments_are_the_default_options():
+    assert TraceOptions.from_args(_parse()) == TraceOptions()
+
+
+def test_trace_arguments():
+    options = TraceOptions.from_args(
+        _parse("-r", "-rs", "1024", "-cz", "-pr", "read, mmap", "-pp", "/data/,/db/")
+    )
+
+    assert asdict(options) == dict(
+        asdict(TraceOptions()),
+        rotate=True,
+        rotate_size=1024,
+        compress="auto",
+        probes=["read", "mmap"],
+        path_prefix=["/data/", "/db/"],
+    )
+    assert options.rendered()
@@ -0,0 +1,160 @@
+import gzip
+import os
+import shutil
+
+import pytest
+
+from src.parser import (
+    iter_calls,
+    iter_lines,
+    list_segments,
+    pair_events,
+    parse_args,
+    parse_line,
+)
+
+
+def test_parse_line():
+    event = parse_line(
+        b"1500 {pid=10 tid=11 proc=my app}{EN pread64}{fd=3 count=4096 off=-1}\n"
+    )
+    assert event.ts == 1500
+    assert (event.pid, event.tid, event.comm) == (10, 11, "my app")
+    assert (event.kind, event.op) == ("EN", "pread64")
+    assert event.args == {"fd": 3, "count": 4096, "off": -1}
+
+
+def test_parse_line_skips_other_lines():
+    assert parse_line(b"2026-10-18 14:02:00 START tracing events for PID 10\n") is None
+    assert parse_line(b"Attaching 42 probes...\n") is None
+    assert parse_line(b"@dropped[rate, read]: 12\n") is None
+
+
+def test_parse_args_keeps_spaces_and_equals_in_paths():
+    args = parse_args(b"fname=/data/my file=1.txt fd=3")
+    assert args == {"fname": "/data/my file=1.txt", "fd": 3}
+    assert parse_args(b"") == {}
+
+
+def _events(text: str) -> list:
+    return [parse_line(line.encode()) for line in text.strip().splitlines()]
+
+
+def test_pair_events():
+    events = _events("""
+100 {pid=1 tid=1 proc=a}{EN read}{fd=3 count=10}
+105 {pid=1 tid=2 proc=a}{PA write}{fd=4 count=5 ret=5 latency=3}
+110 {pid=1 tid=1 proc=a}{EX read}{ret=10}
+120 {pid=1 tid=1 proc=a}{EX close}{ret=0}
+130 {pid=1 tid=1 proc=a}{EN read}{fd=3 count=10}
+140 {pid=1 tid=1 proc=a}{EN fork}{pid=2 comm=a}
+""")
+    calls = list(pair_events(events))
+
+    assert [(c.op, c.ret, c.latency) for c in calls] == [
+        ("write", 5, 3),
+        ("read", 10, 10),
+        ("close", 0, None),
+        ("fork", None, None),
+        ("read", None, None),  # never exited, flushed at the end
+    ]
+    assert calls[0].ts == 102 and calls[0].end == 105
+    assert calls[0].args == {"fd": 4, "count": 5}
+    assert calls[1].args == {"fd": 3, "count": 10}
+
+
+def test_pair_events_replaces_stale_enter():
+    events = _events("""
+100 {pid=1 tid=1 proc=a}{EN read}{fd=3 count=10}
+200 {pid=1 tid=1 proc=a}{EN read}{fd=4 count=10}
+210 {pid=1 tid=1 proc=a}{EX read}{ret=7}
+""")
+    calls = list(pair_events(events))
+    assert [(c.args["fd"], c.ret, c.latency) for c in calls] == [
+        (3, None, None),
+        (4, 7, 10),
+    ]
+
+
+def test_pair_events_carries_pending_across_segments(session):
+    _, lines = session
+    events = [parse_line(line) for line in lines]
+    expected = list(pair_events(events))
+
+    # cut inside calls, the enter lines of the first part wait in `pending`
+    pending = {}
+    calls = []
+    for start, end in ((0, 1234), (1234, 3001), (3001, len(events))):
+        last = end == len(events)
+        calls += pair_events(events[start:end], flush=last, pending=pending)
+        if not last:
+            assert pending
+
+    assert calls == expected
+    assert not pending
+
+
+def test_pair_events_without_pending_loses_calls(session):
+    _, lines = session
+    events = [parse_line(line) for line in lines]
+    cut = next(
+        i
+        for i, ev in enumerate(events)
+        if ev.kind == "EX" and i and events[i - 1].kind == "EN"
+    )
+
+    split = list(pair_events(events[:cut])) + list(pair_events(events[cut:]))
+    assert split != list(pair_events(events))
+
+
+def test_iter_calls_reads_rotated_segments_as_one_stream(session):
+    path, lines = session
+    expected = list(pair_events(parse_line(line) for line in lines))
+
+    assert len(list_segments(path)) == 4
+    assert list(iter_calls(path)) == expected
+    assert list(iter_calls(path, tracer="io")) == []
+
+
+def _compress_gzip(path: str) -> str:
+    with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(path)
+    return path + ".gz"
+
+
+def test_read_gzip_segments(session):
+    path, _ = session
+    segments = list_segments(path)
+    expected = list(iter_calls(path))
+    with open(segments[1], "rb") as f:
+        plain = f.read().splitlines(keepends=True)
+
+    compressed = _compress_gzip(segments[1])
+
+    assert list(iter_lines(compressed)) == plain
+    assert list_segments(path)[1] == compressed
+    assert list(iter_calls(path)) == expected
+
+
+def test_read_zstd_segments(session):
+    zstandard = pytest.importorskip("zstandard")
+    path, _ = session
+    segments = list_segments(path)
+    expected = list(iter_calls(path))
+
+    with open(segments[2], "rb") as src, open(segments[2] + ".zst", "wb") as dst:
+        zstandard.ZstdCompressor().copy_stream(src, dst)
+    os.remove(segments[2])
+
+    assert list_segments(path)[2] == segments[2] + ".zst"
+    assert list(iter_calls(path)) == expected
+
+
+def test_list_segments_prefers_the_plain_copy(session):
+    path, _ = session
+    first = list_segments(path)[0]
+    with open(first, "rb") as src, gzip.open(first + ".gz", "wb") as dst:
+        dst.write(src.read()[:100])  # a compression in progress
+
+    assert list_segments(path)[0] == first
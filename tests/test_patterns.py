@@ -0,0 +1,97 @@
+import numpy as np
+
+from src.faults import Fault
+from src.patterns import (
+    analyze,
+    expand_blocks,
+    fault_accesses,
+    miss_ratio_curve,
+    working_set,
+)
+
+SECOND = 10**9
+
+
+def _accesses(off, size=4096, file=0, ts=None) -> dict:
+    """Build the access columns of one stream of a file."""
+    n = len(off)
+    return {
+        "ts": np.arange(n, dtype=np.int64) if ts is None else np.array(ts),
+        "pid": np.ones(n, dtype=np.int64),
+        "stream": np.zeros(n, dtype=np.int64),
+        "file": np.full(n, file, dtype=np.int64),
+        "off": np.array(off, dtype=np.int64),
+        "size": np.full(n, size, dtype=np.int64),
+        "write": np.zeros(n, dtype=bool),
+        "files": np.array(["/data/a"]),
+    }
+
+
+def test_sequential_and_random_reads():
+    sequential = analyze(_accesses([i * 4096 for i in range(16)]))
+    random = analyze(_accesses([i * 4096 for i in (5, 0, 9, 2, 14, 7, 11, 3)]))
+
+    assert sequential["groups"][0]["sequential"] == 1.0
+    assert random["groups"][0]["sequential"] == 0.0
+    assert sequential["groups"][0]["name"] == "/data/a"
+    assert sequential["groups"][0]["sizes"] == {"4096": 16}
+    assert sequential["total"]["blocks"] == 16
+
+
+def test_expand_blocks():
+    # 1000 + 5000 bytes end in the second block, an empty read touches one block
+    acc = _accesses([1000, 8192, 4096], size=5000)
+    acc["size"][2] = 0
+
+    owner, block = expand_blocks(acc, 4096)
+
+    assert owner.tolist() == [0, 0, 1, 1, 2]
+    assert block.tolist() == [0, 1, 2, 3, 1]
+
+
+def test_working_set():
+    ts = np.array([0, 1, 2, 3, 10, 11]) * SECOND
+    block = np.array([0, 1, 0, 2, 0, 0])
+    group = np.array([0, 0, 1, 0, 0, 1])
+
+    footprint = working_set(ts, block, group, 2, 5 * SECOND)
+
+    assert footprint.tolist() == [[3, 0, 1], [1, 0, 1]]
+
+
+def test_miss_ratio_curve_of_a_loop():
+    # LRU misses every access of a loop over 4 blocks below 4 blocks, and none above
+    mrc = miss_ratio_curve(np.array([0, 1, 2, 3] * 50), points=16)
+
+    assert mrc[0].tolist() == [1.0, 1.0]
+    assert all(ratio == 1.0 for size, ratio in mrc if size < 4)
+    assert all(ratio == 0.0 for size, ratio in mrc if size >= 4)
+    assert mrc[-1].tolist() == [4.0, 0.0]
+
+
+def test_miss_ratio_curve_without_reuse():
+    mrc = miss_ratio_curve(np.arange(100), points=8)
+
+    assert (mrc[:, 1] == 1.0).all()
+    assert len(miss_ratio_curve(np.array([7]))) == 0
+
+
+def test_analyze_empty_accesses():
+    report = analyze(fault_accesses([]))
+
+    assert report["total"] == {"accesses": 0, "bytes": 0, "blocks": 0, "mrc": []}
+    assert report["groups"] == []
+
+
+def test_fault_accesses():
+    faults = [
+        Fault(1, 10, 10, "a", 0x10000, "/data/a", 3, None),
+        Fault(2, 10, 10, "a", 0x20000, None, None, None),
+        Fault(3, 10, 10, "a", 0x11000, "/data/b", 0, None),
+    ]
+
+    acc = fault_accesses(faults)
+
+    assert acc["off"].tolist() == [3 * 4096, 0]
+    assert acc["files"][acc["file"]].tolist() == ["/data/a", "/data/b"]
+    assert analyze(acc, by="pid")["groups"][0]["name"] == "10"
@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+from src.render import render_cached
+
+
+@pytest.mark.parametrize("entry", ["pid", "cgroups", "pods"])
+def test_path_tracking_forgets_exited_processes(tmp_path, entry):
+    targets = ["11", "12"] if entry == "cgroups" else None
+    out = render_cached(
+        entry, cache_dir=str(tmp_path), path_prefixes=["/data/"], targets=targets
+    )
+
+    assert "aggregate_trace.bt" in os.listdir(out)
+    for name in os.listdir(out):
+        with open(os.path.join(out, name)) as f:
+            script = f.read()
+        if "@fname[pid, (int64)args->ret]" not in script:
+            continue  # no open probe (e.g. memory_trace.bt)
+        assert "@fn_max[pid] = args->ret + 1;" in script
+        cleanup = script.split("/ @fn_max[pid] && curtask->signal->live.counter == 0 /")
+        assert len(cleanup) == 2
+        assert "delete(@fname[pid, $fd]);" in cleanup[1]
@@ -0,0 +1,126 @@
+import gzip
+import os
+import shutil
+
+import pytest
+
+import src.report as report
+from src.report import SessionReport, build_report, map_segment
+
+
+@pytest.fixture
+def small_ranges(monkeypatch):
+    """Split the segments into ranges of a few kilobytes, so every call can cross one."""
+    monkeypatch.setattr(report, "MIN_RANGE_SIZE", 4096)
+
+
+def _single_pass(tmp_path, lines: list[bytes]) -> dict:
+    """Report a session written as one file, read as a single range."""
+    path = os.path.join(tmp_path, "one.log")
+    with open(path, "wb") as f:
+        f.writelines(lines)
+    session = SessionReport()
+    session.add(map_segment(path))
+    summary = session.summary(top=10**9)
+    summary.pop("segments")
+    return summary
+
+
+@pytest.mark.parametrize("jobs", [1, 8])
+def test_parallel_report_matches_a_single_pass(tmp_path, session, small_ranges, jobs):
+    path, lines = session
+
+    summary = build_report(path, jobs=jobs, top=10**9)["all"]
+
+    assert summary.pop("segments") == 4
+    assert summary == _single_pass(tmp_path, lines)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_parallel_report_with_compressed_segments(
+    tmp_path, make_session, small_ranges, seed
+):
+    lines, segments = make_session(str(tmp_path), 8000, 6, seed)
+    for segment in segments[1:3]:
+        with open(segment, "rb") as src, gzip.open(segment + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(segment)
+
+    summary = build_report(str(tmp_path), jobs=4, top=10**9)["all"]
+
+    assert summary.pop("segments") == 6
+    assert summary == _single_pass(tmp_path, lines)
+
+
+def _reports(path: str, cache_dir: str) -> tuple[dict, dict]:
+    """Report a session with the cache and without it."""
+    cached = build_report(path, jobs=1, top=10**9, cache_dir=cache_dir)
+    return cached, build_report(path, jobs=1, top=10**9)
+
+
+def test_cached_report_follows_the_session(tmp_path, make_session, small_ranges):
+    out = os.path.join(tmp_path, "out")
+    cache_dir = os.path.join(tmp_path, "cache")
+    os.mkdir(out)
+    _, segments = make_session(out, 9000, 4)
+    # the session so far ends in the middle of the last segment
+    with open(segments[-1], "rb") as f:
+        last = f.readlines()
+    with open(segments[-1], "wb") as f:
+        f.writelines(last[: len(last) // 2])
+    rest = last[len(last) // 2 :]
+
+    cached, uncached = _reports(out, cache_dir)
+    assert cached == uncached
+
+    # the active segment grows
+    with open(segments[-1], "ab") as f:
+        f.writelines(rest[:500])
+    cached, uncached = _reports(out, cache_dir)
+    assert cached == uncached
+
+    # it is rotated into a new segment
+    with open(os.path.join(out, "trace_all_4.log"), "wb") as f:
+        f.writelines(rest[500:])
+    cached, uncached = _reports(out, cache_dir)
+    assert cached["all"]["segments"] == 5
+    assert cached == uncached
+
+    # the closed segments are compressed
+    for segment in segments[:2]:
+        with open(segment, "rb") as src, gzip.open(segment + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(segment)
+    cached, uncached = _reports(out, cache_dir)
+    assert cached == uncached
+
+    # and the oldest one is deleted by the retention
+    os.remove(segments[0] + ".gz")
+    cached, uncached = _reports(out, cache_dir)
+    assert cached["all"]["segments"] == 4
+    assert cached == uncached
+
+
+def test_cached_report_reads_only_new_data(tmp_path, session, monkeypatch):
+    path, _ = session
+    cache_dir = os.path.join(tmp_path, "cache")
+    build_report(path, jobs=1, cache_dir=cache_dir)
+
+    mapped = []
+
+    def counted(segment, start=0, end=None):
+        part = map_segment(segment, start, end)
+        mapped.append((os.path.basename(segment), start, part.end))
+        return part
+
+    monkeypatch.setattr(report, "map_segment", counted)
+
+    build_report(path, jobs=1, cache_dir=cache_dir)
+    assert mapped == []
+
+    last = os.path.join(path, "trace_all_3.log")
+    size = os.path.getsize(last)
+    with open(last, "ab") as f:
+        f.write(b"2000000000 {pid=100 tid=100 proc=c100}{EN close}{fd=3}\n")
+    build_report(path, jobs=1, cache_dir=cache_dir)
+    assert mapped == [("trace_all_3.log", size, os.path.getsize(last))]
@@ -0,0 +1,156 @@
+import gzip
+import os
+import time
+
+import pytest
+
+from src.index import index_path
+from src.parser import iter_lines, list_segments
+from src.segments import (
+    SegmentWriter,
+    compress_segment,
+    enforce_retention,
+    finish_segment,
+)
+
+
+def _session(out_dir: str, make_session, tracers=("io", "memory"), segments=5):
+    """Write the segments of some tracers, closed in turn one second apart.
+
+    :return: every segment path, oldest first
+    """
+    paths = []
+    for t, tracer in enumerate(tracers):
+        _, chain = make_session(out_dir, 500 * segments, segments, seed=t)
+        for i, path in enumerate(chain):
+            renamed = os.path.join(out_dir, f"trace_{tracer}_{i}.log")
+            os.replace(path, renamed)
+            paths.append((i, t, renamed))
+    paths = [path for _, _, path in sorted(paths)]
+    now = time.time()
+    for age, path in enumerate(reversed(paths)):
+        os.utime(path, (now - age, now - age))
+    return paths
+
+
+def _left(out_dir: str) -> list[str]:
+    return sorted(os.path.basename(path) for path in list_segments(out_dir))
+
+
+def test_retention_by_count_removes_the_oldest(tmp_path, make_session):
+    out = str(tmp_path)
+    paths = _session(out, make_session)
+
+    enforce_retention(out, max_segments=6)
+
+    assert _left(out) == sorted(os.path.basename(path) for path in paths[-6:])
+
+
+def test_retention_by_size_removes_the_oldest(tmp_path, make_session):
+    out = str(tmp_path)
+    paths = _session(out, make_session)
+    sizes = [os.path.getsize(path) for path in paths]
+    # room for the 3 newest segments and part of the 4th one
+    limit = sum(sizes[-3:]) + sizes[-4] // 2
+
+    enforce_retention(out, max_bytes=limit)
+
+    assert _left(out) == sorted(os.path.basename(path) for path in paths[-3:])
+
+
+def test_retention_keeps_the_active_segments(tmp_path, make_session):
+    out = str(tmp_path)
+    _session(out, make_session)
+
+    enforce_retention(out, max_bytes=1, max_segments=1)
+
+    # the limits cannot be met, the last segment of each tracer may be written
+    assert _left(out) == ["trace_io_4.log", "trace_memory_4.log"]
+
+
+def test_retention_removes_the_index(tmp_path, make_session):
+    out = str(tmp_path)
+    paths = _session(out, make_session, tracers=("io",), segments=3)
+    for path in paths:
+        finish_segment(path)
+    assert all(os.path.exists(index_path(path)) for path in paths)
+
+    enforce_retention(out, max_segments=2)
+
+    assert not os.path.exists(paths[0]) and not os.path.exists(index_path(paths[0]))
+    assert os.path.exists(index_path(paths[1]))
+
+
+def test_retention_counts_a_compressed_copy_once(tmp_path, make_session):
+    out = str(tmp_path)
+    paths = _session(out, make_session, tracers=("io",), segments=4)
+    # a compression in progress: the plain segment and its compressed copy
+    with open(paths[1], "rb") as src, gzip.open(paths[1] + ".gz", "wb") as dst:
+        dst.write(src.read())
+    os.utime(paths[1] + ".gz", (os.path.getmtime(paths[1]),) * 2)
+    compress_segment(paths[0], "gzip")
+
+    enforce_retention(out, max_segments=4)
+    assert _left(out) == ["trace_io_0.log.gz", "trace_io_1.log"] + [
+        os.path.basename(path) for path in paths[2:]
+    ]
+
+    enforce_retention(out, max_segments=3)
+    assert _left(out) == [os.path.basename(path) for path in paths[1:]]
+
+
+@pytest.mark.parametrize("codec", ["gzip", "zstd"])
+def test_finish_segment_compresses(tmp_path, make_session, codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    out = str(tmp_path)
+    paths = _session(out, make_session, tracers=("io",), segments=2)
+    with open(paths[0], "rb") as f:
+        lines = f.read().splitlines(keepends=True)
+    mtime = os.path.getmtime(paths[0])
+
+    finish_segment(paths[0], codec=codec)
+
+    compressed = list_segments(out)[0]
+    assert compressed == paths[0] + (".gz" if codec == "gzip" else ".zst")
+    assert not os.path.exists(paths[0])
+    assert os.path.getmtime(compressed) == mtime
+    assert os.path.exists(index_path(compressed))
+    assert list(iter_lines(compressed)) == lines
+
+
+def test_writer_rotates_on_line_boundaries(tmp_path, session):
+    _, lines = session
+    out = os.path.join(tmp_path, "out")
+    os.mkdir(out)
+    data = b"".join(lines)
+
+    writer = SegmentWriter(out, "io", rotate_size=10_000, index=False)
+    for i in range(0, len(data), 3000):
+        writer.write(data[i : i + 3000])
+    writer.close()
+
+    segments = list_segments(out)
+    assert len(segments) > 1
+    for path in segments:
+        with open(path, "rb") as f:
+            content = f.read()
+        assert len(content) <= 10_000
+        assert content.endswith(b"\n")
+    assert [line for path in segments for line in iter_lines(path)] == lines
+
+
+def test_writer_rotates_old_segments(tmp_path):
+    writer = SegmentWriter(str(tmp_path), "io", rotate_interval=0.05, index=False)
+    writer.write(b"1 {pid=1 tid=1 proc=a}{EN read}{fd=3}\n2 {pid=1 ")
+    time.sleep(0.1)
+    # the open line is finished in the old segment
+    writer.write(
+        b"tid=1 proc=a}{EX read}{ret=1}\n3 {pid=1 tid=1 proc=a}{EN close}{fd=3}\n"
+    )
+    writer.close()
+
+    assert [len(list(iter_lines(path))) for path in list_segments(str(tmp_path))] == [
+        2,
+        1,
+    ]
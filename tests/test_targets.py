@@ -0,0 +1,60 @@
+import os
+
+from src.targets import export_targets, load_targets, pid_targets, split_by_target
+
+
+def _write(path: str, lines: list[str]):
+    with open(path, "w") as f:
+        f.writelines(line + "\n" for line in lines)
+
+
+def test_split_by_target_follows_a_reused_pid(tmp_path):
+    out = os.path.join(tmp_path, "out")
+    os.mkdir(out)
+    export_targets(
+        out,
+        [
+            {"name": "default/web-1/app", "id": "11"},
+            {"name": "default/web-2/app", "id": "12"},
+        ],
+    )
+    _write(
+        os.path.join(out, "trace_io_0.log"),
+        [
+            "2026-10-18 14:02:00 START tracing events for 2 pods",
+            "100 {pid=7 tid=7 proc=web}{EN target}{target=1}",
+            "110 {pid=7 tid=7 proc=web}{EN read}{fd=3 count=10}",
+            "120 {pid=8 tid=8 proc=web}{EN target}{target=2}",
+            "130 {pid=8 tid=8 proc=web}{EN write}{fd=4 count=5}",
+            "140 {pid=7 tid=7 proc=web}{EX process}{}",
+        ],
+    )
+    # the first pod is gone, the second one got its pid (after a rotation)
+    _write(
+        os.path.join(out, "trace_io_1.log"),
+        [
+            "200 {pid=7 tid=7 proc=web}{EN target}{target=2}",
+            "210 {pid=7 tid=7 proc=web}{EN read}{fd=5 count=10}",
+            "220 {pid=9 tid=9 proc=other}{EN read}{fd=3 count=10}",
+        ],
+    )
+
+    assert pid_targets(out) == {7: "default/web-2/app", 8: "default/web-2/app"}
+
+    split = os.path.join(tmp_path, "split")
+    counts = split_by_target(out, split)
+
+    assert counts == {"default/web-1/app": 2, "default/web-2/app": 2}
+    with open(os.path.join(split, "default_web-1_app", "trace_io_0.log")) as f:
+        assert [line.split(" ", 1)[0] for line in f] == ["110", "140"]
+    with open(os.path.join(split, "default_web-2_app", "trace_io_0.log")) as f:
+        assert [line.split(" ", 1)[0] for line in f] == ["130", "210"]
+
+
+def test_targets_file(tmp_path):
+    assert load_targets(str(tmp_path)) == []
+
+    targets = [{"name": "default/web-1/app", "id": "11", "started": 1.5}]
+    export_targets(str(tmp_path), targets)
+    assert load_targets(str(tmp_path)) == targets
+    assert os.listdir(tmp_path) == ["targets.json"]
@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from src.tracer import MonoTracer, RotateTracer
+
+_OUTPUT = (
+    b"10 {pid=1 tid=1 proc=a}{EN read}{fd=3}\n"
+    b"Lost 12 events\n"
+    b'{"type": "lost_events", "data": {"events": 30}}\n'
+    b"20 {pid=1 tid=1 proc=a}{EX read}{ret=1}\n"
+)
+
+
+@pytest.mark.parametrize("cut", range(1, len(_OUTPUT)))
+def test_rotate_tracer_counts_split_lost_reports(tmp_path, cut):
+    tracer = RotateTracer("io", "io_trace.bt", str(tmp_path))
+
+    tracer._count_lost_lines(1, _OUTPUT[:cut])
+    tracer._count_lost_lines(2, b"Lost 1")  # another stream, never finished
+    tracer._count_lost_lines(1, _OUTPUT[cut:])
+    tracer._count_lost_lines(1, b"")
+
+    assert tracer._lost_events == 42
+
+
+def test_rotate_tracer_counts_the_last_line_at_the_end(tmp_path):
+    tracer = RotateTracer("io", "io_trace.bt", str(tmp_path))
+
+    tracer._count_lost_lines(1, b"Lost 3 events")
+    assert tracer._lost_events == 0
+    tracer._count_lost_lines(1, b"")
+    assert tracer._lost_events == 3
+
+
+@pytest.mark.parametrize("cut", [5, 45, 60, 100])
+def test_mono_tracer_counts_complete_lines(tmp_path, cut):
+    tracer = MonoTracer("io", "io_trace.bt", str(tmp_path))
+    path = os.path.join(tmp_path, "trace_io_0.log")
+
+    with open(path, "wb") as f:
+        f.write(_OUTPUT[:cut])
+    first = tracer.metrics()
+    with open(path, "ab") as f:
+        f.write(_OUTPUT[cut:])
+
+    assert first["bytes"] == cut
+    assert tracer.metrics() == {"bytes": len(_OUTPUT), "lost_events": 42}